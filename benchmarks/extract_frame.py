@@ -0,0 +1,64 @@
+"""
+Compares the latency of exact and fast frame extraction on an H.264 video
+with a long interval between keyframes.
+
+Usage: python benchmarks/extract_frame.py [--duration SECONDS] [--gop FRAMES] [--repeat N]
+"""
+import argparse
+import io
+import os
+import statistics
+import subprocess
+import tempfile
+import time
+
+from madam.ffmpeg import FFmpegProcessor
+from madam.future import subprocess_run
+
+
+def create_video(path, duration, gop, width=1280, height=720, rate=30):
+    command = ['ffmpeg', '-loglevel', 'error',
+               '-f', 'lavfi', '-i', 'testsrc=size=%dx%d:rate=%d:duration=%d' % (width, height, rate, duration),
+               '-c:v', 'libx264', '-preset', 'ultrafast', '-g', str(gop), '-keyint_min', str(gop),
+               '-sc_threshold', '0', '-f', 'mp4', '-y', path]
+    subprocess_run(command, check=True, stderr=subprocess.PIPE)
+
+
+def measure(operator, asset, repeat):
+    latencies = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        operator(asset)
+        latencies.append(time.perf_counter() - start_time)
+    return statistics.median(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--duration', type=int, default=60, help='Duration of the test video in seconds')
+    parser.add_argument('--gop', type=int, default=600, help='Number of frames between keyframes')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of measurements per mode')
+    args = parser.parse_args()
+
+    processor = FFmpegProcessor()
+    with tempfile.TemporaryDirectory(prefix='madam') as tmpdir_path:
+        video_path = os.path.join(tmpdir_path, 'long_gop.mp4')
+        create_video(video_path, args.duration, args.gop)
+        with open(video_path, 'rb') as video_file:
+            asset = processor.read(io.BytesIO(video_file.read()))
+
+    seconds = asset.duration*0.9
+    modes = [
+        ('exact', processor.extract_frame(mime_type='image/jpeg', seconds=seconds)),
+        ('fast', processor.extract_frame(mime_type='image/jpeg', seconds=seconds, fast=True)),
+        ('fast, 320x180', processor.extract_frame(mime_type='image/jpeg', seconds=seconds, fast=True,
+                                                  width=320, height=180)),
+    ]
+    print('Frame at %.1f s of a %d s video with %d frames per GOP (median of %d runs):'
+          % (seconds, args.duration, args.gop, args.repeat))
+    for name, operator in modes:
+        print('  %-16s %8.1f ms' % (name, measure(operator, asset, args.repeat)*1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Measures the stored size and the throughput of ShelveStorage with different
+compression codecs.
+
+Usage: python benchmarks/storage_compression.py [--duration SECONDS] [--repeat N]
+"""
+import argparse
+import io
+import math
+import os
+import random
+import struct
+import tempfile
+import time
+import wave
+
+import PIL.Image
+
+from madam.core import Asset, ShelveStorage
+
+
+def create_wav(duration, rate=44100):
+    samples = [int(8000*math.sin(2*math.pi*440*index/rate)) for index in range(int(duration*rate))]
+    essence = io.BytesIO()
+    with wave.open(essence, 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(rate)
+        wav_file.writeframes(struct.pack('<%dh' % len(samples), *samples))
+    essence.seek(0)
+    return Asset(essence, mime_type='audio/wav')
+
+
+def create_svg(shapes=10000):
+    rng = random.Random(0)
+    circles = ''.join('<circle cx="%d" cy="%d" r="%d" fill="#%06x"/>\n'
+                      % (rng.randrange(1000), rng.randrange(1000), rng.randrange(1, 50), rng.randrange(1 << 24))
+                      for _ in range(shapes))
+    svg = '<svg xmlns="http://www.w3.org/2000/svg" width="1000" height="1000">\n%s</svg>\n' % circles
+    return Asset(io.BytesIO(svg.encode('utf-8')), mime_type='image/svg+xml')
+
+
+def create_png(width=1024, height=1024):
+    image = PIL.Image.frombytes('RGB', (width, height), os.urandom(width*height*3))
+    essence = io.BytesIO()
+    image.save(essence, 'PNG')
+    essence.seek(0)
+    return Asset(essence, mime_type='image/png')
+
+
+def stored_size(path):
+    directory, name = os.path.split(path)
+    return sum(os.path.getsize(os.path.join(directory, file_name)) for file_name in os.listdir(directory)
+               if file_name.startswith(name + '.') and not file_name.endswith('.lock'))
+
+
+def measure(asset, codec, repeat):
+    with tempfile.TemporaryDirectory(prefix='madam') as tmpdir_path:
+        path = os.path.join(tmpdir_path, 'storage.shelve')
+        storage = ShelveStorage(path, compression=codec)
+        items = {'asset%d' % index: (asset, None) for index in range(repeat)}
+        start_time = time.perf_counter()
+        storage.put_many(items)
+        write_time = time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        storage.get_many(items)
+        read_time = time.perf_counter() - start_time
+        return stored_size(path)/repeat, write_time, read_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--duration', type=int, default=30, help='Duration of the WAV asset in seconds')
+    parser.add_argument('--repeat', type=int, default=10, help='Number of copies of each asset that are stored')
+    args = parser.parse_args()
+
+    assets = [
+        ('WAV %d s' % args.duration, create_wav(args.duration)),
+        ('SVG', create_svg()),
+        ('PNG (noise)', create_png()),
+    ]
+    print('%-12s %-6s %10s %12s %12s' % ('type', 'codec', 'stored', 'write', 'read'))
+    for name, asset in assets:
+        megabytes = len(asset._essence_data)*args.repeat/1e6
+        for codec in (None, 'zlib', 'lzma', 'bz2'):
+            size, write_time, read_time = measure(asset, codec, args.repeat)
+            print('%-12s %-6s %7.2f MB %7.0f MB/s %7.0f MB/s'
+                  % (name, codec or 'none', size/1e6, megabytes/write_time, megabytes/read_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,33 @@
 import abc
+import asyncio
+import bz2
+import collections
+import contextlib
+import dbm
+import fcntl
 import functools
+import hashlib
 import io
 import importlib
+import itertools
+import json
+import logging
+import lzma
+import math
 import os
+import pickle
+import queue
+import re
+import resource
 import shelve
 import shutil
+import sys
+import tempfile
+import threading
+import time
+import zlib
 from collections.abc import MutableMapping
+from concurrent.futures import Executor, FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
 
 from frozendict import frozendict
 
@@ -190,7 +212,34 @@ class AssetStorage(MutableMapping):
 
     The persistence guarantees for stored data may differ based on the
     respective storage implementation.
+
+    Secondary indexes can be added to a storage using
+    :func:`~madam.core.AssetStorage.add_index`. The storage keeps the indexes
+    up to date whenever assets are added or removed, which allows to query
+    assets without reading the whole storage.
     """
+    def __init__(self):
+        """
+        Initializes a new AssetStorage without indexes.
+        """
+        self._indexes = {}
+        self._in_memory_index_stores = {}
+
+    @property
+    def indexes(self):
+        """
+        Dictionary mapping names to the secondary indexes of this storage.
+
+        The dictionary is created on first access, so that subclasses which do
+        not call :func:`~madam.core.AssetStorage.__init__` support indexes and
+        bulk operations as well.
+        """
+        return vars(self).setdefault('_indexes', {})
+
+    @property
+    def _index_stores(self):
+        return vars(self).setdefault('_in_memory_index_stores', {})
+
     def filter(self, **kwargs):
         """
         Returns a sequence of asset keys whose assets match the criteria that are
@@ -217,6 +266,176 @@ class AssetStorage(MutableMapping):
         return set(asset_key for asset_key, (asset, asset_tags) in self.items()
                    if search_tags <= asset_tags)
 
+    def get_many(self, asset_keys):
+        """
+        Returns the :class:`~madam.core.Asset` objects and the associated tags
+        for all of the specified keys.
+
+        :param asset_keys: Keys of the assets to be returned
+        :return: Dictionary mapping each asset key to a tuple of the asset and its tags
+        :raise KeyError: if one of the keys does not exist in this storage
+        """
+        return {asset_key: self[asset_key] for asset_key in asset_keys}
+
+    def put_many(self, assets_and_tags):
+        """
+        Stores multiple :class:`~madam.core.Asset` objects in this asset storage.
+
+        The assets are specified either as a mapping or as an iterable of pairs.
+        Each asset key is associated with a tuple of the asset and its tags,
+        just like in :func:`~madam.core.AssetStorage.__setitem__`.
+
+        :param assets_and_tags: Asset keys and tuples of assets and tags
+        """
+        for asset_key, asset_and_tags in _pairs(assets_and_tags):
+            self[asset_key] = asset_and_tags
+
+    def delete_many(self, asset_keys):
+        """
+        Removes the :class:`~madam.core.Asset` objects with the specified keys
+        from this asset storage, as well as all associated data (e.g. tags).
+
+        No asset will be removed if one of the keys does not exist.
+
+        :param asset_keys: Keys of the assets to be removed
+        :raise KeyError: if one of the keys does not exist in this storage
+        """
+        asset_keys = list(asset_keys)
+        _raise_for_missing_keys(self.contains_many(asset_keys))
+        for asset_key in asset_keys:
+            del self[asset_key]
+
+    def contains_many(self, asset_keys):
+        """
+        Returns whether assets with the specified keys are stored in this
+        asset storage.
+
+        :param asset_keys: Keys of the assets that should be tested
+        :return: Dictionary mapping each asset key to `True` if the key exists, `False` otherwise
+        """
+        return {asset_key: asset_key in self for asset_key in asset_keys}
+
+    def add_index(self, name, index, rebuild=False):
+        """
+        Adds a secondary index to this storage.
+
+        All assets in the storage are indexed immediately, unless the storage
+        already contains persisted data for an index with the specified name.
+        Afterwards, the index is updated whenever assets are added or removed.
+
+        :param name: Unique name of the index
+        :param index: Index to be added
+        :type index: AssetIndex
+        :param rebuild: Whether existing index data should be discarded and rebuilt
+        """
+        self.indexes[name] = index
+        if rebuild or not self._index_exists(name):
+            self._rebuild_index(name)
+
+    def query_index(self, name, *args, **kwargs):
+        """
+        Returns the keys of the assets that match a query on the index with
+        the specified name, ordered by relevance.
+
+        The query arguments depend on the type of the index. See the `query`
+        method of the respective :class:`~madam.core.AssetIndex`.
+
+        :param name: Name of the index
+        :return: List of tuples of asset keys and scores
+        :raise KeyError: if no index with the specified name exists
+        """
+        index = self.indexes[name]
+        return index.rank(self._query_index(name, *args, **kwargs))
+
+    @contextlib.contextmanager
+    def _index_store(self, name, writable=False):
+        """
+        Returns the mapping that holds the data of the index with the specified name.
+
+        Storages without persistent indexes keep the index data in memory.
+
+        :param name: Name of the index
+        :param writable: Whether the index data will be modified
+        """
+        yield self._index_stores.setdefault(name, {})
+
+    def _index_exists(self, name):
+        """
+        Returns whether data for the index with the specified name already exists.
+
+        :param name: Name of the index
+        :return: `True` if the index data exists, `False` otherwise
+        """
+        return name in self._index_stores
+
+    def _rebuild_index(self, name):
+        """
+        Discards the data of the index with the specified name and indexes all
+        assets in this storage.
+
+        :param name: Name of the index
+        """
+        index = self.indexes[name]
+        with self._index_store(name, writable=True) as index_store:
+            index_store.clear()
+            for asset_key, (asset, tags) in self.items():
+                index.add(index_store, asset_key, asset, tags)
+
+    def _update_indexes(self, changes):
+        """
+        Updates all indexes of this storage.
+
+        Each change is a tuple of an asset key and either a tuple of the new
+        asset and its tags, or `None` if the asset was removed.
+
+        :param changes: Iterable of changed assets
+        """
+        if not self.indexes:
+            return
+        changes = list(changes)
+        for name, index in self.indexes.items():
+            with self._index_store(name, writable=True) as index_store:
+                for asset_key, asset_and_tags in changes:
+                    index.remove(index_store, asset_key)
+                    if asset_and_tags is not None:
+                        asset, tags = asset_and_tags
+                        index.add(index_store, asset_key, asset, tags)
+
+    def _query_index(self, name, *args, **kwargs):
+        """
+        Returns the unordered results of a query on the index with the specified name.
+
+        :param name: Name of the index
+        :return: List of tuples of asset keys and scores
+        """
+        index = self.indexes[name]
+        with self._index_store(name) as index_store:
+            return index.query(index_store, *args, **kwargs)
+
+
+def _pairs(mapping_or_pairs):
+    """
+    Returns an iterable of key-value pairs for a mapping or an iterable of pairs.
+
+    :param mapping_or_pairs: Mapping or iterable of key-value pairs
+    :return: Iterable of key-value pairs
+    """
+    if hasattr(mapping_or_pairs, 'items'):
+        return mapping_or_pairs.items()
+    return mapping_or_pairs
+
+
+def _raise_for_missing_keys(contains_by_key):
+    """
+    Raises an error if one of the keys is marked as missing.
+
+    :param contains_by_key: Mapping of asset keys to whether they exist in a storage
+    :raise KeyError: if the mapping contains a key that does not exist
+    """
+    missing_keys = [asset_key for asset_key, contained in contains_by_key.items() if not contained]
+    if missing_keys:
+        raise KeyError('Assets with keys %r cannot be found in storage' % missing_keys)
+
 
 class InMemoryStorage(AssetStorage):
     """
@@ -229,6 +448,7 @@ class InMemoryStorage(AssetStorage):
         """
         Initializes a new, empty InMemoryStorage object.
         """
+        super().__init__()
         self.store = {}
 
     def __setitem__(self, asset_key, asset_and_tags):
@@ -248,6 +468,7 @@ class InMemoryStorage(AssetStorage):
         if not tags:
             tags = frozenset()
         self.store[asset_key] = (asset, frozenset(tags))
+        self._update_indexes([(asset_key, self.store[asset_key])])
 
     def __getitem__(self, asset_key):
         """
@@ -275,6 +496,7 @@ class InMemoryStorage(AssetStorage):
         if asset_key not in self.store:
             raise KeyError('Asset with key %r cannot be found in storage' % asset_key)
         del self.store[asset_key]
+        self._update_indexes([(asset_key, None)])
 
     def __contains__(self, asset_key):
         """
@@ -300,6 +522,125 @@ class InMemoryStorage(AssetStorage):
         """
         return len(self.store)
 
+    def get_many(self, asset_keys):
+        asset_keys = list(asset_keys)
+        _raise_for_missing_keys(self.contains_many(asset_keys))
+        return {asset_key: self.store[asset_key] for asset_key in asset_keys}
+
+    def put_many(self, assets_and_tags):
+        items = [(asset_key, (asset, frozenset(tags or ())))
+                 for asset_key, (asset, tags) in _pairs(assets_and_tags)]
+        self.store.update(items)
+        self._update_indexes(items)
+
+    def delete_many(self, asset_keys):
+        asset_keys = list(asset_keys)
+        _raise_for_missing_keys(self.contains_many(asset_keys))
+        for asset_key in asset_keys:
+            del self.store[asset_key]
+        self._update_indexes((asset_key, None) for asset_key in asset_keys)
+
+    def contains_many(self, asset_keys):
+        return {asset_key: asset_key in self.store for asset_key in asset_keys}
+
+
+class _ZlibReader(io.RawIOBase):
+    """
+    Represents a file-like object that decompresses a zlib stream read from
+    another file-like object.
+    """
+    def __init__(self, file, chunk_size=64*1024):
+        """
+        Initializes a new _ZlibReader.
+
+        :param file: File-like object with zlib compressed data
+        :param chunk_size: Number of compressed bytes that are read at once
+        """
+        super().__init__()
+        self._file = file
+        self._chunk_size = chunk_size
+        self._decompressor = zlib.decompressobj()
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = b''
+        while not data and not self._decompressor.eof:
+            compressed_data = self._decompressor.unconsumed_tail or self._file.read(self._chunk_size)
+            if not compressed_data:
+                raise EOFError('Compressed data ended before the end of the zlib stream')
+            data = self._decompressor.decompress(compressed_data, len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+#: Compression codecs for essences in persistent storages. Each codec is
+#: defined by a function that compresses bytes and a function that returns
+#: a decompressing file-like object for a compressed file-like object. The
+#: codec ``'zlib'`` stores a raw zlib stream as described in RFC 1950.
+_COMPRESSION_CODECS = {
+    'zlib': (zlib.compress, _ZlibReader),
+    'lzma': (lzma.compress, lambda file: lzma.LZMAFile(file, mode='rb')),
+    'bz2': (bz2.compress, lambda file: bz2.BZ2File(file, mode='rb')),
+}
+
+#: MIME types whose essence is already compressed and does not benefit from
+#: storage-level compression
+COMPRESSED_MIME_TYPES = frozenset([
+    'application/gzip',
+    'application/zip',
+    'audio/aac',
+    'audio/mpeg',
+    'audio/ogg',
+    'audio/opus',
+    'image/gif',
+    'image/jpeg',
+    'image/webp',
+    'video/mp4',
+    'video/ogg',
+    'video/quicktime',
+    'video/webm',
+    'video/x-matroska',
+])
+
+
+#: Maximum ratio of compressed to uncompressed size for which essences are
+#: stored compressed
+MAX_COMPRESSION_RATIO = 0.9
+
+#: Size in bytes of the leading part of an essence that is compressed to
+#: estimate whether compressing the whole essence pays off
+_COMPRESSION_SAMPLE_SIZE = 64*1024
+
+
+class _CompressedAsset:
+    """
+    Represents the serialized form of an :class:`~madam.core.Asset` whose
+    essence is compressed.
+    """
+    def __init__(self, codec, compressed_essence, metadata):
+        """
+        Initializes a new _CompressedAsset.
+
+        :param codec: Name of the compression codec
+        :param compressed_essence: Compressed essence data
+        :param metadata: Metadata of the asset
+        """
+        self.codec = codec
+        self.compressed_essence = compressed_essence
+        self.metadata = metadata
+
+    def decompress(self):
+        """
+        Returns the asset with decompressed essence.
+
+        :return: Asset with decompressed essence
+        """
+        _, open_decompressed = _COMPRESSION_CODECS[self.codec]
+        with open_decompressed(io.BytesIO(self.compressed_essence)) as essence:
+            return Asset(essence, **self.metadata)
+
 
 class ShelveStorage(AssetStorage):
     """
@@ -307,16 +648,162 @@ class ShelveStorage(AssetStorage):
     objects. Asset keys must be strings.
 
     ShelveStorage uses a file on the file system to serialize Assets.
+
+    Access to the file is coordinated using a lock file next to the storage
+    file. Read operations hold a shared lock and write operations hold an
+    exclusive lock, so that multiple threads or processes can read at the same
+    time while writers wait for each other.
+
+    Essences can optionally be compressed before they are written. The
+    compression codec is chosen by the MIME type of the asset and is stored
+    along with the compressed data, so that a storage can be read regardless
+    of its current compression settings. Supported codecs are ``'zlib'``,
+    ``'lzma'``, and ``'bz2'``.
     """
-    def __init__(self, path):
+    def __init__(self, path, lock_timeout=None, compression=None):
         """
         Initializes a new ShelveStorage with the specified path.
 
+        The `compression` argument is either `None` to disable compression,
+        the name of a codec that is used for all MIME types except those in
+        :data:`~madam.core.COMPRESSED_MIME_TYPES`, or a mapping of MIME types to
+        codec names. Essences are stored uncompressed if compression does not
+        reduce their size to :data:`~madam.core.MAX_COMPRESSION_RATIO` or less.
+
         :param path: File system path where the data should be stored
+        :param lock_timeout: Maximum time in seconds to wait for the lock of
+               the storage file, or `None` to wait indefinitely
+        :param compression: Compression codec or mapping of MIME types to compression codecs
         """
         if os.path.exists(path) and not os.path.isfile(path):
             raise ValueError('The storage path %r is not a file.' % path)
+        if isinstance(compression, str):
+            codecs = {compression}
+        else:
+            codecs = set((compression or {}).values()) - {None}
+        unknown_codecs = codecs - _COMPRESSION_CODECS.keys()
+        if unknown_codecs:
+            raise ValueError('Unsupported compression codecs: %r' % sorted(unknown_codecs))
+        super().__init__()
         self.path = path
+        self.lock_path = path + '.lock'
+        self.lock_timeout = lock_timeout
+        self.lock_statistics = LockStatistics()
+        self.compression = compression
+
+    def _compression_codec(self, mime_type):
+        """
+        Returns the name of the compression codec for the specified MIME type.
+
+        :param mime_type: MIME type of an asset
+        :return: Name of the codec, or `None` if the essence should not be compressed
+        """
+        if isinstance(self.compression, str):
+            if mime_type in COMPRESSED_MIME_TYPES:
+                return None
+            return self.compression
+        return (self.compression or {}).get(mime_type)
+
+    def _pack(self, asset):
+        """
+        Returns the object that is written to the storage file for the specified asset.
+
+        :param asset: Asset to be stored
+        :return: Asset or compressed asset
+        """
+        codec = self._compression_codec(asset.mime_type)
+        if codec is None:
+            return asset
+        compress, _ = _COMPRESSION_CODECS[codec]
+        essence_data = asset._essence_data
+        if len(essence_data) > _COMPRESSION_SAMPLE_SIZE:
+            # Skip incompressible essences without compressing all of their data
+            sample = essence_data[:_COMPRESSION_SAMPLE_SIZE]
+            if len(compress(sample)) > MAX_COMPRESSION_RATIO*len(sample):
+                return asset
+        compressed_essence = compress(essence_data)
+        if len(compressed_essence) > MAX_COMPRESSION_RATIO*len(essence_data):
+            return asset
+        return _CompressedAsset(codec, compressed_essence, dict(asset.metadata))
+
+    @staticmethod
+    def _unpack(asset_and_tags):
+        """
+        Returns the asset and tags for an object that was read from the storage file.
+
+        :param asset_and_tags: Tuple of a stored asset and the associated tags
+        :return: Tuple of the asset and the associated tags
+        """
+        asset, tags = asset_and_tags
+        if isinstance(asset, _CompressedAsset):
+            asset = asset.decompress()
+        return asset, tags
+
+    @contextlib.contextmanager
+    def _open(self, writable=False):
+        """
+        Opens the storage file while holding the lock of the storage.
+
+        Read-only access uses a shared lock, write access uses an exclusive
+        lock. An empty mapping is returned for read-only access when the
+        storage file does not exist yet.
+
+        :param writable: Whether the storage file is opened for writing
+        :raise LockTimeoutError: if the lock cannot be acquired within the lock timeout
+        """
+        with _file_lock(self.lock_path, shared=not writable, timeout=self.lock_timeout,
+                        statistics=self.lock_statistics):
+            if not writable and dbm.whichdb(self.path) is None:
+                yield {}
+                return
+            with shelve.open(self.path, flag='c' if writable else 'r') as store:
+                yield store
+
+    def _index_path(self, name):
+        """
+        Returns the file system path where the data of the index with the
+        specified name is stored.
+
+        :param name: Name of the index
+        :return: Path of the index file
+        """
+        return '%s.%s.index' % (self.path, name)
+
+    @contextlib.contextmanager
+    def _index_store(self, name, writable=False):
+        """
+        Opens the file of the index with the specified name.
+
+        The caller must hold the lock of the storage.
+
+        :param name: Name of the index
+        :param writable: Whether the index file is opened for writing
+        """
+        index_path = self._index_path(name)
+        if not writable and dbm.whichdb(index_path) is None:
+            yield {}
+            return
+        with shelve.open(index_path, flag='c' if writable else 'r', writeback=writable) as index_store:
+            yield index_store
+
+    def _index_exists(self, name):
+        with self._open():
+            return dbm.whichdb(self._index_path(name)) is not None
+
+    def _rebuild_index(self, name):
+        index = self.indexes[name]
+        with self._open(writable=True) as store:
+            with self._index_store(name, writable=True) as index_store:
+                index_store.clear()
+                for asset_key, record in store.items():
+                    asset, tags = self._unpack(record)
+                    index.add(index_store, asset_key, asset, tags)
+
+    def _query_index(self, name, *args, **kwargs):
+        index = self.indexes[name]
+        with self._open():
+            with self._index_store(name) as index_store:
+                return index.query(index_store, *args, **kwargs)
 
     def __setitem__(self, asset_key, asset_and_tags):
         """
@@ -334,8 +821,10 @@ class ShelveStorage(AssetStorage):
         asset, tags = asset_and_tags
         if not tags:
             tags = frozenset()
-        with shelve.open(self.path) as store:
-            store[asset_key] = (asset, tags)
+        record = self._pack(asset)
+        with self._open(writable=True) as store:
+            store[asset_key] = (record, tags)
+            self._update_indexes([(asset_key, (asset, tags))])
 
     def __getitem__(self, asset_key):
         """
@@ -348,10 +837,11 @@ class ShelveStorage(AssetStorage):
         :return: A tuple containing an asset and a set the tags associated with the asset
         :raise KeyError: if the key does not exist in this storage
         """
-        with shelve.open(self.path) as store:
+        with self._open() as store:
             if asset_key not in store:
                 raise KeyError('Asset with key %r cannot be found in storage' % asset_key)
-            return store[asset_key]
+            record = store[asset_key]
+        return self._unpack(record)
 
     def __delitem__(self, asset_key):
         """
@@ -361,10 +851,11 @@ class ShelveStorage(AssetStorage):
         :param asset_key: Key of the asset to be removed
         :raise KeyError: if the key does not exist in this storage
         """
-        with shelve.open(self.path) as store:
+        with self._open(writable=True) as store:
             if asset_key not in store:
                 raise KeyError('Asset with key %r cannot be found in storage' % asset_key)
             del store[asset_key]
+            self._update_indexes([(asset_key, None)])
 
     def __contains__(self, asset_key):
         """
@@ -373,7 +864,7 @@ class ShelveStorage(AssetStorage):
         :param asset_key: Key of the asset that should be tested
         :return: `True` if the key exists, `False` otherwise
         """
-        with shelve.open(self.path) as store:
+        with self._open() as store:
             return asset_key in store
 
     def __iter__(self):
@@ -382,7 +873,7 @@ class ShelveStorage(AssetStorage):
         in this asset storage.
         :return: Iterator object
         """
-        with shelve.open(self.path) as store:
+        with self._open() as store:
             return iter(list(store.keys()))
 
     def __len__(self):
@@ -390,180 +881,1869 @@ class ShelveStorage(AssetStorage):
         Returns the number of assets in this storage.
         :return: Number of assets in this storage
         """
-        with shelve.open(self.path) as store:
+        with self._open() as store:
             return len(store)
 
-
-def _immutable(value):
-    """
-    Creates a read-only version from the specified value.
-
-    Dictionaries, lists, and sets will be handled recursively.
-
-    :param value: Value to be transformed into a read-only version
-    :return: Read-only value
-    """
-    if isinstance(value, dict):
-        return frozendict({k: _immutable(v) for k, v in value.items()})
-    elif isinstance(value, set):
-        return frozenset({_immutable(v) for v in value})
-    elif isinstance(value, list):
-        return tuple([_immutable(v) for v in value])
-    else:
-        return value
-
-
-class Asset:
+    def get_many(self, asset_keys):
+        asset_keys = list(asset_keys)
+        with self._open() as store:
+            _raise_for_missing_keys({asset_key: asset_key in store for asset_key in asset_keys})
+            records = {asset_key: store[asset_key] for asset_key in asset_keys}
+        return {asset_key: self._unpack(record) for asset_key, record in records.items()}
+
+    def put_many(self, assets_and_tags):
+        items = [(asset_key, (asset, tags or frozenset()))
+                 for asset_key, (asset, tags) in _pairs(assets_and_tags)]
+        records = [(asset_key, (self._pack(asset), tags)) for asset_key, (asset, tags) in items]
+        with self._open(writable=True) as store:
+            for asset_key, record in records:
+                store[asset_key] = record
+            self._update_indexes(items)
+
+    def delete_many(self, asset_keys):
+        asset_keys = list(asset_keys)
+        with self._open(writable=True) as store:
+            _raise_for_missing_keys({asset_key: asset_key in store for asset_key in asset_keys})
+            for asset_key in asset_keys:
+                del store[asset_key]
+            self._update_indexes((asset_key, None) for asset_key in asset_keys)
+
+    def contains_many(self, asset_keys):
+        with self._open() as store:
+            return {asset_key: asset_key in store for asset_key in asset_keys}
+
+
+class LockStatistics:
     """
-    Represents a digital asset.
-
-    An :class:`~madam.core.Asset` is an immutable value object whose contents consist
-    of *essence* and *metadata*. Essence represents the actual data of a media file,
-    such as the color values of an image, whereas the metadata describes the essence.
+    Represents cumulative statistics about the file locks that were acquired
+    by a storage.
 
-    Assets should not be instantiated directly. Instead, use :func:`~madam.core.read` to retrieve an Asset
-    representing your content.
+    Wait times are measured in seconds.
     """
-    def __init__(self, essence, **metadata):
+    def __init__(self):
         """
-        Initializes a new :class:`~madam.core.Asset` with the specified essence and metadata.
-
-        :param essence: The essence of the asset as a file-like object
-        :param metadata: The metadata describing the essence
+        Initializes new LockStatistics without any recorded lock acquisitions.
         """
-        self._essence_data = essence.read()
-        if 'mime_type' not in metadata:
-            metadata['mime_type'] = None
-        self.metadata = _immutable(metadata)
+        self.shared_acquisitions = 0
+        self.shared_wait_time = 0.0
+        self.exclusive_acquisitions = 0
+        self.exclusive_wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.timeouts = 0
+        self._mutex = threading.Lock()
 
-    def __eq__(self, other):
-        if isinstance(other, self.__class__):
-            return other.__dict__ == self.__dict__
-        return False
+    def record(self, shared, wait_time, timed_out=False):
+        """
+        Records a single attempt to acquire a lock.
 
-    def __getattr__(self, item):
-        if item in self.metadata:
-            return self.metadata[item]
-        raise AttributeError('%r object has no attribute %r' % (self.__class__, item))
+        :param shared: Whether a shared or an exclusive lock was requested
+        :param wait_time: Time that was spent waiting for the lock
+        :param timed_out: Whether the lock could not be acquired in time
+        """
+        with self._mutex:
+            self.max_wait_time = max(self.max_wait_time, wait_time)
+            if timed_out:
+                self.timeouts += 1
+            elif shared:
+                self.shared_acquisitions += 1
+                self.shared_wait_time += wait_time
+            else:
+                self.exclusive_acquisitions += 1
+                self.exclusive_wait_time += wait_time
 
-    def __setattr__(self, key, value):
-        if 'metadata' in self.__dict__ and key in self.__dict__['metadata']:
-            raise NotImplementedError('Unable to overwrite metadata attribute.')
-        super().__setattr__(key, value)
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['_mutex']
+        return state
 
     def __setstate__(self, state):
-        """
-        Sets this objects __dict__ to the specified state.
+        self.__dict__.update(state)
+        self._mutex = threading.Lock()
 
-        Required for Asset to be unpicklable. If this is absent, pickle will not
-        set the __dict__ correctly due to the presence of :func:`~madam.core.Asset.__getattr__`.
-        :param state: The state passed by pickle
-        """
-        self.__dict__ = state
 
-    @property
-    def essence(self):
-        """
-        Represents the actual content of the asset.
+_LOCK_POLL_INTERVAL = 0.005
+_LOCK_MAX_POLL_INTERVAL = 0.1
 
-        The essence of an MP3 file, for example, is only comprised of the actual audio data,
-        whereas metadata such as ID3 tags are stored separately as metadata.
-        """
-        return io.BytesIO(self._essence_data)
 
-    def __hash__(self):
-        return hash(self._essence_data) ^ hash(self.metadata)
+@contextlib.contextmanager
+def _file_lock(path, shared=False, timeout=None, statistics=None):
+    """
+    Holds a lock on the file with the specified path.
 
+    The lock is acquired using :func:`fcntl.flock`, which means that it
+    coordinates threads as well as separate processes. The lock file will be
+    created if it does not exist.
 
-class UnsupportedFormatError(Exception):
+    :param path: Path of the lock file
+    :param shared: Whether a shared lock is acquired instead of an exclusive lock
+    :param timeout: Maximum time in seconds to wait for the lock, or `None` to wait indefinitely
+    :param statistics: Optional :class:`~madam.core.LockStatistics` that records the lock acquisition
+    :raise LockTimeoutError: if the lock cannot be acquired within the timeout
     """
-    Represents an error that is raised whenever file content with unknown type is encountered.
+    operation = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+    with open(path, 'a') as lock_file:
+        start_time = time.monotonic()
+        if timeout is None:
+            fcntl.flock(lock_file, operation)
+        else:
+            poll_interval = _LOCK_POLL_INTERVAL
+            while True:
+                try:
+                    fcntl.flock(lock_file, operation | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    remaining_time = timeout - (time.monotonic() - start_time)
+                    if remaining_time <= 0:
+                        if statistics is not None:
+                            statistics.record(shared, time.monotonic() - start_time, timed_out=True)
+                        raise LockTimeoutError('Could not acquire lock %r within %s seconds' % (path, timeout))
+                    time.sleep(min(poll_interval, remaining_time))
+                    poll_interval = min(2 * poll_interval, _LOCK_MAX_POLL_INTERVAL)
+        if statistics is not None:
+            statistics.record(shared, time.monotonic() - start_time)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class ShardedStorage(AssetStorage):
     """
-    pass
-
-
-class Pipeline:
+    Represents a persistent storage backend for :class:`~madam.core.Asset`
+    objects that distributes the assets across several shards. Asset keys must
+    be strings.
+
+    Each shard is a :class:`~madam.core.ShelveStorage` in a separate file
+    inside the storage directory. The shard of an asset is determined by the
+    hash of its key. Every shard is guarded by its own reader/writer file lock,
+    so that multiple threads or processes can write into different shards at
+    the same time. Operations on several assets are executed on all affected
+    shards in parallel.
+
+    The same number of shards must be used whenever a storage directory is
+    opened.
     """
-    Represents a processing pipeline for :class:`~madam.core.Asset` objects.
+    def __init__(self, path, shard_count=16, max_workers=None, lock_timeout=None, compression=None):
+        """
+        Initializes a new ShardedStorage in the directory with the specified path.
+
+        :param path: File system path of the directory where the data should be stored
+        :param shard_count: Number of shards that the assets are distributed across
+        :param max_workers: Maximum number of shards that are accessed in parallel.
+               Defaults to the number of shards.
+        :param lock_timeout: Maximum time in seconds to wait for the lock of
+               a shard, or `None` to wait indefinitely
+        :param compression: Compression codec or mapping of MIME types to
+               compression codecs as described for :class:`~madam.core.ShelveStorage`
+        """
+        if os.path.exists(path) and not os.path.isdir(path):
+            raise ValueError('The storage path %r is not a directory.' % path)
+        if shard_count < 1:
+            raise ValueError('Invalid number of shards: %d' % shard_count)
+        os.makedirs(path, exist_ok=True)
+        super().__init__()
+        self.path = path
+        self.shards = [ShelveStorage(os.path.join(path, 'shard-%03d' % shard_index),
+                                     lock_timeout=lock_timeout, compression=compression)
+                       for shard_index in range(shard_count)]
+        self.max_workers = max_workers or shard_count
+        self.lock_statistics = LockStatistics()
+        for shard in self.shards:
+            shard.lock_statistics = self.lock_statistics
 
-    The pipeline can be configured to hold a list of asset processing operators, all
-    of which are applied to one or more assets when calling the
-    :func:`~madam.core.Pipeline.process` method.
-    """
-    def __init__(self):
+    def _shard_index(self, asset_key):
         """
-        Initializes a new pipeline without operators.
-        """
-        self.operators = []
+        Returns the index of the shard that is responsible for the specified key.
 
-    def process(self, *assets):
+        :param asset_key: Key of an asset
+        :return: Index of the shard
         """
-        Applies the operators in this pipeline on the specified assets.
+        return zlib.crc32(asset_key.encode('utf-8')) % len(self.shards)
 
-        :param assets: Assets to be processed
-        :return: Generator with processed assets
+    def _shard(self, asset_key):
         """
-        for asset in assets:
-            processed_asset = asset
-            for operator in self.operators:
-                processed_asset = operator(processed_asset)
-            yield processed_asset
+        Returns the shard that is responsible for the specified key.
 
-    def add(self, operator):
+        :param asset_key: Key of an asset
+        :return: Shard storage
         """
-        Appends the specified operator to the processing chain.
+        return self.shards[self._shard_index(asset_key)]
 
-        :param operator: Operator to be added
+    def _map_shards(self, function, argument_by_shard):
         """
-        self.operators.append(operator)
+        Calls the specified function for multiple shards in parallel.
 
+        The function is called with a shard and the argument for the
+        respective shard.
 
-class Processor(metaclass=abc.ABCMeta):
-    """
-    Represents an entity that can create :class:`~madam.core.Asset` objects
-    from binary data.
+        :param function: Callable that takes a shard and an argument
+        :param argument_by_shard: Mapping of shard indices to arguments
+        :return: List of the results for each shard
+        """
+        def call_with_shard(shard_index):
+            return function(self.shards[shard_index], argument_by_shard[shard_index])
 
-    Every Processor needs to have a no-args __init__ method in order to be registered correctly.
-    """
+        if len(argument_by_shard) <= 1:
+            return list(map(call_with_shard, argument_by_shard))
+        max_workers = min(self.max_workers, len(argument_by_shard))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(call_with_shard, argument_by_shard))
 
-    @abc.abstractmethod
-    def can_read(self, file):
+    def _keys_by_shard(self, asset_keys):
         """
-        Returns whether the specified MIME type is supported by this processor.
+        Groups the specified asset keys by the index of their shards.
 
-        :param file: file-like object to be tested
-        :return: whether the data format of the specified file is supported or not
+        :param asset_keys: Keys of assets
+        :return: Mapping of shard indices to lists of asset keys
         """
-        raise NotImplementedError()
+        keys_by_shard = collections.OrderedDict()
+        for asset_key in asset_keys:
+            keys_by_shard.setdefault(self._shard_index(asset_key), []).append(asset_key)
+        return keys_by_shard
 
-    @abc.abstractmethod
-    def read(self, file):
+    def _all_shards(self):
         """
-        Returns an :class:`~madam.core.Asset` object whose essence is identical to
-        the contents of the specified file.
+        Returns a mapping of all shard indices to `None` arguments that can be
+        used with :func:`~madam.core.ShardedStorage._map_shards`.
 
-        :param file: file-like object to be read
-        :return: Asset with essence
-        :raises UnsupportedFormatError: if the specified data format is not supported
+        :return: Mapping of shard indices to `None`
         """
-        raise NotImplementedError()
+        return collections.OrderedDict.fromkeys(range(len(self.shards)))
 
+    def __setitem__(self, asset_key, asset_and_tags):
+        """
+        Stores an :class:`~madam.core.Asset` in this asset storage using the
+        specified key.
 
-class MetadataProcessor(metaclass=abc.ABCMeta):
-    """
-    Represents an entity that can manipulate metadata.
+        The `asset_and_tags` argument is a tuple of the asset and the
+        associated tags.
 
-    Every MetadataProcessor needs to have a no-args __init__ method in order to be registered correctly.
-    """
-    @property
-    @abc.abstractmethod
-    def formats(self):
-        """
-        The metadata formats which are supported.
-        :return: supported metadata formats
-        :rtype: tuple
+        Adding an asset key twice overwrites all tags for the asset.
+
+        :param asset_key: Unique value used as a key to store the asset.
+        :param asset: Tuple of the asset and the tags associated with the asset
         """
-        raise NotImplementedError()
+        self._shard(asset_key)[asset_key] = asset_and_tags
+
+    def __getitem__(self, asset_key):
+        """
+        Returns a tuple of the :class:`~madam.core.Asset` with the specified
+        key and the tags associated with the asset.
+
+        An error will be raised if the key does not exist.
+
+        :param asset_key: Key of the asset for which the tags should be returned
+        :return: A tuple containing an asset and a set the tags associated with the asset
+        :raise KeyError: if the key does not exist in this storage
+        """
+        return self._shard(asset_key)[asset_key]
+
+    def __delitem__(self, asset_key):
+        """
+        Removes the :class:`~madam.core.Asset` with the specified key from this
+        asset storage, as well as all associated data (e.g. tags).
+
+        :param asset_key: Key of the asset to be removed
+        :raise KeyError: if the key does not exist in this storage
+        """
+        del self._shard(asset_key)[asset_key]
+
+    def __contains__(self, asset_key):
+        """
+        Returns whether an asset with the specified key is stored in this
+        asset storage.
+        :param asset_key: Key of the asset that should be tested
+        :return: `True` if the key exists, `False` otherwise
+        """
+        return asset_key in self._shard(asset_key)
+
+    def __iter__(self):
+        """
+        Returns an object that can be used to iterate all asset that are stored
+        in this asset storage.
+        :return: Iterator object
+        """
+        asset_keys_by_shard = self._map_shards(lambda shard, _: list(shard), self._all_shards())
+        return iter([asset_key for asset_keys in asset_keys_by_shard for asset_key in asset_keys])
+
+    def __len__(self):
+        """
+        Returns the number of assets in this storage.
+        :return: Number of assets in this storage
+        """
+        return sum(self._map_shards(lambda shard, _: len(shard), self._all_shards()))
+
+    def filter(self, **kwargs):
+        asset_keys_by_shard = self._map_shards(lambda shard, _: shard.filter(**kwargs), self._all_shards())
+        return [asset_key for asset_keys in asset_keys_by_shard for asset_key in asset_keys]
+
+    def filter_by_tags(self, *tags):
+        asset_keys_by_shard = self._map_shards(lambda shard, _: shard.filter_by_tags(*tags), self._all_shards())
+        return set().union(*asset_keys_by_shard)
+
+    def get_many(self, asset_keys):
+        results = self._map_shards(ShelveStorage.get_many, self._keys_by_shard(asset_keys))
+        assets_and_tags_by_key = {}
+        for result in results:
+            assets_and_tags_by_key.update(result)
+        return assets_and_tags_by_key
+
+    def put_many(self, assets_and_tags):
+        items_by_shard = collections.OrderedDict()
+        for asset_key, asset_and_tags in _pairs(assets_and_tags):
+            items_by_shard.setdefault(self._shard_index(asset_key), []).append((asset_key, asset_and_tags))
+        self._map_shards(ShelveStorage.put_many, items_by_shard)
+
+    def delete_many(self, asset_keys):
+        keys_by_shard = self._keys_by_shard(asset_keys)
+        _raise_for_missing_keys(self.contains_many(
+            asset_key for asset_keys in keys_by_shard.values() for asset_key in asset_keys))
+        self._map_shards(ShelveStorage.delete_many, keys_by_shard)
+
+    def contains_many(self, asset_keys):
+        results = self._map_shards(ShelveStorage.contains_many, self._keys_by_shard(asset_keys))
+        contains_by_key = {}
+        for result in results:
+            contains_by_key.update(result)
+        return contains_by_key
+
+    def add_index(self, name, index, rebuild=False):
+        self.indexes[name] = index
+        self._map_shards(lambda shard, _: shard.add_index(name, index, rebuild=rebuild), self._all_shards())
+
+    def _query_index(self, name, *args, **kwargs):
+        results_by_shard = self._map_shards(lambda shard, _: shard._query_index(name, *args, **kwargs),
+                                            self._all_shards())
+        return [result for results in results_by_shard for result in results]
+
+
+class AssetIndex(metaclass=abc.ABCMeta):
+    """
+    Represents a secondary index over the assets in an
+    :class:`~madam.core.AssetStorage`.
+
+    An index maps each asset to a number of *terms*. For every term, the
+    index keeps a posting list of the keys of all assets with that term, so
+    that queries only need to read the posting lists of the terms they are
+    interested in. Posting lists are split into blocks of at most
+    :attr:`BLOCK_SIZE` entries, so that adding or removing an asset only
+    rewrites one block per term instead of the whole posting list.
+
+    Index objects do not hold any data themselves. All entries are kept in a
+    mapping with string keys which is provided by the storage. This allows
+    persistent storages to persist the index along with the assets.
+    """
+    #: Maximum number of entries in a block of a posting list
+    BLOCK_SIZE = 256
+
+    @abc.abstractmethod
+    def terms(self, asset, tags):
+        """
+        Returns the index terms for the specified asset.
+
+        :param asset: Asset to be indexed
+        :param tags: Tags of the asset
+        :return: Mapping of terms to values that are stored with the asset key in the posting list
+        :rtype: dict
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def query(self, index_store, *args, **kwargs):
+        """
+        Returns the assets that match the specified query.
+
+        :param index_store: Mapping with the index data
+        :return: List of tuples of asset keys and scores
+        """
+        raise NotImplementedError()
+
+    def rank(self, results):
+        """
+        Returns the specified query results ordered by relevance.
+
+        By default, results with lower scores are more relevant.
+
+        :param results: Iterable of tuples of asset keys and scores
+        :return: Sorted list of tuples of asset keys and scores
+        """
+        return sorted(results, key=lambda result: result[1])
+
+    def add(self, index_store, asset_key, asset, tags):
+        """
+        Adds the specified asset to the index.
+
+        :param index_store: Mapping with the index data
+        :param asset_key: Key of the asset
+        :param asset: Asset to be indexed
+        :param tags: Tags of the asset
+        """
+        terms = self.terms(asset, tags)
+        if not terms:
+            return
+        blocks = []
+        for term, value in terms.items():
+            block_count = index_store.get('c:' + term, 0)
+            block = index_store.get(self._block_key(term, block_count - 1), {}) if block_count else {}
+            if not block_count or len(block) >= self.BLOCK_SIZE:
+                block = {}
+                block_count += 1
+                index_store['c:' + term] = block_count
+            block[asset_key] = value
+            index_store[self._block_key(term, block_count - 1)] = block
+            blocks.append((term, block_count - 1))
+        index_store['a:' + repr(asset_key)] = blocks
+        index_store['n:'] = index_store.get('n:', 0) + 1
+
+    def remove(self, index_store, asset_key):
+        """
+        Removes the asset with the specified key from the index.
+
+        Nothing happens if the asset is not indexed.
+
+        :param index_store: Mapping with the index data
+        :param asset_key: Key of the asset
+        """
+        blocks = index_store.pop('a:' + repr(asset_key), None)
+        if blocks is None:
+            return
+        for term, block_index in blocks:
+            block_key = self._block_key(term, block_index)
+            block = index_store[block_key]
+            del block[asset_key]
+            if block:
+                index_store[block_key] = block
+                continue
+            del index_store[block_key]
+            # Drop empty blocks at the end of the posting list
+            block_count = index_store['c:' + term]
+            while block_count and self._block_key(term, block_count - 1) not in index_store:
+                block_count -= 1
+            if block_count:
+                index_store['c:' + term] = block_count
+            else:
+                del index_store['c:' + term]
+        index_store['n:'] -= 1
+
+    @staticmethod
+    def _block_key(term, block_index):
+        """
+        Returns the key under which a block of a posting list is stored.
+
+        :param term: Index term
+        :param block_index: Position of the block in the posting list
+        :return: Key of the block
+        """
+        return 'b:%s:%d' % (term, block_index)
+
+    @classmethod
+    def postings(cls, index_store, term):
+        """
+        Returns the posting list of the specified term.
+
+        :param index_store: Mapping with the index data
+        :param term: Index term
+        :return: Mapping of the keys of all assets with the term to the stored values
+        """
+        postings = {}
+        for block_index in range(index_store.get('c:' + term, 0)):
+            postings.update(index_store.get(cls._block_key(term, block_index), {}))
+        return postings
+
+    @staticmethod
+    def posting_blocks(index_store):
+        """
+        Returns all blocks of all posting lists.
+
+        :param index_store: Mapping with the index data
+        :return: Iterator of tuples of terms and mappings of asset keys to the stored values
+        """
+        for key in list(index_store.keys()):
+            if key.startswith('b:'):
+                term, _, _ = key[2:].rpartition(':')
+                yield term, index_store[key]
+
+    @staticmethod
+    def asset_count(index_store):
+        """
+        Returns the number of indexed assets.
+
+        :param index_store: Mapping with the index data
+        :return: Number of indexed assets
+        """
+        return index_store.get('n:', 0)
+
+
+def hamming_distance(value, other_value):
+    """
+    Returns the number of differing bits of two integers.
+
+    :param value: First integer
+    :param other_value: Second integer
+    :return: Number of differing bits
+    """
+    return bin(value ^ other_value).count('1')
+
+
+class PerceptualHashIndex(AssetIndex):
+    """
+    Represents an index of perceptual hashes which can be used to find
+    similar assets, e.g. near-duplicate images.
+
+    The index reads the hashes from the asset metadata, which are added by
+    :meth:`~madam.image.PillowProcessor.add_perceptual_hash`. It uses
+    multi-index hashing: each hash is split into chunks, and each chunk is a
+    separate index term. If two hashes differ in at most `k` bits, at least one of
+    their chunks differs in at most `k // chunk_count` bits. Queries thus only
+    need to look up a small neighborhood of each chunk instead of comparing
+    the hashes of all assets.
+
+    Queries take a hash and the maximum Hamming distance of matching assets,
+    and return the Hamming distance as score.
+    """
+    def __init__(self, method='dhash', metadata_key='perceptual_hash', bits=64, chunk_count=4):
+        """
+        Initializes a new PerceptualHashIndex.
+
+        :param method: Key of the hash in the perceptual hash metadata
+        :param metadata_key: Metadata key of the perceptual hashes
+        :param bits: Number of bits of a hash
+        :param chunk_count: Number of chunks a hash is split into
+        """
+        if bits % chunk_count:
+            raise ValueError('Number of bits %d is not divisible into %d chunks' % (bits, chunk_count))
+        self.method = method
+        self.metadata_key = metadata_key
+        self.chunk_count = chunk_count
+        self.chunk_bits = bits // chunk_count
+
+    def _chunks(self, perceptual_hash):
+        """
+        Returns the chunks of the specified hash.
+
+        :param perceptual_hash: Hash value
+        :return: List of chunk values
+        """
+        mask = (1 << self.chunk_bits) - 1
+        return [(perceptual_hash >> (chunk_index * self.chunk_bits)) & mask
+                for chunk_index in range(self.chunk_count)]
+
+    def terms(self, asset, tags):
+        perceptual_hashes = asset.metadata.get(self.metadata_key) or {}
+        perceptual_hash = perceptual_hashes.get(self.method)
+        if perceptual_hash is None:
+            return {}
+        return {'%d:%x' % (chunk_index, chunk): perceptual_hash
+                for chunk_index, chunk in enumerate(self._chunks(perceptual_hash))}
+
+    def query(self, index_store, perceptual_hash, max_distance):
+        """
+        Returns all assets whose hash differs from the specified hash in at most
+        `max_distance` bits.
+
+        :param index_store: Mapping with the index data
+        :param perceptual_hash: Hash value
+        :param max_distance: Maximum Hamming distance
+        :return: List of tuples of asset keys and Hamming distances
+        """
+        radius = min(max_distance // self.chunk_count, self.chunk_bits)
+        neighborhood_size = sum(math.factorial(self.chunk_bits) //
+                                (math.factorial(flipped_bit_count) *
+                                 math.factorial(self.chunk_bits - flipped_bit_count))
+                                for flipped_bit_count in range(radius + 1))
+        candidates = {}
+        if neighborhood_size * self.chunk_count > self.asset_count(index_store):
+            # Comparing all hashes is cheaper than looking up all neighbors
+            for term, block in self.posting_blocks(index_store):
+                if term.startswith('0:'):
+                    candidates.update(block)
+            radius = -1
+        for chunk_index, chunk in enumerate(self._chunks(perceptual_hash)):
+            for flipped_bit_count in range(radius + 1):
+                for flipped_bits in itertools.combinations(range(self.chunk_bits), flipped_bit_count):
+                    neighbor = chunk
+                    for bit in flipped_bits:
+                        neighbor ^= 1 << bit
+                    candidates.update(self.postings(index_store, '%d:%x' % (chunk_index, neighbor)))
+        results = []
+        for asset_key, candidate_hash in candidates.items():
+            distance = hamming_distance(perceptual_hash, candidate_hash)
+            if distance <= max_distance:
+                results.append((asset_key, distance))
+        return results
+
+
+class FullTextIndex(AssetIndex):
+    """
+    Represents an inverted index over the textual metadata of assets.
+
+    The indexed fields are specified as dotted paths into the asset metadata,
+    where the first component is the metadata format, e.g. ``'iptc.caption'``.
+    Field values can be strings or sequences of strings. They are split into
+    lowercase alphanumeric tokens. Besides the tokens themselves, all token
+    prefixes with a minimum length are indexed, so that prefix searches do
+    not need to scan the vocabulary.
+
+    Queries take a text and return the assets that contain all of its tokens,
+    ranked by TF-IDF score with higher scores first.
+    """
+    #: Metadata fields that are indexed by default
+    DEFAULT_FIELDS = (
+        'exif.description',
+        'iptc.caption',
+        'iptc.headline',
+        'iptc.keywords',
+        'iptc.subjects',
+        'ffmetadata.album',
+        'ffmetadata.artist',
+        'ffmetadata.comment',
+        'ffmetadata.title',
+    )
+
+    _TOKEN_PATTERN = re.compile(r'\w+')
+
+    def __init__(self, fields=DEFAULT_FIELDS, min_prefix_length=3):
+        """
+        Initializes a new FullTextIndex.
+
+        :param fields: Dotted paths of the metadata fields to be indexed
+        :param min_prefix_length: Minimum length of indexed token prefixes
+        """
+        self.fields = tuple(fields)
+        self.min_prefix_length = min_prefix_length
+
+    @classmethod
+    def tokenize(cls, text):
+        """
+        Splits the specified text into lowercase tokens.
+
+        :param text: Text to be split
+        :return: List of tokens
+        """
+        return cls._TOKEN_PATTERN.findall(text.lower())
+
+    def _field_values(self, asset):
+        """
+        Returns the strings in the indexed metadata fields of the specified asset.
+
+        :param asset: Asset whose fields are read
+        :return: List of strings
+        """
+        values = []
+        for field in self.fields:
+            metadata_format, _, key = field.partition('.')
+            value = (asset.metadata.get(metadata_format) or {}).get(key)
+            if isinstance(value, str):
+                values.append(value)
+            elif isinstance(value, (list, tuple, frozenset, set)):
+                values.extend(item for item in value if isinstance(item, str))
+        return values
+
+    def terms(self, asset, tags):
+        tokens = [token for value in self._field_values(asset) for token in self.tokenize(value)]
+        if not tokens:
+            return {}
+        counts = collections.Counter()
+        for token in tokens:
+            counts['w:' + token] += 1
+            for prefix_length in range(self.min_prefix_length, len(token)):
+                counts['p:' + token[:prefix_length]] += 1
+        return {term: (count, len(tokens)) for term, count in counts.items()}
+
+    def query(self, index_store, text, prefix=False):
+        """
+        Returns all assets whose indexed fields contain all tokens of the specified text.
+
+        :param index_store: Mapping with the index data
+        :param text: Text to search for
+        :param prefix: Whether the tokens also match longer tokens that start with them
+        :return: List of tuples of asset keys and relevance scores
+        """
+        tokens = self.tokenize(text)
+        if not tokens:
+            return []
+        asset_count = self.asset_count(index_store)
+        scores = None
+        for token in tokens:
+            postings = dict(self.postings(index_store, 'w:' + token))
+            if prefix and len(token) >= self.min_prefix_length:
+                for asset_key, (count, length) in self.postings(index_store, 'p:' + token).items():
+                    exact_count, _ = postings.get(asset_key, (0, length))
+                    postings[asset_key] = (count + exact_count, length)
+            inverse_document_frequency = math.log(1 + asset_count / (1 + len(postings)))
+            token_scores = {asset_key: count / length * inverse_document_frequency
+                            for asset_key, (count, length) in postings.items()}
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {asset_key: score + token_scores[asset_key]
+                          for asset_key, score in scores.items() if asset_key in token_scores}
+            if not scores:
+                break
+        return list(scores.items())
+
+    def rank(self, results):
+        return sorted(results, key=lambda result: result[1], reverse=True)
+
+
+def decimal_degrees(degrees_minutes_seconds, ref=None):
+    """
+    Converts an angle in degrees, minutes, and seconds to decimal degrees.
+
+    :param degrees_minutes_seconds: Sequence with degrees and optionally minutes and seconds, or a single number
+    :param ref: Hemisphere reference, i.e. ``'north'``, ``'south'``, ``'east'``, or ``'west'``
+    :return: Angle in decimal degrees which is negative for the southern and western hemispheres
+    :rtype: float
+    """
+    if isinstance(degrees_minutes_seconds, (int, float)):
+        degrees_minutes_seconds = (degrees_minutes_seconds,)
+    value = sum(float(component) / 60**position
+                for position, component in enumerate(degrees_minutes_seconds))
+    if ref in ('south', 'west'):
+        value = -value
+    return value
+
+
+_EARTH_RADIUS = 6371.0088
+
+
+def _great_circle_distance(latitude, longitude, other_latitude, other_longitude):
+    """
+    Returns the distance of two points on the earth's surface in kilometers.
+
+    :param latitude: Latitude of the first point in decimal degrees
+    :param longitude: Longitude of the first point in decimal degrees
+    :param other_latitude: Latitude of the second point in decimal degrees
+    :param other_longitude: Longitude of the second point in decimal degrees
+    :return: Distance in kilometers
+    """
+    phi, other_phi = math.radians(latitude), math.radians(other_latitude)
+    delta_phi = other_phi - phi
+    delta_lambda = math.radians(other_longitude - longitude)
+    a = math.sin(delta_phi/2)**2 + math.cos(phi)*math.cos(other_phi)*math.sin(delta_lambda/2)**2
+    return 2*_EARTH_RADIUS*math.asin(min(1.0, math.sqrt(a)))
+
+
+def _longitude_ranges(west, east):
+    """
+    Returns the longitude ranges between the specified western and eastern
+    boundary. Ranges that cross the antimeridian are split in two.
+
+    :param west: Western boundary in decimal degrees
+    :param east: Eastern boundary in decimal degrees
+    :return: List of tuples of western and eastern boundaries
+    """
+    if west <= east:
+        return [(west, east)]
+    return [(west, 180.0), (-180.0, east)]
+
+
+class GeoIndex(AssetIndex):
+    """
+    Represents a spatial index over the GPS coordinates of assets.
+
+    The index uses a geohash grid: the earth's surface is recursively divided
+    into cells, and the cells containing an asset are its index terms. Cells
+    of several sizes are indexed, so that queries can look up a small number
+    of cells whose size matches the queried area, and only need to compare the
+    coordinates of the assets in these cells.
+
+    The coordinates are converted to decimal degrees from the values
+    ``gps.latitude`` and ``gps.longitude`` of the Exif metadata and their
+    hemisphere references ``gps.latitude_ref`` and ``gps.longitude_ref``.
+
+    Queries take either a bounding box or a center and a radius, and return
+    the distance to the center in kilometers as score.
+    """
+    _BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+    def __init__(self, metadata_format='exif', precisions=(3, 5, 7), max_cells=64):
+        """
+        Initializes a new GeoIndex.
+
+        :param metadata_format: Metadata format that contains the coordinates
+        :param precisions: Lengths of the indexed geohashes
+        :param max_cells: Maximum number of cells to be looked up by a query
+        """
+        self.metadata_format = metadata_format
+        self.precisions = tuple(sorted(precisions))
+        self.max_cells = max_cells
+
+    @staticmethod
+    def _cell_counts(precision):
+        """
+        Returns the number of grid rows and columns for geohashes of the
+        specified length.
+
+        :param precision: Length of the geohashes
+        :return: Tuple of the numbers of latitude rows and longitude columns
+        """
+        bit_count = 5*precision
+        return 1 << (bit_count // 2), 1 << ((bit_count + 1) // 2)
+
+    @classmethod
+    def _cell(cls, latitude, longitude, precision):
+        """
+        Returns the grid row and column of the specified point.
+
+        :param latitude: Latitude in decimal degrees
+        :param longitude: Longitude in decimal degrees
+        :param precision: Length of the geohashes
+        :return: Tuple of row and column
+        """
+        row_count, column_count = cls._cell_counts(precision)
+        row = int((latitude + 90.0) / 180.0 * row_count)
+        column = int((longitude + 180.0) / 360.0 * column_count)
+        return min(max(row, 0), row_count - 1), min(max(column, 0), column_count - 1)
+
+    @classmethod
+    def _cell_geohash(cls, row, column, precision):
+        """
+        Returns the geohash of the specified grid cell.
+
+        :param row: Grid row
+        :param column: Grid column
+        :param precision: Length of the geohash
+        :return: Geohash
+        """
+        bit_count = 5*precision
+        latitude_bit_count, longitude_bit_count = bit_count // 2, (bit_count + 1) // 2
+        bits = 0
+        for position in range(bit_count):
+            if position % 2:
+                bit = row >> (latitude_bit_count - 1 - position // 2)
+            else:
+                bit = column >> (longitude_bit_count - 1 - position // 2)
+            bits = (bits << 1) | (bit & 1)
+        return ''.join(cls._BASE32[(bits >> (5*(precision - 1 - index))) & 31]
+                       for index in range(precision))
+
+    @classmethod
+    def geohash(cls, latitude, longitude, precision):
+        """
+        Returns the geohash of the specified point.
+
+        :param latitude: Latitude in decimal degrees
+        :param longitude: Longitude in decimal degrees
+        :param precision: Length of the geohash
+        :return: Geohash
+        """
+        row, column = cls._cell(latitude, longitude, precision)
+        return cls._cell_geohash(row, column, precision)
+
+    def coordinates(self, asset):
+        """
+        Returns the decimal coordinates of the specified asset.
+
+        :param asset: Asset whose coordinates are read
+        :return: Tuple of latitude and longitude, or `None` if the asset has no coordinates
+        """
+        metadata = asset.metadata.get(self.metadata_format) or {}
+        latitude = metadata.get('gps.latitude')
+        longitude = metadata.get('gps.longitude')
+        if latitude is None or longitude is None:
+            return None
+        return (decimal_degrees(latitude, metadata.get('gps.latitude_ref')),
+                decimal_degrees(longitude, metadata.get('gps.longitude_ref')))
+
+    def terms(self, asset, tags):
+        coordinates = self.coordinates(asset)
+        if coordinates is None:
+            return {}
+        return {self.geohash(coordinates[0], coordinates[1], precision): coordinates
+                for precision in self.precisions}
+
+    def _covering_cells(self, south, north, longitude_ranges, precision):
+        """
+        Returns the geohashes of all grid cells that intersect the specified area.
+
+        :param south: Southern boundary in decimal degrees
+        :param north: Northern boundary in decimal degrees
+        :param longitude_ranges: List of tuples of western and eastern boundaries
+        :param precision: Length of the geohashes
+        :return: List of geohashes
+        """
+        south_row, _ = self._cell(south, 0.0, precision)
+        north_row, _ = self._cell(north, 0.0, precision)
+        column_ranges = [(self._cell(0.0, west, precision)[1], self._cell(0.0, east, precision)[1])
+                         for west, east in longitude_ranges]
+        return [self._cell_geohash(row, column, precision)
+                for row in range(south_row, north_row + 1)
+                for west_column, east_column in column_ranges
+                for column in range(west_column, east_column + 1)]
+
+    def _cell_count(self, south, north, longitude_ranges, precision):
+        """
+        Returns the number of grid cells that intersect the specified area.
+
+        :param south: Southern boundary in decimal degrees
+        :param north: Northern boundary in decimal degrees
+        :param longitude_ranges: List of tuples of western and eastern boundaries
+        :param precision: Length of the geohashes
+        :return: Number of cells
+        """
+        row_count = self._cell(north, 0.0, precision)[0] - self._cell(south, 0.0, precision)[0] + 1
+        column_count = sum(self._cell(0.0, east, precision)[1] - self._cell(0.0, west, precision)[1] + 1
+                           for west, east in longitude_ranges)
+        return row_count*column_count
+
+    def _candidates(self, index_store, south, north, longitude_ranges):
+        """
+        Returns the coordinates of all assets in grid cells that intersect the
+        specified area.
+
+        :param index_store: Mapping with the index data
+        :param south: Southern boundary in decimal degrees
+        :param north: Northern boundary in decimal degrees
+        :param longitude_ranges: List of tuples of western and eastern boundaries
+        :return: Mapping of asset keys to tuples of latitude and longitude
+        """
+        for precision in reversed(self.precisions):
+            cell_count = self._cell_count(south, north, longitude_ranges, precision)
+            if cell_count <= self.max_cells:
+                break
+        candidates = {}
+        if cell_count > self.asset_count(index_store):
+            # Comparing all coordinates is cheaper than looking up all cells
+            for term, block in self.posting_blocks(index_store):
+                if len(term) == precision:
+                    candidates.update(block)
+            return candidates
+        for cell in self._covering_cells(south, north, longitude_ranges, precision):
+            candidates.update(self.postings(index_store, cell))
+        return candidates
+
+    def query(self, index_store, bbox=None, center=None, radius=None):
+        """
+        Returns all assets within the specified bounding box, or within the
+        specified radius around a center.
+
+        :param index_store: Mapping with the index data
+        :param bbox: Tuple of the southern, western, northern, and eastern boundary in decimal degrees
+        :param center: Tuple of latitude and longitude in decimal degrees
+        :param radius: Radius in kilometers
+        :return: List of tuples of asset keys and distances to the center in kilometers
+        :raise ValueError: if neither a bounding box nor a center and a radius are specified
+        """
+        if bbox is not None and center is None and radius is None:
+            south, west, north, east = bbox
+            longitude_ranges = _longitude_ranges(west, east)
+            center_latitude = (south + north)/2
+            center_longitude = west + ((east - west) % 360.0)/2
+            if center_longitude >= 180.0:
+                center_longitude -= 360.0
+            candidates = self._candidates(index_store, south, north, longitude_ranges)
+            matches = {asset_key: (latitude, longitude) for asset_key, (latitude, longitude) in candidates.items()
+                       if south <= latitude <= north and
+                       any(range_west <= longitude <= range_east for range_west, range_east in longitude_ranges)}
+        elif bbox is None and center is not None and radius is not None:
+            center_latitude, center_longitude = center
+            angular_radius = radius/_EARTH_RADIUS
+            south = math.degrees(math.radians(center_latitude) - angular_radius)
+            north = math.degrees(math.radians(center_latitude) + angular_radius)
+            cos_latitude = math.cos(math.radians(center_latitude))
+            if south <= -90.0 or north >= 90.0 or math.sin(angular_radius) >= cos_latitude:
+                south, north = max(south, -90.0), min(north, 90.0)
+                longitude_ranges = [(-180.0, 180.0)]
+            else:
+                delta_longitude = math.degrees(math.asin(math.sin(angular_radius)/cos_latitude))
+                west = (center_longitude - delta_longitude + 180.0) % 360.0 - 180.0
+                east = (center_longitude + delta_longitude + 180.0) % 360.0 - 180.0
+                longitude_ranges = _longitude_ranges(west, east)
+            candidates = self._candidates(index_store, south, north, longitude_ranges)
+            matches = {asset_key: coordinates for asset_key, coordinates in candidates.items()
+                       if _great_circle_distance(center_latitude, center_longitude, *coordinates) <= radius}
+        else:
+            raise ValueError('Either a bounding box or a center and a radius must be specified')
+        return [(asset_key, _great_circle_distance(center_latitude, center_longitude, latitude, longitude))
+                for asset_key, (latitude, longitude) in matches.items()]
+
+
+def _immutable(value):
+    """
+    Creates a read-only version from the specified value.
+
+    Dictionaries, lists, and sets will be handled recursively.
+
+    :param value: Value to be transformed into a read-only version
+    :return: Read-only value
+    """
+    if isinstance(value, dict):
+        return frozendict({k: _immutable(v) for k, v in value.items()})
+    elif isinstance(value, set):
+        return frozenset({_immutable(v) for v in value})
+    elif isinstance(value, list):
+        return tuple([_immutable(v) for v in value])
+    else:
+        return value
+
+
+class Asset:
+    """
+    Represents a digital asset.
+
+    An :class:`~madam.core.Asset` is an immutable value object whose contents consist
+    of *essence* and *metadata*. Essence represents the actual data of a media file,
+    such as the color values of an image, whereas the metadata describes the essence.
+
+    Assets should not be instantiated directly. Instead, use :func:`~madam.core.read` to retrieve an Asset
+    representing your content.
+    """
+    def __init__(self, essence, **metadata):
+        """
+        Initializes a new :class:`~madam.core.Asset` with the specified essence and metadata.
+
+        :param essence: The essence of the asset as a file-like object
+        :param metadata: The metadata describing the essence
+        """
+        self._essence_data = essence.read()
+        if 'mime_type' not in metadata:
+            metadata['mime_type'] = None
+        self.metadata = _immutable(metadata)
+
+    def __eq__(self, other):
+        if isinstance(other, self.__class__):
+            return other.__dict__ == self.__dict__
+        return False
+
+    def __getattr__(self, item):
+        if item in self.metadata:
+            return self.metadata[item]
+        raise AttributeError('%r object has no attribute %r' % (self.__class__, item))
+
+    def __setattr__(self, key, value):
+        if 'metadata' in self.__dict__ and key in self.__dict__['metadata']:
+            raise NotImplementedError('Unable to overwrite metadata attribute.')
+        super().__setattr__(key, value)
+
+    def __setstate__(self, state):
+        """
+        Sets this objects __dict__ to the specified state.
+
+        Required for Asset to be unpicklable. If this is absent, pickle will not
+        set the __dict__ correctly due to the presence of :func:`~madam.core.Asset.__getattr__`.
+        :param state: The state passed by pickle
+        """
+        self.__dict__ = state
+
+    @property
+    def essence(self):
+        """
+        Represents the actual content of the asset.
+
+        The essence of an MP3 file, for example, is only comprised of the actual audio data,
+        whereas metadata such as ID3 tags are stored separately as metadata.
+        """
+        return io.BytesIO(self._essence_data)
+
+    def __hash__(self):
+        return hash(self._essence_data) ^ hash(self.metadata)
+
+
+class LockTimeoutError(TimeoutError):
+    """
+    Represents an error that is raised whenever the lock of a storage cannot be acquired in time.
+    """
+    pass
+
+
+class UnsupportedFormatError(Exception):
+    """
+    Represents an error that is raised whenever file content with unknown type is encountered.
+    """
+    pass
+
+
+class Pipeline:
+    """
+    Represents a processing pipeline for :class:`~madam.core.Asset` objects.
+
+    The pipeline can be configured to hold a list of asset processing operators, all
+    of which are applied to one or more assets when calling the
+    :func:`~madam.core.Pipeline.process` method.
+    """
+    def __init__(self, cache=None, observers=None, timeout=None):
+        """
+        Initializes a new pipeline without operators.
+
+        Observers are called with an :class:`~madam.core.OperatorEvent` for
+        every operator call while the pipeline processes assets in the calling
+        thread or in a thread pool. Operator calls in process pools are not
+        observed.
+
+        If a timeout is specified, the operators of the pipeline must process
+        each asset within this time (see :func:`~madam.core.deadline`).
+
+        :param cache: :class:`~madam.core.OperatorCache` for the results of the operators, or `None`
+        :param observers: Callables that receive an event for every operator call
+        :param timeout: Maximum time in seconds for processing an asset, or `None`
+        :type timeout: float
+        """
+        self.operators = []
+        self.branches = collections.OrderedDict()
+        self.cache = cache
+        self.observers = list(observers or [])
+        self.timeout = timeout
+
+    def process(self, *assets, executor=None, max_workers=None, ordered=True, prefetch=None, token=None):
+        """
+        Applies the operators in this pipeline on the specified assets.
+
+        Consecutive operators of the same processor are fused if the processor
+        supports it (see :func:`~madam.core.Processor.fuse`).
+
+        By default, the assets are processed one after another in the calling
+        thread, and errors are raised immediately. If an executor is specified,
+        the assets are processed in parallel. In this case, an error only affects
+        the asset that caused it: a :class:`~madam.core.ProcessingError` is
+        yielded in place of the processed asset and the remaining assets are
+        processed as usual.
+
+        When processing in a process pool, the operators and assets must be
+        picklable. This is the case for operators of picklable processors.
+
+        If a cancellation token is specified and cancelled, the remaining
+        operator calls fail with an :class:`~madam.core.OperatorCancelledError`.
+        Operator calls in process pools cannot be cancelled.
+
+        :param assets: Assets to be processed
+        :param executor: `'thread'` or `'process'` for a new thread or process pool, or an existing
+            :class:`concurrent.futures.Executor` which is not shut down afterwards
+        :param max_workers: Maximum number of workers of a new pool
+        :param ordered: Whether the processed assets are yielded in the order of the input assets,
+            or as soon as they are done
+        :param prefetch: Maximum number of assets that are submitted to the executor but whose
+            results have not been yielded yet; defaults to twice the number of workers
+        :param token: :class:`~madam.core.CancellationToken` for the processing, or `None`
+        :return: Generator with processed assets
+        :raise ValueError: if the executor is invalid
+        """
+        operators = _fuse_operators(self.operators)
+        if executor is None:
+            for asset in assets:
+                yield _apply_operators(operators, asset, self.cache, self.observers, self.timeout, token)
+            return
+
+        executor, owned_executor = _resolve_executor(executor, max_workers)
+        observers = self._observers_for(executor)
+        if isinstance(executor, ProcessPoolExecutor):
+            token = None
+        if prefetch is None:
+            prefetch = 2*(max_workers or os.cpu_count() or 1)
+        prefetch = max(prefetch, 1)
+
+        pending = collections.OrderedDict()
+        asset_iterator = iter(assets)
+        try:
+            while True:
+                for asset in itertools.islice(asset_iterator, prefetch - len(pending)):
+                    pending[executor.submit(_apply_operators, operators, asset, self.cache, observers,
+                                            self.timeout, token)] = asset
+                if not pending:
+                    break
+                if ordered:
+                    future = next(iter(pending))
+                else:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    future = next(future for future in pending if future in done)
+                asset = pending.pop(future)
+                error = future.exception()
+                if error is None:
+                    yield future.result()
+                else:
+                    processing_error = ProcessingError('Could not process asset: %s' % error, asset)
+                    processing_error.__cause__ = error
+                    yield processing_error
+        finally:
+            for future in pending:
+                future.cancel()
+            if owned_executor is not None:
+                owned_executor.shutdown(wait=True)
+
+    def stream(self, assets, concurrency=1, queue_size=None, token=None):
+        """
+        Applies the operators in this pipeline on a stream of assets.
+
+        Unlike :func:`~madam.core.Pipeline.process`, the assets are read from
+        an iterable or an asynchronous iterable only when there is room for
+        them. Each operator is a stage with its own worker threads, and stages
+        are connected by bounded queues. When a stage is slower than the stages
+        before it, the queues fill up and reading stops until the stage catches
+        up. At most ``sum(concurrency) + (len(operators) + 1) * queue_size + 2``
+        assets are in memory at the same time, regardless of the number of
+        assets in the stream.
+
+        Processed assets are yielded as soon as they are done, so they may be in
+        a different order than the input assets. If an operator fails, a
+        :class:`~madam.core.ProcessingError` is yielded in place of the asset.
+        Closing the generator does not wait for the iterable to produce its
+        next asset; the iterable is no longer read afterwards.
+
+        The timeout of the pipeline limits the time that the operators spend on
+        each asset, not counting the time the asset waits in the queues. If a
+        cancellation token is specified and cancelled, the remaining operator
+        calls fail with an :class:`~madam.core.OperatorCancelledError`.
+
+        :param assets: Iterable or asynchronous iterable of assets
+        :param concurrency: Number of worker threads per operator, either as a single number or as
+            a sequence with one number per operator; fused operators use the maximum of their numbers
+        :param queue_size: Maximum number of assets waiting in front of each stage; defaults to the
+            maximum concurrency
+        :param token: :class:`~madam.core.CancellationToken` for the processing, or `None`
+        :return: Generator with processed assets
+        :raise ValueError: if the number of concurrency values does not match the number of operators
+        """
+        if isinstance(concurrency, int):
+            concurrency = [concurrency]*len(self.operators)
+        elif len(concurrency) != len(self.operators):
+            raise ValueError('Expected %d concurrency values, got %d' % (len(self.operators), len(concurrency)))
+        stages = []
+        operator_index = 0
+        for operator, operator_count in _fuse_operator_runs(self.operators):
+            stages.append((operator, max(1, *concurrency[operator_index:operator_index + operator_count])))
+            operator_index += operator_count
+        if queue_size is None:
+            queue_size = max([worker_count for _, worker_count in stages] + [1])
+
+        stop_event = threading.Event()
+        feed_errors = []
+        queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+        feeder = threading.Thread(target=_feed_stream, args=(assets, queues[0], stop_event, feed_errors))
+        workers = []
+        for stage_index, (operator, worker_count) in enumerate(stages):
+            stage = _StreamStage(operator, worker_count, queues[stage_index], queues[stage_index + 1],
+                                 stop_event, self.cache, self.observers, self.timeout, token)
+            workers.extend(threading.Thread(target=stage.work) for _ in range(worker_count))
+        for thread in [feeder] + workers:
+            thread.daemon = True
+            thread.start()
+
+        try:
+            while True:
+                item = _get_from_stream(queues[-1], stop_event)
+                if item is _END_OF_STREAM:
+                    break
+                asset, _ = item
+                yield asset
+            if feed_errors:
+                raise feed_errors[0]
+        finally:
+            stop_event.set()
+            # The feeder may be blocked in the iterable until it produces the next
+            # asset, so it is left to end by itself when the stream is closed early
+            for worker in workers:
+                worker.join()
+
+    @property
+    def signature(self):
+        """
+        Canonical, hashable description of the processing chain, which consists
+        of the signatures of its operators.
+
+        :raise ValueError: if an operator has no signature
+        """
+        for operator in self.operators:
+            if not isinstance(operator, _ConfiguredOperator):
+                raise ValueError('Operator %r has no signature' % (operator,))
+        return tuple(operator.signature for operator in self.operators)
+
+    def output_key(self, asset):
+        """
+        Returns the storage key of the output of this pipeline for the specified
+        source asset, as used by :func:`~madam.core.Pipeline.process_incremental`.
+
+        :param asset: Source asset
+        :return: Hexadecimal key
+        :raise ValueError: if an operator has no signature
+        """
+        return hashlib.sha256(repr((_asset_digest(asset), self.signature)).encode('utf-8')).hexdigest()
+
+    def process_incremental(self, sources, storage, tags=None, checkpoint_path=None, batch_size=64,
+                            executor=None, max_workers=None):
+        """
+        Applies the operators in this pipeline on the specified sources and
+        records the outputs in a storage, skipping sources whose outputs have
+        already been recorded.
+
+        Outputs are stored under a key that is derived from the digest of the
+        source asset and the signature of the pipeline (see
+        :func:`~madam.core.Pipeline.output_key`), so changed sources and
+        changed operators are processed again, while everything else is
+        skipped.
+
+        Sources are handled in batches. If a checkpoint path is specified, the
+        number of completed sources is written to this file after each batch.
+        When the processing is interrupted and started again with the same
+        sources in the same order, the completed sources are skipped without
+        loading them. The checkpoint is removed when all sources are done.
+
+        :param sources: Iterable of source assets, or of callables without arguments that load source assets
+        :param storage: :class:`~madam.core.AssetStorage` for the outputs
+        :param tags: Tags of the stored outputs
+        :param checkpoint_path: Path of the progress checkpoint file, or `None`
+        :param batch_size: Number of sources per batch
+        :param executor: Executor for the batches as in :func:`~madam.core.Pipeline.process`
+        :param max_workers: Maximum number of workers of a new pool
+        :return: Generator with tuples of output keys and the processed asset, `None` if the output
+            already existed, or a :class:`~madam.core.ProcessingError`
+        :raise ValueError: if an operator has no signature
+        """
+        pipeline_digest = hashlib.sha256(repr(self.signature).encode('utf-8')).hexdigest()
+        position = 0
+        if checkpoint_path is not None and os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as checkpoint_file:
+                checkpoint = json.load(checkpoint_file)
+            if checkpoint.get('pipeline') == pipeline_digest:
+                position = checkpoint['position']
+        source_iterator = itertools.islice(iter(sources), position, None)
+
+        while True:
+            batch = list(itertools.islice(source_iterator, batch_size))
+            if not batch:
+                break
+            assets = [source() if callable(source) else source for source in batch]
+            output_keys = [self.output_key(asset) for asset in assets]
+            existing_keys = storage.contains_many(output_keys)
+            pending = [(output_key, asset) for output_key, asset in zip(output_keys, assets)
+                       if not existing_keys[output_key]]
+            results = {}
+            if pending:
+                if executor is None:
+                    processed_assets = [self._process_safely(asset) for _, asset in pending]
+                else:
+                    processed_assets = self.process(*[asset for _, asset in pending], executor=executor,
+                                                    max_workers=max_workers)
+                for (output_key, _), processed_asset in zip(pending, processed_assets):
+                    results[output_key] = processed_asset
+                storage.put_many((output_key, (processed_asset, tags))
+                                 for output_key, processed_asset in results.items()
+                                 if not isinstance(processed_asset, ProcessingError))
+            position += len(batch)
+            if checkpoint_path is not None:
+                _write_checkpoint(checkpoint_path, dict(pipeline=pipeline_digest, position=position))
+            for output_key in output_keys:
+                yield output_key, results.get(output_key)
+
+        if checkpoint_path is not None and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+
+    def _process_safely(self, asset):
+        """
+        Applies the operators in this pipeline on the specified asset in the
+        calling thread.
+
+        :param asset: Asset to be processed
+        :return: Processed asset, or a :class:`~madam.core.ProcessingError` if an operator failed
+        """
+        try:
+            return _apply_operators(_fuse_operators(self.operators), asset, self.cache, self.observers,
+                                    self.timeout)
+        except Exception as error:
+            processing_error = ProcessingError('Could not process asset: %s' % error, asset)
+            processing_error.__cause__ = error
+            return processing_error
+
+    def _observers_for(self, executor):
+        """
+        Returns the observers that can be passed to tasks of the specified executor.
+
+        :param executor: Executor of the tasks
+        :return: List of observers
+        """
+        if isinstance(executor, ProcessPoolExecutor):
+            return []
+        return self.observers
+
+    def add(self, operator):
+        """
+        Appends the specified operator to the processing chain.
+
+        :param operator: Operator to be added
+        """
+        self.operators.append(operator)
+
+    def branch(self, name, *operators):
+        """
+        Adds a named branch to the pipeline.
+
+        A branch is applied to the output of the operators in the processing
+        chain, so all branches share these operators. Branches are processed
+        with :func:`~madam.core.Pipeline.process_branches`.
+
+        :param name: Name of the branch
+        :param operators: Operators to be applied in the branch
+        :raise ValueError: if a branch with the same name already exists
+        """
+        if name in self.branches:
+            raise ValueError('Branch %r already exists' % (name,))
+        self.branches[name] = list(operators)
+
+    def process_branches(self, asset, executor=None, max_workers=None, token=None):
+        """
+        Applies the operators in this pipeline and in each of its branches on
+        the specified asset.
+
+        The branches form a tree: operators that are shared by several branches,
+        i.e. the processing chain and equal leading operators of the branches,
+        are applied only once and their output is passed on to all of these
+        branches. Runs of operators without fan-out are fused where possible.
+
+        If an executor is specified, independent branches are processed in
+        parallel. In this case, an error only affects the branches that depend
+        on the failed operator: a :class:`~madam.core.ProcessingError` is
+        returned in place of their assets.
+
+        If a cancellation token is specified and cancelled, the remaining
+        operator calls fail with an :class:`~madam.core.OperatorCancelledError`.
+        Operator calls in process pools cannot be cancelled.
+
+        :param asset: Asset to be processed
+        :param executor: `'thread'` or `'process'` for a new thread or process pool, or an existing
+            :class:`concurrent.futures.Executor` which is not shut down afterwards
+        :param max_workers: Maximum number of workers of a new pool
+        :param token: :class:`~madam.core.CancellationToken` for the processing, or `None`
+        :return: Dictionary with the processed asset of each branch, in the order the branches were added
+        :raise ValueError: if the pipeline has no branches, or if the executor is invalid
+        """
+        if not self.branches:
+            raise ValueError('Pipeline has no branches')
+        root = _BranchNode()
+        for name, operators in self.branches.items():
+            root.add(name, self.operators + operators)
+
+        results = {}
+        if executor is None:
+            tasks = root.tasks(asset, results)
+            while tasks:
+                operators, node, source_asset = tasks.pop()
+                processed_asset = _apply_operators(operators, source_asset, self.cache, self.observers,
+                                                   self.timeout, token)
+                tasks.extend(node.tasks(processed_asset, results))
+        else:
+            executor, owned_executor = _resolve_executor(executor, max_workers)
+            observers = self._observers_for(executor)
+            if isinstance(executor, ProcessPoolExecutor):
+                token = None
+            pending = {}
+            try:
+                for operators, node, source_asset in root.tasks(asset, results):
+                    pending[executor.submit(_apply_operators, operators, source_asset, self.cache, observers,
+                                            self.timeout, token)] = node, source_asset
+                while pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        node, source_asset = pending.pop(future)
+                        error = future.exception()
+                        if error is not None:
+                            processing_error = ProcessingError('Could not process asset: %s' % error, source_asset)
+                            processing_error.__cause__ = error
+                            for name in node.branch_names():
+                                results[name] = processing_error
+                            continue
+                        for operators, child, child_asset in node.tasks(future.result(), results):
+                            pending[executor.submit(_apply_operators, operators, child_asset, self.cache,
+                                                    observers, self.timeout, token)] = child, child_asset
+            finally:
+                for future in pending:
+                    future.cancel()
+                if owned_executor is not None:
+                    owned_executor.shutdown(wait=True)
+
+        return collections.OrderedDict((name, results[name]) for name in self.branches)
+
+
+_END_OF_STREAM = object()
+_STREAM_POLL_INTERVAL = 0.1
+
+
+class _StreamStopped(Exception):
+    """
+    Represents the termination of a stream by its consumer.
+    """
+    pass
+
+
+def _put_into_stream(stream_queue, item, stop_event):
+    """
+    Puts an item into a stream queue and waits while the queue is full.
+
+    :param stream_queue: Bounded queue
+    :param item: Item to be put into the queue
+    :param stop_event: Event that is set when the stream is terminated
+    :raise _StreamStopped: if the stream was terminated while waiting
+    """
+    while not stop_event.is_set():
+        try:
+            stream_queue.put(item, timeout=_STREAM_POLL_INTERVAL)
+            return
+        except queue.Full:
+            pass
+    raise _StreamStopped()
+
+
+def _get_from_stream(stream_queue, stop_event):
+    """
+    Gets an item from a stream queue and waits while the queue is empty.
+
+    :param stream_queue: Bounded queue
+    :param stop_event: Event that is set when the stream is terminated
+    :return: Item from the queue
+    :raise _StreamStopped: if the stream was terminated while waiting
+    """
+    while not stop_event.is_set():
+        try:
+            return stream_queue.get(timeout=_STREAM_POLL_INTERVAL)
+        except queue.Empty:
+            pass
+    raise _StreamStopped()
+
+
+def _feed_stream(assets, stream_queue, stop_event, errors):
+    """
+    Reads assets from an iterable or an asynchronous iterable into a stream queue.
+
+    If reading fails, the stream is ended and the error is appended to the
+    specified list.
+
+    :param assets: Iterable or asynchronous iterable of assets
+    :param stream_queue: Queue of the first stage
+    :param stop_event: Event that is set when the stream is terminated
+    :param errors: List for errors that occur while reading
+    """
+    try:
+        try:
+            _read_into_stream(assets, stream_queue, stop_event)
+        except _StreamStopped:
+            raise
+        except Exception as error:
+            errors.append(error)
+        _put_into_stream(stream_queue, _END_OF_STREAM, stop_event)
+    except _StreamStopped:
+        pass
+
+
+def _read_into_stream(assets, stream_queue, stop_event):
+    """
+    Reads assets from an iterable or an asynchronous iterable into a stream queue.
+
+    The items of the queue are tuples of an asset and the time in seconds
+    that operators have spent on it so far.
+
+    :param assets: Iterable or asynchronous iterable of assets
+    :param stream_queue: Queue of the first stage
+    :param stop_event: Event that is set when the stream is terminated
+    :raise _StreamStopped: if the stream was terminated
+    """
+    if hasattr(assets, '__aiter__'):
+        loop = asyncio.new_event_loop()
+        try:
+            asset_iterator = assets.__aiter__()
+            while True:
+                try:
+                    asset = loop.run_until_complete(asset_iterator.__anext__())
+                except StopAsyncIteration:
+                    break
+                _put_into_stream(stream_queue, (asset, 0.0), stop_event)
+        finally:
+            loop.close()
+    else:
+        for asset in assets:
+            _put_into_stream(stream_queue, (asset, 0.0), stop_event)
+
+
+class _StreamStage:
+    """
+    Represents a stage of a streaming pipeline, i.e. an operator which is
+    applied by several worker threads.
+    """
+    def __init__(self, operator, worker_count, input_queue, output_queue, stop_event, cache, observers,
+                 timeout=None, token=None):
+        """
+        Initializes a new stage.
+
+        :param operator: Operator to be applied
+        :param worker_count: Number of worker threads
+        :param input_queue: Queue with the assets to be processed
+        :param output_queue: Queue for the processed assets
+        :param stop_event: Event that is set when the stream is terminated
+        :param cache: :class:`~madam.core.OperatorCache` for the results of the operator, or `None`
+        :param observers: Callables that receive an event for every operator call
+        :param timeout: Maximum time in seconds for all operators of the stream per asset, or `None`
+        :param token: :class:`~madam.core.CancellationToken` for the operator, or `None`
+        """
+        self.operator = operator
+        self.worker_count = worker_count
+        self.input_queue = input_queue
+        self.output_queue = output_queue
+        self.stop_event = stop_event
+        self.cache = cache
+        self.observers = observers
+        self.timeout = timeout
+        self.token = token
+        self._mutex = threading.Lock()
+
+    def work(self):
+        """
+        Applies the operator on assets from the input queue until the end of
+        the stream is reached. The last worker to finish passes the end of the
+        stream on to the next stage.
+        """
+        try:
+            while True:
+                item = _get_from_stream(self.input_queue, self.stop_event)
+                if item is _END_OF_STREAM:
+                    # Let the other workers of this stage see the end of the stream as well
+                    _put_into_stream(self.input_queue, item, self.stop_event)
+                    break
+                asset, processing_time = item
+                if not isinstance(asset, ProcessingError):
+                    timeout = None if self.timeout is None else max(self.timeout - processing_time, 0.0)
+                    start_time = time.monotonic()
+                    try:
+                        asset = _apply_operators([self.operator], asset, self.cache, self.observers,
+                                                 timeout, self.token)
+                    except Exception as error:
+                        processing_error = ProcessingError('Could not process asset: %s' % error, asset)
+                        processing_error.__cause__ = error
+                        asset = processing_error
+                    processing_time += time.monotonic() - start_time
+                _put_into_stream(self.output_queue, (asset, processing_time), self.stop_event)
+            with self._mutex:
+                self.worker_count -= 1
+                is_last_worker = self.worker_count == 0
+            if is_last_worker:
+                _put_into_stream(self.output_queue, _END_OF_STREAM, self.stop_event)
+        except _StreamStopped:
+            pass
+
+
+class _BranchNode:
+    """
+    Represents a node in the tree of pipeline branches.
+
+    Each edge of the tree is an operator. Equal operators that follow the same
+    node share an edge, so that they are applied only once.
+    """
+    def __init__(self):
+        self.children = collections.OrderedDict()
+        self.names = []
+
+    def add(self, name, operators):
+        """
+        Adds a branch with the specified operators below this node.
+
+        :param name: Name of the branch
+        :param operators: Operators of the branch
+        """
+        node = self
+        for operator in operators:
+            if isinstance(operator, _ConfiguredOperator):
+                key = operator.signature
+            else:
+                key = id(operator)
+            if key not in node.children:
+                node.children[key] = operator, _BranchNode()
+            node = node.children[key][1]
+        node.names.append(name)
+
+    def branch_names(self):
+        """
+        Returns the names of all branches that end in or below this node.
+
+        :return: List of branch names
+        """
+        names = list(self.names)
+        for _, child in self.children.values():
+            names.extend(child.branch_names())
+        return names
+
+    def tasks(self, asset, results):
+        """
+        Stores the specified output asset of this node for all branches that
+        end here, and returns the work that follows this node.
+
+        Chains of nodes without fan-out are merged into a single task whose
+        operators are fused.
+
+        :param asset: Output asset of this node
+        :param results: Dictionary with the processed assets by branch name
+        :return: List of tuples of fused operators, the node after the operators, and the input asset
+        """
+        for name in self.names:
+            results[name] = asset
+        tasks = []
+        for operator, node in self.children.values():
+            operators = [operator]
+            while not node.names and len(node.children) == 1:
+                operator, node = next(iter(node.children.values()))
+                operators.append(operator)
+            tasks.append((_fuse_operators(operators), node, asset))
+        return tasks
+
+
+def _write_checkpoint(path, checkpoint):
+    """
+    Atomically replaces the checkpoint file at the specified path.
+
+    :param path: Path of the checkpoint file
+    :param checkpoint: JSON-serializable checkpoint data
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile('w', dir=directory, suffix='.tmp', delete=False) as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file)
+    os.replace(checkpoint_file.name, path)
+
+
+def _resolve_executor(executor, max_workers):
+    """
+    Returns the executor for the specified executor argument of a pipeline.
+
+    :param executor: `'thread'` or `'process'` for a new thread or process pool, or an existing
+        :class:`concurrent.futures.Executor`
+    :param max_workers: Maximum number of workers of a new pool
+    :return: Tuple of the executor and the executor that must be shut down, if any
+    :raise ValueError: if the executor is invalid
+    """
+    if isinstance(executor, Executor):
+        return executor, None
+    elif executor == 'thread':
+        executor = ThreadPoolExecutor(max_workers=max_workers or os.cpu_count() or 1)
+    elif executor == 'process':
+        executor = ProcessPoolExecutor(max_workers=max_workers)
+    else:
+        raise ValueError('Invalid executor: %r' % executor)
+    return executor, executor
+
+
+def _fuse_operators(operators):
+    """
+    Replaces runs of consecutive operators of the same processor with fused
+    operators where the processor supports it.
+
+    :param operators: Operators to be fused
+    :return: List of operators
+    """
+    return [fused_operator for fused_operator, _ in _fuse_operator_runs(operators)]
+
+
+def _fuse_operator_runs(operators):
+    """
+    Replaces runs of consecutive operators of the same processor with fused
+    operators where the processor supports it, and keeps track of the
+    original operators.
+
+    :param operators: Operators to be fused
+    :return: List of tuples of operators and the number of original operators they replace
+    """
+    fused_operators = []
+    for _, run in itertools.groupby(operators, key=_operator_processor):
+        run = list(run)
+        processor = _operator_processor(run[0])
+        fused_operator = processor.fuse(run) if len(run) > 1 and processor is not None else None
+        if fused_operator is None:
+            fused_operators.extend((operator, 1) for operator in run)
+        else:
+            fused_operators.append((fused_operator, len(run)))
+    return fused_operators
+
+
+def _operator_processor(operator):
+    """
+    Returns the processor of the specified operator.
+
+    :param operator: Operator
+    :return: Processor of the operator, or `None` if the operator is not bound to a processor
+    """
+    if isinstance(operator, _ConfiguredOperator) and isinstance(operator.args[0], Processor):
+        return operator.args[0]
+    return None
+
+
+def _apply_operators(operators, asset, cache=None, observers=None, timeout=None, token=None):
+    """
+    Applies the specified operators on an asset one after another.
+
+    :param operators: Operators to be applied
+    :param asset: Asset to be processed
+    :param cache: :class:`~madam.core.OperatorCache` for the results of the operators, or `None`
+    :param observers: Callables that receive an event for every operator call
+    :param timeout: Maximum time in seconds for all operators, or `None`
+    :param token: :class:`~madam.core.CancellationToken` for the operators, or `None`
+    :return: Processed asset
+    :raise OperatorTimeoutError: if the operators did not finish in time
+    :raise OperatorCancelledError: if the token was cancelled
+    """
+    with _observed_by(observers), deadline(timeout=timeout, token=token):
+        processed_asset = asset
+        for operator in operators:
+            check_deadline()
+            if cache is None:
+                processed_asset = operator(processed_asset)
+            else:
+                processed_asset = cache.apply(operator, processed_asset)
+    return processed_asset
+
+
+class Processor(metaclass=abc.ABCMeta):
+    """
+    Represents an entity that can create :class:`~madam.core.Asset` objects
+    from binary data.
+
+    Every Processor needs to have a no-args __init__ method in order to be registered correctly.
+    """
+
+    @abc.abstractmethod
+    def can_read(self, file):
+        """
+        Returns whether the specified MIME type is supported by this processor.
+
+        :param file: file-like object to be tested
+        :return: whether the data format of the specified file is supported or not
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def read(self, file):
+        """
+        Returns an :class:`~madam.core.Asset` object whose essence is identical to
+        the contents of the specified file.
+
+        :param file: file-like object to be read
+        :return: Asset with essence
+        :raises UnsupportedFormatError: if the specified data format is not supported
+        """
+        raise NotImplementedError()
+
+    def fuse(self, operators):
+        """
+        Returns a single operator that has the same effect as applying the
+        specified operators of this processor one after another.
+
+        A :class:`~madam.core.Pipeline` calls this method for consecutive
+        operators of the same processor, so that processors can avoid decoding
+        and encoding intermediate results. By default, operators are not fused.
+
+        :param operators: Configured operators of this processor
+        :return: Fused operator, or `None` if the operators cannot be fused
+        """
+        return None
+
+
+class MetadataProcessor(metaclass=abc.ABCMeta):
+    """
+    Represents an entity that can manipulate metadata.
+
+    Every MetadataProcessor needs to have a no-args __init__ method in order to be registered correctly.
+    """
+    @property
+    @abc.abstractmethod
+    def formats(self):
+        """
+        The metadata formats which are supported.
+        :return: supported metadata formats
+        :rtype: tuple
+        """
+        raise NotImplementedError()
 
     @abc.abstractmethod
     def read(self, file):
@@ -627,13 +2807,708 @@ def operator(function):
     """
     @functools.wraps(function)
     def wrapper(self, **kwargs):
-        configured_operator = functools.partial(function, self, **kwargs)
+        configured_operator = _ConfiguredOperator(function, self, **kwargs)
         return configured_operator
     return wrapper
 
 
+class _ConfiguredOperator(functools.partial):
+    """
+    Represents an operator method that is bound to a processor and configured
+    with keyword arguments.
+
+    Unlike plain partial objects of decorated methods, configured operators
+    can be pickled as long as their processor can be pickled. This allows
+    them to be sent to worker processes.
+    """
+    def __reduce__(self):
+        processor = self.args[0]
+        return _configure_operator, (processor, self.func.__name__, self.keywords)
+
+    def __call__(self, *args, **kwargs):
+        if not _observers and not getattr(_observation, 'observers', None):
+            return super().__call__(*args, **kwargs)
+        return _observe_call(self, super().__call__, args, kwargs)
+
+    @property
+    def signature(self):
+        """
+        Canonical, hashable description of the operation, which consists of
+        the qualified name of the processor class, the name of the operator
+        method, and the sorted keyword arguments.
+
+        Two operators with equal signatures produce equal results for equal
+        assets.
+        """
+        processor_class = type(self.args[0])
+        return ('%s.%s' % (processor_class.__module__, processor_class.__qualname__),
+                self.func.__name__,
+                tuple(sorted((key, _canonical(value)) for key, value in self.keywords.items())))
+
+
+def _configure_operator(processor, operator_name, keywords):
+    """
+    Returns the operator of a processor configured with the specified keyword arguments.
+
+    :param processor: Processor with the operator
+    :param operator_name: Name of the operator method
+    :param keywords: Keyword arguments of the operator
+    :return: Configured operator
+    """
+    return getattr(processor, operator_name)(**keywords)
+
+
+def _canonical(value):
+    """
+    Returns a hashable representation of the specified value whose `repr` does
+    not depend on the order of mapping or set items.
+
+    :param value: Value to be transformed
+    :return: Canonical value
+    """
+    if isinstance(value, (dict, frozendict)):
+        return tuple(sorted(((key, _canonical(item)) for key, item in value.items()), key=repr))
+    elif isinstance(value, (set, frozenset)):
+        return tuple(sorted((_canonical(item) for item in value), key=repr))
+    elif isinstance(value, (list, tuple)):
+        return tuple(_canonical(item) for item in value)
+    return value
+
+
+def _asset_digest(asset):
+    """
+    Returns a digest of the essence and the metadata of the specified asset.
+
+    :param asset: Asset to be digested
+    :return: Hexadecimal SHA-256 digest
+    """
+    digest = hashlib.sha256(asset._essence_data)
+    digest.update(repr(_canonical(asset.metadata)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class OperatorCache:
+    """
+    Represents a cache for the results of :func:`~madam.core.operator` calls.
+
+    Results are identified by the digest of the source asset and the signature
+    of the operator. The cache keeps results in memory and, if a directory is
+    specified, on disk, so that they can be shared between processes and
+    program runs. Both levels have a size limit in bytes of essence data and
+    evict the least recently used results first.
+
+    Hits, misses, and evictions are counted in the attributes `hits`,
+    `misses`, and `evictions`.
+    """
+    def __init__(self, max_size=64*1024**2, path=None, max_disk_size=1024**3):
+        """
+        Initializes a new, empty OperatorCache.
+
+        :param max_size: Maximum size of the results in memory in bytes
+        :param path: Directory for results on disk, or `None` to keep results in memory only
+        :param max_disk_size: Maximum size of the results on disk in bytes
+        """
+        self.max_size = max_size
+        self.path = path
+        self.max_disk_size = max_disk_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        self._mutex = threading.RLock()
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['_mutex']
+        state['_entries'] = collections.OrderedDict()
+        state['_size'] = 0
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._mutex = threading.RLock()
+
+    def _disk_entries(self):
+        """
+        Returns the results that are stored on disk, ordered by last use.
+
+        The directory is read every time, so that results written by other
+        processes are taken into account.
+
+        :return: List of tuples of the file name and the file size
+        """
+        entries = []
+        for file_name in os.listdir(self.path):
+            if not file_name.endswith('.asset'):
+                continue
+            try:
+                file_stat = os.stat(os.path.join(self.path, file_name))
+            except FileNotFoundError:
+                continue
+            entries.append((file_stat.st_mtime, file_name, file_stat.st_size))
+        return [(file_name, size) for _, file_name, size in sorted(entries)]
+
+    @staticmethod
+    def key(asset, operator):
+        """
+        Returns the cache key for applying the specified operator on an asset.
+
+        :param asset: Source asset
+        :param operator: Configured operator
+        :return: Tuple of the asset digest and the operator signature
+        :raise ValueError: if the operator has no signature
+        """
+        if not isinstance(operator, _ConfiguredOperator):
+            raise ValueError('Operator %r has no signature' % (operator,))
+        return _asset_digest(asset), operator.signature
+
+    @staticmethod
+    def _file_name(key):
+        """
+        Returns the name of the file that stores the result with the specified key.
+
+        :param key: Cache key
+        :return: File name
+        """
+        return hashlib.sha256(repr(key).encode('utf-8')).hexdigest() + '.asset'
+
+    def get(self, key):
+        """
+        Returns the cached result with the specified key.
+
+        :param key: Cache key
+        :return: Result asset, or `None` if the result is not cached
+        """
+        with self._mutex:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if self.path is not None:
+                asset = self._read_from_disk(self._file_name(key))
+                if asset is not None:
+                    self._put_in_memory(key, asset)
+                    self.hits += 1
+                    return asset
+            self.misses += 1
+            return None
+
+    def put(self, key, asset):
+        """
+        Stores a result in the cache.
+
+        :param key: Cache key
+        :param asset: Result asset
+        """
+        with self._mutex:
+            self._put_in_memory(key, asset)
+            if self.path is not None:
+                self._write_to_disk(self._file_name(key), asset)
+
+    def apply(self, operator, asset):
+        """
+        Applies the specified operator on an asset, or returns the cached result.
+
+        Operators without a signature are always applied.
+
+        :param operator: Operator to be applied
+        :param asset: Source asset
+        :return: Result asset
+        """
+        if not isinstance(operator, _ConfiguredOperator):
+            return operator(asset)
+        key = self.key(asset, operator)
+        result = self.get(key)
+        if result is None:
+            result = operator(asset)
+            self.put(key, result)
+        return result
+
+    def _put_in_memory(self, key, asset):
+        """
+        Stores a result in memory and evicts the least recently used results
+        that exceed the size limit.
+
+        :param key: Cache key
+        :param asset: Result asset
+        """
+        size = len(asset._essence_data)
+        if size > self.max_size:
+            return
+        if key in self._entries:
+            self._size -= self._entries.pop(key)[1]
+        self._entries[key] = asset, size
+        self._size += size
+        while self._size > self.max_size:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self._size -= evicted_size
+            self.evictions += 1
+
+    def _read_from_disk(self, file_name):
+        """
+        Reads a result from disk and marks it as recently used.
+
+        :param file_name: Name of the result file
+        :return: Result asset, or `None` if the file does not exist
+        """
+        file_path = os.path.join(self.path, file_name)
+        try:
+            with open(file_path, 'rb') as file:
+                asset = pickle.load(file)
+            os.utime(file_path)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            # The file does not exist or was removed by another process
+            return None
+        return asset
+
+    def _write_to_disk(self, file_name, asset):
+        """
+        Writes a result to disk and removes the least recently used results
+        that exceed the size limit.
+
+        :param file_name: Name of the result file
+        :param asset: Result asset
+        """
+        data = pickle.dumps(asset)
+        if len(data) > self.max_disk_size:
+            return
+        with tempfile.NamedTemporaryFile(dir=self.path, suffix='.tmp', delete=False) as file:
+            file.write(data)
+        os.replace(file.name, os.path.join(self.path, file_name))
+        # The size limit applies to the results of all processes sharing the directory
+        disk_entries = self._disk_entries()
+        disk_size = sum(size for _, size in disk_entries)
+        for evicted_file_name, evicted_size in disk_entries:
+            if disk_size <= self.max_disk_size:
+                break
+            if evicted_file_name == file_name:
+                continue
+            disk_size -= evicted_size
+            self.evictions += 1
+            try:
+                os.remove(os.path.join(self.path, evicted_file_name))
+            except FileNotFoundError:
+                pass
+
+
+_logger = logging.getLogger(__name__)
+
+#: Observers that receive events for all operator calls
+_observers = []
+
+#: Observers and active operator calls of the current thread
+_observation = threading.local()
+
+_thread_time = getattr(time, 'thread_time', time.process_time)
+
+# ru_maxrss is measured in bytes on macOS and in kilobytes elsewhere
+_MAXRSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+
+def add_observer(observer):
+    """
+    Registers an observer for all operator calls in this process.
+
+    :param observer: Callable that receives an :class:`~madam.core.OperatorEvent` for every operator call
+    """
+    _observers.append(observer)
+
+
+def remove_observer(observer):
+    """
+    Unregisters an observer that was registered with :func:`~madam.core.add_observer`.
+
+    :param observer: Observer to be removed
+    :raise ValueError: if the observer is not registered
+    """
+    _observers.remove(observer)
+
+
+@contextlib.contextmanager
+def _observed_by(observers):
+    """
+    Context manager that lets the specified observers observe all operator
+    calls of the current thread within the block.
+
+    :param observers: Callables that receive an event for every operator call
+    """
+    if not observers:
+        yield
+        return
+    previous_observers = getattr(_observation, 'observers', None)
+    _observation.observers = list(previous_observers or []) + list(observers)
+    try:
+        yield
+    finally:
+        _observation.observers = previous_observers
+
+
+@contextlib.contextmanager
+def track_subprocess():
+    """
+    Context manager that attributes the time spent in the block to a
+    subprocess of the operator calls that are currently observed in this
+    thread.
+
+    Processors should run external programs within this context manager.
+    It has no effect if no operator calls are observed.
+    """
+    calls = getattr(_observation, 'calls', None)
+    if not calls:
+        yield
+        return
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        wall_time = time.perf_counter() - start_time
+        for event in calls:
+            event.subprocess_count += 1
+            event.subprocess_time += wall_time
+
+
+def _essence_size(value):
+    """
+    Returns the size of the essence if the specified value is an asset.
+
+    :param value: Value that might be an asset
+    :return: Size of the essence in bytes, or `None`
+    """
+    if isinstance(value, Asset):
+        return len(value._essence_data)
+    return None
+
+
+def _observe_call(operator, call, args, kwargs):
+    """
+    Calls an operator and sends an event to all observers.
+
+    :param operator: Configured operator
+    :param call: Function that calls the operator
+    :param args: Positional arguments
+    :param kwargs: Keyword arguments
+    :return: Result of the call
+    """
+    event = OperatorEvent(type(operator.args[0]).__name__, operator.func.__name__, operator.keywords)
+    event.input_size = _essence_size(args[0]) if args else None
+    calls = getattr(_observation, 'calls', None)
+    if calls is None:
+        calls = _observation.calls = []
+    calls.append(event)
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start_cpu_time = _thread_time()
+    start_time = time.perf_counter()
+    try:
+        result = call(*args, **kwargs)
+        event.output_size = _essence_size(result)
+        return result
+    except Exception as error:
+        event.error = error
+        raise
+    finally:
+        event.wall_time = time.perf_counter() - start_time
+        event.cpu_time = _thread_time() - start_cpu_time
+        finished_children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        event.subprocess_cpu_time = (finished_children_usage.ru_utime + finished_children_usage.ru_stime -
+                                     children_usage.ru_utime - children_usage.ru_stime)
+        event.memory_delta = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss -
+                              self_usage.ru_maxrss) * _MAXRSS_UNIT
+        calls.pop()
+        for observer in list(_observers) + list(getattr(_observation, 'observers', None) or []):
+            # Failing observers must not change the result of the operator
+            try:
+                observer(event)
+            except Exception:
+                _logger.exception('Observer %r failed for operator %s', observer, event.operator)
+
+
+class OperatorEvent:
+    """
+    Represents a single call of an :func:`~madam.core.operator`.
+
+    Times are measured in seconds and sizes in bytes. Subprocess CPU time and
+    peak memory are measured for the whole process, so they also include the
+    work of other threads that run at the same time.
+    """
+    def __init__(self, processor, operator, keywords):
+        """
+        Initializes a new OperatorEvent.
+
+        :param processor: Class name of the processor
+        :param operator: Name of the operator method
+        :param keywords: Keyword arguments of the operator
+        """
+        #: Class name of the processor
+        self.processor = processor
+        #: Name of the operator method
+        self.operator = operator
+        #: Keyword arguments of the operator
+        self.keywords = dict(keywords)
+        #: Elapsed time of the call
+        self.wall_time = 0.0
+        #: CPU time of the calling thread
+        self.cpu_time = 0.0
+        #: Essence size of the input asset
+        self.input_size = None
+        #: Essence size of the output asset
+        self.output_size = None
+        #: Number of subprocesses that were run
+        self.subprocess_count = 0
+        #: Elapsed time of the subprocesses
+        self.subprocess_time = 0.0
+        #: CPU time of subprocesses that finished during the call
+        self.subprocess_cpu_time = 0.0
+        #: Growth of the peak memory usage of the process
+        self.memory_delta = 0
+        #: Exception raised by the call, or `None`
+        self.error = None
+
+    @property
+    def name(self):
+        """
+        Qualified name of the operator, e.g. ``'PillowProcessor.resize'``.
+        """
+        return '%s.%s' % (self.processor, self.operator)
+
+
+class OperatorStatistics:
+    """
+    Represents an observer which aggregates operator events by operator.
+
+    Instances can be passed as observers to a :class:`~madam.core.Pipeline`
+    or to :func:`~madam.core.add_observer`.
+    """
+    _COLUMNS = (
+        ('Operator', '%-40s'),
+        ('Calls', '%7d'),
+        ('Errors', '%7d'),
+        ('Wall [s]', '%10.3f'),
+        ('CPU [s]', '%10.3f'),
+        ('Subproc.', '%9d'),
+        ('Subproc. [s]', '%13.3f'),
+        ('In [MB]', '%10.2f'),
+        ('Out [MB]', '%10.2f'),
+        ('Peak mem. +[MB]', '%16.2f'),
+    )
+
+    def __init__(self):
+        """
+        Initializes new OperatorStatistics without any recorded events.
+        """
+        self.by_operator = collections.OrderedDict()
+        self._mutex = threading.Lock()
+
+    def __call__(self, event):
+        with self._mutex:
+            statistics = self.by_operator.get(event.name)
+            if statistics is None:
+                statistics = self.by_operator[event.name] = dict(
+                    calls=0, errors=0, wall_time=0.0, cpu_time=0.0, subprocess_count=0,
+                    subprocess_time=0.0, input_size=0, output_size=0, memory_delta=0)
+            statistics['calls'] += 1
+            statistics['errors'] += event.error is not None
+            statistics['wall_time'] += event.wall_time
+            statistics['cpu_time'] += event.cpu_time
+            statistics['subprocess_count'] += event.subprocess_count
+            statistics['subprocess_time'] += event.subprocess_time
+            statistics['input_size'] += event.input_size or 0
+            statistics['output_size'] += event.output_size or 0
+            statistics['memory_delta'] += event.memory_delta
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['_mutex']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._mutex = threading.Lock()
+
+    def summary(self):
+        """
+        Returns a table with the aggregated statistics of each operator,
+        ordered by total wall time.
+
+        :return: Table as string
+        """
+        header_formats = [format_string.rstrip('dfs').split('.')[0] + 's' for _, format_string in self._COLUMNS]
+        lines = [' '.join(header_format % title for header_format, (title, _)
+                          in zip(header_formats, self._COLUMNS))]
+        with self._mutex:
+            rows = sorted(self.by_operator.items(), key=lambda item: item[1]['wall_time'], reverse=True)
+            for name, statistics in rows:
+                values = (name, statistics['calls'], statistics['errors'], statistics['wall_time'],
+                          statistics['cpu_time'], statistics['subprocess_count'], statistics['subprocess_time'],
+                          statistics['input_size']/1024**2, statistics['output_size']/1024**2,
+                          statistics['memory_delta']/1024**2)
+                lines.append(' '.join(format_string % value for (_, format_string), value
+                                      in zip(self._COLUMNS, values)))
+        return '\n'.join(lines)
+
+    def print_summary(self, file=None):
+        """
+        Prints the table returned by :func:`~madam.core.OperatorStatistics.summary`.
+
+        :param file: File-like object to print to; defaults to standard output
+        """
+        print(self.summary(), file=file)
+
+
+class CancellationToken:
+    """
+    Represents a token that can be used to cancel running operators.
+
+    Operators check the tokens of the current thread cooperatively with
+    :func:`~madam.core.check_deadline`, e.g. between the operators of a
+    pipeline or while they wait for a subprocess.
+    """
+    def __init__(self):
+        """
+        Initializes a new token that is not cancelled.
+        """
+        self.__event = threading.Event()
+
+    def cancel(self):
+        """
+        Cancels all operators that use this token.
+        """
+        self.__event.set()
+
+    @property
+    def cancelled(self):
+        """
+        Returns whether the token was cancelled.
+
+        :return: `True` if the token was cancelled, `False` otherwise
+        """
+        return self.__event.is_set()
+
+
+#: Deadline and cancellation tokens of the current thread
+_execution = threading.local()
+
+
+@contextlib.contextmanager
+def deadline(timeout=None, token=None):
+    """
+    Context manager that limits the time of all operator calls of the
+    current thread within the block, and lets a token cancel them.
+
+    Nested deadlines cannot extend the deadline of an enclosing block.
+
+    :param timeout: Maximum time in seconds, or `None`
+    :type timeout: float
+    :param token: :class:`~madam.core.CancellationToken`, or `None`
+    """
+    previous_deadline = getattr(_execution, 'deadline', None)
+    previous_tokens = getattr(_execution, 'tokens', ())
+    if timeout is not None:
+        end_time = time.monotonic() + timeout
+        _execution.deadline = end_time if previous_deadline is None else min(previous_deadline, end_time)
+    if token is not None:
+        _execution.tokens = previous_tokens + (token,)
+    try:
+        yield
+    finally:
+        _execution.deadline = previous_deadline
+        _execution.tokens = previous_tokens
+
+
+def propagate_deadline(function):
+    """
+    Returns a function that calls the specified function under the deadline
+    and the cancellation tokens of the current thread.
+
+    Operators can use it to hand parts of their work to other threads.
+
+    :param function: Callable to be wrapped
+    :return: Wrapped callable
+    """
+    end_time = getattr(_execution, 'deadline', None)
+    tokens = getattr(_execution, 'tokens', ())
+
+    @functools.wraps(function)
+    def call_with_deadline(*args, **kwargs):
+        previous_deadline = getattr(_execution, 'deadline', None)
+        previous_tokens = getattr(_execution, 'tokens', ())
+        _execution.deadline = end_time
+        _execution.tokens = tokens
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _execution.deadline = previous_deadline
+            _execution.tokens = previous_tokens
+    return call_with_deadline
+
+
+def remaining_time():
+    """
+    Returns the time that is left until the deadline of the current thread.
+
+    :return: Remaining time in seconds, or `None` if there is no deadline
+    """
+    end_time = getattr(_execution, 'deadline', None)
+    if end_time is None:
+        return None
+    return max(end_time - time.monotonic(), 0.0)
+
+
+def check_deadline():
+    """
+    Checks whether the operator calls of the current thread may go on.
+
+    Long-running operators should call this function regularly.
+
+    :raise OperatorTimeoutError: if the deadline has passed
+    :raise OperatorCancelledError: if a token was cancelled
+    """
+    if any(token.cancelled for token in getattr(_execution, 'tokens', ())):
+        raise OperatorCancelledError('Operation was cancelled')
+    if remaining_time() == 0:
+        raise OperatorTimeoutError('Operation did not finish in time')
+
+
 class OperatorError(Exception):
     """
     Represents an error that is raised whenever an error occurs in an :func:`~madam.core.operator`.
     """
     pass
+
+
+class OperatorTimeoutError(OperatorError):
+    """
+    Represents an error that is raised whenever an operator does not finish
+    before its deadline.
+    """
+    pass
+
+
+class OperatorCancelledError(OperatorError):
+    """
+    Represents an error that is raised whenever an operator is cancelled with
+    a :class:`~madam.core.CancellationToken`.
+    """
+    pass
+
+
+class ProcessingError(Exception):
+    """
+    Represents an error that occurred while processing an asset in a
+    :class:`~madam.core.Pipeline`.
+
+    The original error is available as ``__cause__``.
+    """
+    def __init__(self, message, asset):
+        """
+        Initializes a new ProcessingError.
+
+        :param message: Error message
+        :param asset: Asset whose processing failed
+        """
+        super().__init__(message)
+        self.asset = asset
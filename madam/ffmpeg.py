@@ -1,30 +1,470 @@
+import collections
+import contextlib
+import dbm
+import functools
+import glob
+import hashlib
+import heapq
 import io
+import itertools
 import json
+import math
 import multiprocessing
 import os
+import re
 import shutil
 import subprocess
+import tarfile
 import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy
 from bidict import bidict
 
 from madam.core import Asset, MetadataProcessor, Processor, operator, OperatorError, UnsupportedFormatError
-from madam.future import CalledProcessError, subprocess_run
+from madam.core import OperatorTimeoutError, check_deadline, propagate_deadline, remaining_time, track_subprocess
+from madam.core import LockTimeoutError, _file_lock
+from madam.future import POLL_INTERVAL, CalledProcessError, subprocess_run, write_input
+
+
+class FFmpegScheduler:
+    """
+    Represents a scheduler that limits the resources used by the FFmpeg
+    subprocesses of all processors in the current process.
+
+    At most `max_processes` subprocesses run at the same time, and further
+    subprocesses wait in a queue that is ordered by priority and arrival.
+    Encoding subprocesses receive an equal share of the thread budget
+    `max_threads`.
+    """
+    def __init__(self, max_processes=None, max_threads=None):
+        """
+        Initializes a new FFmpegScheduler.
+
+        :param max_processes: Maximum number of concurrent subprocesses, or `None` for the number of CPUs
+        :type max_processes: int
+        :param max_threads: Total number of threads for all running subprocesses, or `None` for the number of CPUs
+        :type max_threads: int
+        """
+        self.__condition = threading.Condition()
+        self.__queue = []
+        self.__sequence = itertools.count()
+        self.__priority = threading.local()
+        self.running = 0
+        self.max_processes = 1
+        self.max_threads = 1
+        self.configure(max_processes=max_processes, max_threads=max_threads)
+
+    def configure(self, max_processes=None, max_threads=None):
+        """
+        Changes the limits of the scheduler.
+
+        :param max_processes: Maximum number of concurrent subprocesses, or `None` for the number of CPUs
+        :type max_processes: int
+        :param max_threads: Total number of threads for all running subprocesses, or `None` for the number of CPUs
+        :type max_threads: int
+        :raise ValueError: if a limit is smaller than 1
+        """
+        cpu_count = multiprocessing.cpu_count()
+        max_processes = cpu_count if max_processes is None else max_processes
+        max_threads = cpu_count if max_threads is None else max_threads
+        if max_processes < 1 or max_threads < 1:
+            raise ValueError('Invalid limits: %r processes, %r threads' % (max_processes, max_threads))
+        with self.__condition:
+            self.max_processes = max_processes
+            self.max_threads = max_threads
+            self.__condition.notify_all()
+
+    @property
+    def waiting(self):
+        """
+        Returns the number of subprocesses that wait for a slot.
+
+        :return: Number of waiting subprocesses
+        """
+        with self.__condition:
+            return len(self.__queue)
+
+    @contextlib.contextmanager
+    def priority(self, priority):
+        """
+        Returns a context manager that sets the priority of the subprocesses
+        started by the current thread.
+
+        Subprocesses with lower values are started first. The default
+        priority is 0.
+
+        :param priority: Priority of the subprocesses
+        :type priority: int
+        """
+        previous_priority = getattr(self.__priority, 'value', 0)
+        self.__priority.value = priority
+        try:
+            yield
+        finally:
+            self.__priority.value = previous_priority
+
+    def propagate_priority(self, function):
+        """
+        Returns a function that calls the specified function with the
+        subprocess priority of the current thread.
+
+        Processors can use it to start subprocesses from other threads.
+
+        :param function: Callable to be wrapped
+        :return: Wrapped callable
+        """
+        priority = getattr(self.__priority, 'value', 0)
+
+        @functools.wraps(function)
+        def call_with_priority(*args, **kwargs):
+            with self.priority(priority):
+                return function(*args, **kwargs)
+        return call_with_priority
+
+    @contextlib.contextmanager
+    def slot(self, priority=None):
+        """
+        Returns a context manager that waits for a free subprocess slot and
+        holds it until the context is left.
+
+        The context value is the number of threads the subprocess should use.
+        Waiting ends early when the deadline of the current thread passes
+        (see :func:`~madam.core.deadline`).
+
+        :param priority: Priority of the subprocess, or `None` for the priority of the current thread
+        :type priority: int
+        :raise OperatorTimeoutError: if the deadline passed while waiting
+        :raise OperatorCancelledError: if the operator was cancelled while waiting
+        """
+        if priority is None:
+            priority = getattr(self.__priority, 'value', 0)
+        entry = (priority, next(self.__sequence))
+        with self.__condition:
+            heapq.heappush(self.__queue, entry)
+            while self.__queue[0] != entry or self.running >= self.max_processes:
+                try:
+                    check_deadline()
+                except Exception:
+                    self.__queue.remove(entry)
+                    heapq.heapify(self.__queue)
+                    self.__condition.notify_all()
+                    raise
+                self.__condition.wait(POLL_INTERVAL)
+            heapq.heappop(self.__queue)
+            self.running += 1
+            jobs = min(self.max_processes, self.running + len(self.__queue))
+            threads = max(1, self.max_threads // jobs)
+            self.__condition.notify_all()
+        try:
+            yield threads
+        finally:
+            with self.__condition:
+                self.running -= 1
+                self.__condition.notify_all()
+
+
+#: Scheduler that is shared by all FFmpeg subprocesses
+scheduler = FFmpegScheduler()
+
+#: Placeholder for the number of threads of an output in commands for :func:`~madam.ffmpeg._run`
+_THREADS = object()
+
+
+def _run(command, threaded=False, **kwargs):
+    """
+    Runs an FFmpeg command as soon as the scheduler allows it.
+
+    The command is killed when the deadline of the current thread passes or
+    when the operator is cancelled (see :func:`~madam.core.deadline`).
+
+    Commands with several outputs can contain the placeholder `_THREADS`
+    after `-threads` options; the threads of the scheduler are divided among
+    these outputs.
+
+    :param command: Command line as list of strings and `_THREADS` placeholders
+    :param threaded: Whether the number of threads should be set by the scheduler
+    :type threaded: bool
+    :param kwargs: Additional arguments for :func:`subprocess.run`
+    :return: Completed process
+    :raise OperatorTimeoutError: if the command did not finish in time
+    :raise OperatorCancelledError: if the operator was cancelled
+    """
+    check_deadline()
+    with scheduler.slot() as threads:
+        placeholder_count = sum(1 for argument in command if argument is _THREADS)
+        if placeholder_count:
+            output_threads = str(max(1, threads//placeholder_count))
+            command = [output_threads if argument is _THREADS else argument for argument in command]
+        elif threaded:
+            # Output options follow the last input file
+            output_index = len(command) - command[::-1].index('-i') + 1
+            command = command[:output_index] + ['-threads', str(threads)] + command[output_index:]
+        with track_subprocess():
+            try:
+                return subprocess_run(command, timeout=remaining_time(), poll=check_deadline, **kwargs)
+            except subprocess.TimeoutExpired:
+                raise OperatorTimeoutError('Command did not finish in time: %s' % command[0])
+
+
+@contextlib.contextmanager
+def _stream(command, input=None):
+    """
+    Starts an FFmpeg command as soon as the scheduler allows it and returns a
+    context manager whose value is the unbuffered standard output of the
+    running process.
+
+    The input bytes are written to the standard input of the process by a
+    separate thread. The process is killed if the context is left with an
+    error.
+
+    The scheduler slot is released as soon as the process has started: the
+    process only runs as fast as its output is read, and the reader may run
+    other FFmpeg commands before it reads on. Streaming processes therefore
+    do not count towards the process limit of the scheduler.
+
+    :param command: Command line as list of strings
+    :param input: Bytes that are passed to the standard input of the process, or `None`
+    :raise CalledProcessError: if the command finished with a non-zero exit code
+    :raise OperatorTimeoutError: if the command did not finish in time
+    :raise OperatorCancelledError: if the operator was cancelled
+    """
+    check_deadline()
+    with track_subprocess(), tempfile.TemporaryFile() as stderr:
+        with scheduler.slot():
+            process = subprocess.Popen(command, bufsize=0,
+                                       stdin=subprocess.DEVNULL if input is None else subprocess.PIPE,
+                                       stdout=subprocess.PIPE, stderr=stderr)
+        writer = None
+        if input is not None:
+            writer = threading.Thread(target=write_input, args=(process.stdin, input), daemon=True)
+            writer.start()
+        try:
+            yield process.stdout
+            try:
+                process.wait(timeout=remaining_time())
+            except subprocess.TimeoutExpired:
+                raise OperatorTimeoutError('Command did not finish in time: %s' % command[0])
+        except BaseException:
+            process.kill()
+            process.wait()
+            raise
+        finally:
+            process.stdout.close()
+            if writer is not None:
+                writer.join()
+        if process.returncode:
+            stderr.seek(0)
+            raise CalledProcessError(returncode=process.returncode, cmd=command, stderr=stderr.read())
+
+
+def _escape_filter_option(value):
+    """
+    Escapes a string for use as an option value in a filtergraph description.
+
+    The value is escaped for the option parser of the filter first, and then
+    for the filtergraph parser.
+
+    :param value: Option value
+    :return: Escaped option value
+    """
+    for special_characters in ("\\':", "\\'[],;"):
+        value = ''.join('\\' + character if character in special_characters else character
+                        for character in value)
+    return value
+
+
+def _read_frames(pipe, buffer):
+    """
+    Fills a NumPy array with raw samples that are read from a pipe.
+
+    The samples are written to the memory of the array directly.
+
+    :param pipe: Unbuffered file-like object of the pipe
+    :param buffer: C-contiguous array of shape (frames, channels)
+    :return: Number of complete frames that were read
+    """
+    view = memoryview(buffer.reshape(-1).view(numpy.uint8))
+    size = 0
+    while size < len(view):
+        count = pipe.readinto(view[size:])
+        if not count:
+            break
+        size += count
+    return size//(buffer.itemsize*buffer.shape[1])
+
+
+class ProbeCache:
+    """
+    Represents a cache for the results of ffprobe.
+
+    Results are identified by the digest of the probed data and the version
+    of ffprobe. The cache keeps the most recently used results in memory and,
+    if a path is specified, all results in a dbm database on disk, so that
+    they can be shared between processes and program runs. Access to the
+    database is coordinated using a lock file next to it, independent of the
+    dbm implementation. The database is skipped if its lock cannot be
+    acquired within the lock timeout.
+
+    Hits and misses are counted in the attributes `hits`, `disk_hits`, and
+    `misses`.
+    """
+    def __init__(self, max_entries=1024, path=None, lock_timeout=1.0):
+        """
+        Initializes a new, empty ProbeCache.
+
+        :param max_entries: Maximum number of results in memory
+        :type max_entries: int
+        :param path: Path of the database on disk, or `None` to keep results in memory only
+        :param lock_timeout: Maximum time in seconds to wait for the lock of the database
+        :type lock_timeout: float
+        """
+        self.max_entries = max_entries
+        self.path = path
+        self.lock_path = None if path is None else path + '.lock'
+        self.lock_timeout = lock_timeout
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._mutex = threading.RLock()
+
+    @property
+    def hit_rate(self):
+        """
+        Returns the fraction of lookups that were answered by the cache.
+
+        :return: Hit rate between 0 and 1, or `None` if there were no lookups
+        """
+        lookups = self.hits + self.misses
+        if not lookups:
+            return None
+        return self.hits/lookups
+
+    @staticmethod
+    def key(data, version):
+        """
+        Returns the cache key for probing the specified data.
+
+        :param data: Probed bytes
+        :param version: Version of ffprobe
+        :return: Cache key as string
+        """
+        return '%s:%s' % (version, hashlib.sha256(data).hexdigest())
+
+    def get(self, key):
+        """
+        Returns the cached result with the specified key.
+
+        :param key: Cache key
+        :return: Parsed ffprobe output, or `None` if the result is not cached
+        """
+        with self._mutex:
+            result = self._entries.get(key)
+            if result is None and self.path is not None:
+                try:
+                    with _file_lock(self.lock_path, shared=True, timeout=self.lock_timeout), \
+                            dbm.open(self.path, 'r') as database:
+                        result = database.get(key.encode('utf-8'))
+                except LockTimeoutError:
+                    result = None
+                except dbm.error:
+                    result = None
+                if result is not None:
+                    result = result.decode('utf-8')
+                    self._put_in_memory(key, result)
+                    self.disk_hits += 1
+            if result is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        # Every caller receives its own copy of the result
+        return json.loads(result)
+
+    def put(self, key, probe_data):
+        """
+        Stores a result in the cache.
+
+        :param key: Cache key
+        :param probe_data: Parsed ffprobe output
+        """
+        result = json.dumps(probe_data)
+        with self._mutex:
+            self._put_in_memory(key, result)
+            if self.path is not None:
+                try:
+                    with _file_lock(self.lock_path, timeout=self.lock_timeout), \
+                            dbm.open(self.path, 'c') as database:
+                        database[key.encode('utf-8')] = result.encode('utf-8')
+                except LockTimeoutError:
+                    pass
+                except dbm.error:
+                    pass
+
+    def _put_in_memory(self, key, result):
+        """
+        Stores a serialized result in memory and evicts the least recently
+        used results that exceed the size limit.
+
+        :param key: Cache key
+        :param result: ffprobe output as JSON string
+        """
+        self._entries[key] = result
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+#: Cache that is shared by all ffprobe calls; can be replaced to configure it
+probe_cache = ProbeCache()
+
+
+@functools.lru_cache(maxsize=None)
+def _ffprobe_version():
+    """
+    Returns the version of the installed ffprobe.
+
+    :return: Version string
+    """
+    result = _run('ffprobe -version'.split(), stdout=subprocess.PIPE)
+    return result.stdout.decode('utf-8').split()[2]
+
+
+def _parse_version(version_string):
+    """
+    Returns the numeric components of an FFmpeg version string.
+
+    :param version_string: Version string, e.g. `'4.4.2-0ubuntu0.22.04.1'` or `'n6.0'`
+    :return: Tuple of integers, or `None` for versions without number like development builds
+    """
+    match = re.match(r'n?(\d+(?:\.\d+)*)', version_string)
+    if match is None:
+        return None
+    return tuple(int(component) for component in match.group(1).split('.'))
 
 
 def _probe(file):
+    data = file.read()
+    file.seek(0)
+    key = probe_cache.key(data, _ffprobe_version())
+    json_obj = probe_cache.get(key)
+    if json_obj is not None:
+        return json_obj
+
     with tempfile.NamedTemporaryFile(mode='wb') as temp_in:
-        shutil.copyfileobj(file, temp_in.file)
+        temp_in.write(data)
         temp_in.flush()
-        file.seek(0)
 
         command = 'ffprobe -loglevel error -print_format json -show_format -show_streams'.split()
         command.append(temp_in.name)
-        result = subprocess_run(command, stdout=subprocess.PIPE,
-                                stderr=subprocess.PIPE, check=True)
+        result = _run(command, stdout=subprocess.PIPE,
+                      stderr=subprocess.PIPE, check=True)
 
     string_result = result.stdout.decode('utf-8')
     json_obj = json.loads(string_result)
+    probe_cache.put(key, json_obj)
 
     return json_obj
 
@@ -43,37 +483,138 @@ def _get_decoder_and_stream_type(probe_data):
     return decoder_name, stream_type
 
 
-class _FFmpegContext(tempfile.TemporaryDirectory):
-    def __init__(self, source, result):
-        super().__init__(prefix='madam')
+#: MIME types whose demuxers can read from a pipe
+_PIPE_INPUT_MIME_TYPES = frozenset(['audio/mpeg', 'audio/ogg', 'audio/wav', 'video/ogg', 'video/x-matroska'])
+
+#: Muxers that can write to a pipe, and the names under which they do so
+_PIPE_OUTPUT_FORMATS = {
+    'image2': 'image2pipe',
+    'mp3': 'mp3',
+    'ogg': 'ogg',
+    'u8': 'u8',
+    's16le': 's16le',
+    's32le': 's32le',
+    'f32le': 'f32le',
+    'f64le': 'f64le',
+}
+
+#: NumPy data types of the raw sample formats that audio can be decoded to
+_PCM_SAMPLE_TYPES = {
+    'u8': numpy.dtype('u1'),
+    's16le': numpy.dtype('<i2'),
+    's32le': numpy.dtype('<i4'),
+    'f32le': numpy.dtype('<f4'),
+    'f64le': numpy.dtype('<f8'),
+}
+
+#: Video decoders that can reduce the resolution while decoding, and the
+#: maximum power of two by which they can reduce it
+_LOWRES_DECODERS = {
+    'h263': 3,
+    'mjpeg': 3,
+    'mpeg1video': 3,
+    'mpeg2video': 3,
+    'mpeg4': 3,
+}
+
+
+class _FFmpegContext:
+    """
+    Represents the input and output files of an FFmpeg command.
+
+    The source is passed to FFmpeg over standard input if its demuxer does
+    not need to seek, and the result is read from standard output if its
+    muxer does not need to seek. Otherwise, temporary files are used.
+    """
+    def __init__(self, source, result, input_mime_type=None, output_format=None):
+        """
+        Initializes a new context.
+
+        The temporary directory of the context is available as `directory`
+        if any temporary files are used.
+
+        :param source: File-like object with the input data
+        :param result: File-like object that receives the output data
+        :param input_mime_type: MIME type of the input, or `None` if the input must be seekable
+        :param output_format: Name of the FFmpeg muxer for the output, or `None` if unknown
+        """
         self.__source = source
         self.__result = result
+        self.__tmpdir = None
+        self.directory = None
+        self.pipe_input = input_mime_type in _PIPE_INPUT_MIME_TYPES
+        self.pipe_output = output_format in _PIPE_OUTPUT_FORMATS
+        self.output_format = _PIPE_OUTPUT_FORMATS[output_format] if self.pipe_output else output_format
+        self.input_path = 'pipe:0'
+        self.output_path = 'pipe:1'
 
     def __enter__(self):
-        tmpdir_path = super().__enter__()
-        self.input_path = os.path.join(tmpdir_path, 'input_file')
-        self.output_path = os.path.join(tmpdir_path, 'output_file')
+        if not (self.pipe_input and self.pipe_output):
+            self.__tmpdir = tempfile.TemporaryDirectory(prefix='madam')
+            tmpdir_path = self.directory = self.__tmpdir.name
+            if not self.pipe_input:
+                self.input_path = os.path.join(tmpdir_path, 'input_file')
+                with open(self.input_path, 'wb') as temp_in:
+                    shutil.copyfileobj(self.__source, temp_in)
+                    self.__source.seek(0)
+            if not self.pipe_output:
+                self.output_path = os.path.join(tmpdir_path, 'output_file')
+
+        return self
+
+    def run(self, command, **kwargs):
+        """
+        Runs an FFmpeg command that uses the input and output paths of this
+        context.
 
-        with open(self.input_path, 'wb') as temp_in:
-            shutil.copyfileobj(self.__source, temp_in)
+        :param command: Command line as list of strings
+        :param kwargs: Additional arguments for :func:`~madam.ffmpeg._run`
+        :return: Completed process
+        """
+        if self.pipe_input:
+            kwargs['input'] = self.__source.read()
             self.__source.seek(0)
+        if self.pipe_output:
+            kwargs['stdout'] = subprocess.PIPE
+        completed_process = _run(command, **kwargs)
+        if self.pipe_output:
+            self.__result.write(completed_process.stdout)
+            self.__result.seek(0)
+        return completed_process
+
+    def stream(self, command):
+        """
+        Starts an FFmpeg command that uses the input path of this context and
+        writes its output to standard output.
 
-        return self
+        :param command: Command line as list of strings
+        :return: Context manager whose value is the standard output of the process
+        """
+        input = None
+        if self.pipe_input:
+            input = self.__source.read()
+            self.__source.seek(0)
+        return _stream(command, input=input)
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if os.path.exists(self.output_path):
-            with open(self.output_path, 'rb') as temp_out:
-                shutil.copyfileobj(temp_out, self.__result)
-                self.__result.seek(0)
-
-        super().__exit__(exc_type, exc_val, exc_tb)
+        if self.__tmpdir is None:
+            return
+        try:
+            if exc_type is None and not self.pipe_output and os.path.exists(self.output_path):
+                with open(self.output_path, 'rb') as temp_out:
+                    shutil.copyfileobj(temp_out, self.__result)
+                    self.__result.seek(0)
+        finally:
+            self.__tmpdir.cleanup()
 
 
 class FFmpegProcessor(Processor):
     """
     Represents a processor that uses FFmpeg to read audio and video data.
 
-    The minimum version of FFmpeg required is v0.9.
+    The minimum version of FFmpeg required is v0.9. Creating adaptive
+    streaming packages with :func:`~madam.ffmpeg.FFmpegProcessor.package`
+    requires v4.1 or later.
     """
 
     __decoder_and_stream_type_to_mime_type = {
@@ -112,15 +653,12 @@ class FFmpegProcessor(Processor):
         super().__init__()
 
         self._min_version = '0.9'
-        command = 'ffprobe -version'.split()
-        result = subprocess_run(command, stdout=subprocess.PIPE)
-        string_result = result.stdout.decode('utf-8')
-        version_string = string_result.split()[2]
+        self._min_package_version = '4.1'
+        version_string = _ffprobe_version()
         if version_string < self._min_version:
             raise EnvironmentError('Found ffprobe version %s. Requiring at least version %s.'
                                    % (version_string, self._min_version))
-
-        self.__threads = multiprocessing.cpu_count()
+        self._ffmpeg_version = _parse_version(version_string)
 
     def can_read(self, file):
         try:
@@ -188,19 +726,15 @@ class FFmpegProcessor(Processor):
             raise OperatorError('Cannot resize asset of type %s')
 
         result = io.BytesIO()
-        with _FFmpegContext(asset.essence, result) as ctx:
-            with open(ctx.input_path, 'wb') as temp_in:
-                shutil.copyfileobj(asset.essence, temp_in)
-                temp_in.flush()
-
+        with _FFmpegContext(asset.essence, result, input_mime_type=asset.mime_type,
+                            output_format=encoder_name) as ctx:
             command = ['ffmpeg', '-loglevel', 'error',
                        '-f', encoder_name, '-i', ctx.input_path,
                        '-filter:v', 'scale=%d:%d' % (width, height),
-                       '-threads', str(self.__threads),
-                       '-f', encoder_name, '-y', ctx.output_path]
+                       '-f', ctx.output_format, '-y', ctx.output_path]
 
             try:
-                subprocess_run(command, stderr=subprocess.PIPE, check=True)
+                ctx.run(command, threaded=True, stderr=subprocess.PIPE, check=True)
             except CalledProcessError as ffmpeg_error:
                 error_message = ffmpeg_error.stderr.decode('utf-8')
                 raise OperatorError('Could not resize video asset: %s' % error_message)
@@ -209,7 +743,7 @@ class FFmpegProcessor(Processor):
                      width=width, height=height, duration=asset.duration)
 
     @operator
-    def convert(self, asset, mime_type, video=None, audio=None, subtitles=None):
+    def convert(self, asset, mime_type, video=None, audio=None, subtitles=None, segments=1):
         """
         Creates a new asset of the specified MIME type from the essence of the
         specified asset.
@@ -218,6 +752,14 @@ class FFmpegProcessor(Processor):
         Options are passed as dictionary instances and can contain various keys for
         each stream type.
 
+        Videos can be converted in segments to use more CPU cores than a
+        single encoder does: the video stream is split at keyframes into
+        about the specified number of segments, the segments are encoded in
+        parallel, and the results are concatenated. Audio is encoded in one
+        piece alongside the segments to avoid gaps at the segment boundaries.
+        Segmented conversions only keep the first video stream and the audio
+        streams.
+
         **Options for video streams:**
 
         - **codec** – Processor-specific name of the video codec as string
@@ -237,46 +779,20 @@ class FFmpegProcessor(Processor):
         :param video: Dictionary with options for video streams.
         :param audio: Dictionary with options for audio streams.
         :param subtitles: Dictionary with the options for subtitle streams.
+        :param segments: Number of segments that are converted in parallel
+        :type segments: int
         :return: New asset with converted essence
         """
         encoder_name = self.__mime_type_to_encoder.get(mime_type)
         if not encoder_name:
             raise UnsupportedFormatError('Unsupported asset type: %s' % mime_type)
 
-        result = io.BytesIO()
-        with _FFmpegContext(asset.essence, result) as ctx:
-            command = ['ffmpeg', '-loglevel', 'error',
-                       '-i', ctx.input_path]
-            if video is not None:
-                if 'codec' in video:
-                    if video['codec']:
-                        command.extend(['-c:v', video['codec']])
-                    else:
-                        command.extend(['-vn'])
-                if video.get('bitrate'):
-                    command.extend(['-b:v', '%dk' % video['bitrate']])
-            if audio is not None:
-                if 'codec' in audio:
-                    if audio['codec']:
-                        command.extend(['-c:a', audio['codec']])
-                    else:
-                        command.extend(['-an'])
-                if audio.get('bitrate'):
-                    command.extend(['-b:a', '%dk' % audio['bitrate']])
-            if subtitles is not None:
-                if 'codec' in subtitles:
-                    if subtitles['codec']:
-                        command.extend(['-c:s', subtitles['codec']])
-                    else:
-                        command.extend(['-sn'])
-            command.extend(['-threads', str(self.__threads),
-                            '-f', encoder_name, '-y', ctx.output_path])
-
-            try:
-                subprocess_run(command, stderr=subprocess.PIPE, check=True)
-            except CalledProcessError as ffmpeg_error:
-                error_message = ffmpeg_error.stderr.decode('utf-8')
-                raise OperatorError('Could not convert video asset: %s' % error_message)
+        is_video_kept = video is None or 'codec' not in video or video['codec']
+        if segments > 1 and is_video_kept and asset.mime_type.startswith('video/') and \
+                mime_type.startswith('video/') and asset.metadata.get('duration'):
+            result = self._convert_segmented(asset, encoder_name, segments, video=video, audio=audio)
+        else:
+            result = self._convert_whole(asset, encoder_name, video=video, audio=audio, subtitles=subtitles)
 
         metadata = {
             'mime_type': mime_type
@@ -290,6 +806,231 @@ class FFmpegProcessor(Processor):
 
         return Asset(essence=result, **metadata)
 
+    def convert_many(self, asset, outputs):
+        """
+        Creates several new assets from the essence of the specified asset
+        with a single ffmpeg invocation, so that the source is decoded once.
+
+        Unlike :func:`~madam.ffmpeg.FFmpegProcessor.convert`, this method is
+        not an operator, because it returns several assets. It cannot be
+        added to a :class:`~madam.core.Pipeline`.
+
+        Each output is a dictionary with the key **mime_type**, optionally the
+        keys **video** and **audio** with stream options as in
+        :func:`~madam.ffmpeg.FFmpegProcessor.convert`, and optionally the keys
+        **width** and **height** to resize the video of the output. Only the
+        first video and audio streams of the source are converted.
+
+        :param asset: Audio or video asset whose contents will be converted
+        :param outputs: Sequence of dictionaries with the options for each output
+        :return: Tuple with a new asset for each output, in the same order
+        :raise ValueError: if no outputs or invalid dimensions are specified
+        """
+        if not outputs:
+            raise ValueError('No outputs specified')
+        if not (asset.mime_type.startswith('audio/') or asset.mime_type.startswith('video/')):
+            raise UnsupportedFormatError('Unsupported source asset type: %s' % asset.mime_type)
+        for output in outputs:
+            mime_type = output['mime_type']
+            if not self.__mime_type_to_encoder.get(mime_type) or \
+                    not (mime_type.startswith('audio/') or mime_type.startswith('video/')):
+                raise UnsupportedFormatError('Unsupported asset type: %s' % mime_type)
+            width, height = output.get('width'), output.get('height')
+            if (width is None) != (height is None) or (width is not None and (width < 1 or height < 1)):
+                raise ValueError('Invalid dimensions: %rx%r' % (width, height))
+
+        probe_data = _probe(asset.essence)
+        stream_types = {stream.get('codec_type') for stream in probe_data['streams']}
+
+        def is_kept(options):
+            return options is None or 'codec' not in options or options['codec']
+        video_outputs = [index for index, output in enumerate(outputs)
+                         if 'video' in stream_types and output['mime_type'].startswith('video/') and
+                         is_kept(output.get('video'))]
+        resized_outputs = [index for index in video_outputs if 'width' in outputs[index]]
+
+        results = [io.BytesIO() for _ in outputs]
+        with _FFmpegContext(asset.essence, io.BytesIO(), input_mime_type=asset.mime_type) as ctx:
+            command = ['ffmpeg', '-loglevel', 'error', '-i', ctx.input_path]
+            if resized_outputs:
+                filters = ['[0:v:0]split=%d%s' % (len(resized_outputs),
+                                                  ''.join('[s%d]' % index for index in resized_outputs))]
+                for index in resized_outputs:
+                    filters.append('[s%d]scale=%d:%d[v%d]' % (index, outputs[index]['width'],
+                                                              outputs[index]['height'], index))
+                command.extend(['-filter_complex', ';'.join(filters)])
+
+            output_paths = []
+            for index, output in enumerate(outputs):
+                if index in resized_outputs:
+                    command.extend(['-map', '[v%d]' % index])
+                elif index in video_outputs:
+                    command.extend(['-map', '0:v:0'])
+                if 'audio' in stream_types and is_kept(output.get('audio')):
+                    command.extend(['-map', '0:a:0'])
+                command.extend(self._stream_options(video=output.get('video'), audio=output.get('audio')))
+                output_paths.append(os.path.join(ctx.directory, 'output_file_%d' % index))
+                command.extend(['-threads', _THREADS,
+                                '-f', self.__mime_type_to_encoder[output['mime_type']], '-y', output_paths[-1]])
+
+            try:
+                ctx.run(command, stderr=subprocess.PIPE, check=True)
+            except CalledProcessError as ffmpeg_error:
+                error_message = ffmpeg_error.stderr.decode('utf-8')
+                raise OperatorError('Could not convert asset: %s' % error_message)
+
+            for output_path, result in zip(output_paths, results):
+                with open(output_path, 'rb') as temp_out:
+                    shutil.copyfileobj(temp_out, result)
+                    result.seek(0)
+
+        converted_assets = []
+        for index, (output, result) in enumerate(zip(outputs, results)):
+            metadata = dict(mime_type=output['mime_type'], duration=asset.duration)
+            if index in video_outputs:
+                metadata['width'] = output.get('width', asset.metadata.get('width'))
+                metadata['height'] = output.get('height', asset.metadata.get('height'))
+            converted_assets.append(Asset(essence=result, **metadata))
+        return tuple(converted_assets)
+
+    def _convert_whole(self, asset, encoder_name, video=None, audio=None, subtitles=None):
+        """
+        Converts the essence of the specified asset with a single ffmpeg
+        invocation.
+
+        :param asset: Asset whose contents will be converted
+        :param encoder_name: Name of the FFmpeg muxer of the result
+        :param video: Dictionary with options for video streams.
+        :param audio: Dictionary with options for audio streams.
+        :param subtitles: Dictionary with the options for subtitle streams.
+        :return: File-like object with the converted essence
+        """
+        result = io.BytesIO()
+        with _FFmpegContext(asset.essence, result, input_mime_type=asset.mime_type,
+                            output_format=encoder_name) as ctx:
+            command = ['ffmpeg', '-loglevel', 'error',
+                       '-i', ctx.input_path]
+            command.extend(self._stream_options(video=video, audio=audio, subtitles=subtitles))
+            command.extend(['-f', ctx.output_format, '-y', ctx.output_path])
+
+            try:
+                ctx.run(command, threaded=True, stderr=subprocess.PIPE, check=True)
+            except CalledProcessError as ffmpeg_error:
+                error_message = ffmpeg_error.stderr.decode('utf-8')
+                raise OperatorError('Could not convert video asset: %s' % error_message)
+
+        return result
+
+    def _convert_segmented(self, asset, encoder_name, segments, video=None, audio=None):
+        """
+        Converts the essence of the specified video asset in segments that are
+        encoded in parallel.
+
+        Segments are cut at keyframes with stream copy, so that every segment
+        can be decoded on its own, and each encoded segment starts with a
+        keyframe. Audio streams are encoded from the complete source.
+
+        :param asset: Video asset whose contents will be converted
+        :param encoder_name: Name of the FFmpeg muxer of the result
+        :param segments: Number of segments
+        :param video: Dictionary with options for video streams.
+        :param audio: Dictionary with options for audio streams.
+        :return: File-like object with the converted essence
+        """
+        probe_data = _probe(asset.essence)
+        has_audio = any(stream.get('codec_type') == 'audio' for stream in probe_data['streams'])
+        is_audio_kept = has_audio and (audio is None or 'codec' not in audio or audio['codec'])
+
+        result = io.BytesIO()
+        with tempfile.TemporaryDirectory(prefix='madam') as tmpdir_path:
+            input_path = os.path.join(tmpdir_path, 'input_file')
+            with open(input_path, 'wb') as temp_in:
+                shutil.copyfileobj(asset.essence, temp_in)
+
+            try:
+                _run(['ffmpeg', '-loglevel', 'error', '-i', input_path,
+                      '-map', '0:v:0', '-codec', 'copy',
+                      '-f', 'segment', '-segment_time', '%f' % (asset.duration/segments),
+                      '-segment_format', 'matroska', '-reset_timestamps', '1',
+                      os.path.join(tmpdir_path, 'segment%05d')],
+                     stderr=subprocess.PIPE, check=True)
+
+                commands = []
+                encoded_paths = []
+                for segment_path in sorted(glob.glob(os.path.join(tmpdir_path, 'segment*'))):
+                    encoded_paths.append(segment_path + '_encoded')
+                    command = ['ffmpeg', '-loglevel', 'error', '-i', segment_path]
+                    command.extend(self._stream_options(video=video))
+                    command.extend(['-an', '-sn', '-f', encoder_name, '-y', encoded_paths[-1]])
+                    commands.append(command)
+                audio_path = os.path.join(tmpdir_path, 'audio')
+                if is_audio_kept:
+                    command = ['ffmpeg', '-loglevel', 'error', '-i', input_path, '-map', '0:a']
+                    command.extend(self._stream_options(audio=audio))
+                    command.extend(['-vn', '-sn', '-f', encoder_name, '-y', audio_path])
+                    commands.append(command)
+
+                run_encoder = propagate_deadline(scheduler.propagate_priority(
+                    functools.partial(_run, threaded=True, stderr=subprocess.PIPE, check=True)))
+                with ThreadPoolExecutor(max_workers=len(commands)) as executor:
+                    for _ in executor.map(run_encoder, commands):
+                        pass
+
+                list_path = os.path.join(tmpdir_path, 'segments.txt')
+                with open(list_path, 'w') as list_file:
+                    for encoded_path in encoded_paths:
+                        list_file.write("file '%s'\n" % encoded_path.replace("'", "'\\''"))
+                output_path = os.path.join(tmpdir_path, 'output_file')
+                command = ['ffmpeg', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', list_path]
+                if is_audio_kept:
+                    command.extend(['-i', audio_path, '-map', '0:v', '-map', '1:a'])
+                command.extend(['-codec', 'copy', '-f', encoder_name, '-y', output_path])
+                _run(command, stderr=subprocess.PIPE, check=True)
+            except CalledProcessError as ffmpeg_error:
+                error_message = ffmpeg_error.stderr.decode('utf-8')
+                raise OperatorError('Could not convert video asset: %s' % error_message)
+
+            with open(output_path, 'rb') as temp_out:
+                shutil.copyfileobj(temp_out, result)
+                result.seek(0)
+
+        return result
+
+    @staticmethod
+    def _stream_options(video=None, audio=None, subtitles=None):
+        """
+        Returns the ffmpeg output options for the specified stream options.
+
+        :param video: Dictionary with options for video streams.
+        :param audio: Dictionary with options for audio streams.
+        :param subtitles: Dictionary with the options for subtitle streams.
+        :return: List of command line arguments
+        """
+        options = []
+        if video is not None:
+            if 'codec' in video:
+                if video['codec']:
+                    options.extend(['-c:v', video['codec']])
+                else:
+                    options.extend(['-vn'])
+            if video.get('bitrate'):
+                options.extend(['-b:v', '%dk' % video['bitrate']])
+        if audio is not None:
+            if 'codec' in audio:
+                if audio['codec']:
+                    options.extend(['-c:a', audio['codec']])
+                else:
+                    options.extend(['-an'])
+            if audio.get('bitrate'):
+                options.extend(['-b:a', '%dk' % audio['bitrate']])
+        if subtitles is not None:
+            if 'codec' in subtitles:
+                if subtitles['codec']:
+                    options.extend(['-c:s', subtitles['codec']])
+                else:
+                    options.extend(['-sn'])
+        return options
+
     @operator
     def trim(self, asset, from_seconds=0, to_seconds=0):
         """
@@ -309,6 +1050,8 @@ class FFmpegProcessor(Processor):
 
         if to_seconds <= 0:
             to_seconds = asset.duration + to_seconds
+        # The clip cannot extend beyond the end of the asset
+        to_seconds = min(to_seconds, asset.duration)
 
         duration = float(to_seconds) - float(from_seconds)
 
@@ -316,14 +1059,14 @@ class FFmpegProcessor(Processor):
             raise ValueError('Start time must be before end time')
 
         result = io.BytesIO()
-        with _FFmpegContext(asset.essence, result) as ctx:
+        with _FFmpegContext(asset.essence, result, output_format=encoder_name) as ctx:
             command = ['ffmpeg', '-v', 'error',
                        '-ss', str(float(from_seconds)), '-t', str(duration),
                        '-i', ctx.input_path, '-codec', 'copy',
-                       '-f', encoder_name, '-y', ctx.output_path]
+                       '-f', ctx.output_format, '-y', ctx.output_path]
 
             try:
-                subprocess_run(command, stderr=subprocess.PIPE, check=True)
+                ctx.run(command, stderr=subprocess.PIPE, check=True)
             except CalledProcessError as ffmpeg_error:
                 error_message = ffmpeg_error.stderr.decode('utf-8')
                 raise OperatorError('Could not convert video asset: %s' % error_message)
@@ -332,16 +1075,31 @@ class FFmpegProcessor(Processor):
                      width=asset.width, height=asset.height, duration=duration)
 
     @operator
-    def extract_frame(self, asset, mime_type, seconds=0):
+    def extract_frame(self, asset, mime_type, seconds=0, fast=False, width=None, height=None):
         """
         Creates a new image asset of the specified MIME type from the essence
         of the specified video asset.
 
+        In fast mode, the frame is taken from the last keyframe at or before
+        the offset, so that no other frames have to be decoded. This is much
+        faster for videos with long intervals between keyframes, but the
+        frame can be earlier than requested. If the frame is scaled down in
+        fast mode and the decoder of the video supports it (e.g. MPEG-2,
+        MPEG-4 Part 2, and Motion JPEG), the keyframe is decoded at a
+        reduced resolution already. Other decoders, like H.264, always decode
+        the keyframe at full resolution before it is scaled.
+
         :param asset: Video asset which will serve as the source for the frame
         :param mime_type: MIME type of the source
         :type mime_type: str
         :param seconds: Offset of the frame in seconds
         :type seconds: float
+        :param fast: Whether the frame is snapped to the preceding keyframe
+        :type fast: bool
+        :param width: Width of the frame, or `None` for the width of the video
+        :type width: int
+        :param height: Height of the frame, or `None` for the height of the video
+        :type height: int
         :return: New image asset with converted essence
         """
         if not asset.mime_type.startswith('video/'):
@@ -352,21 +1110,619 @@ class FFmpegProcessor(Processor):
         if not (encoder_name and codec_name):
             raise UnsupportedFormatError('Unsupported target asset type: %s' % mime_type)
 
+        if (width is None) != (height is None) or (width is not None and (width < 1 or height < 1)):
+            raise ValueError('Invalid dimensions: %rx%r' % (width, height))
+
         result = io.BytesIO()
-        with _FFmpegContext(asset.essence, result) as ctx:
-            command = ['ffmpeg', '-v', 'error', '-ss', str(float(seconds)),
-                       '-i', ctx.input_path,
-                       '-codec:v', codec_name, '-vframes', '1',
-                       '-f', encoder_name, '-y', ctx.output_path]
+        with _FFmpegContext(asset.essence, result, output_format=encoder_name) as ctx:
+            command = ['ffmpeg', '-v', 'error']
+            if fast:
+                # Decode keyframes only and keep the keyframe before the offset
+                command.extend(['-skip_frame', 'nokey', '-noaccurate_seek'])
+                lowres = self._lowres_factor(asset, width, height)
+                if lowres:
+                    command.extend(['-lowres', str(lowres)])
+            command.extend(['-ss', str(float(seconds)), '-i', ctx.input_path])
+            if width is not None:
+                scale_filter = 'scale=%d:%d' % (width, height)
+                if fast:
+                    scale_filter += ':flags=fast_bilinear'
+                command.extend(['-filter:v', scale_filter])
+            if fast:
+                command.extend(['-vsync', 'passthrough'])
+            command.extend(['-codec:v', codec_name, '-vframes', '1',
+                            '-f', ctx.output_format, '-y', ctx.output_path])
 
             try:
-                subprocess_run(command, stderr=subprocess.PIPE, check=True)
+                ctx.run(command, stderr=subprocess.PIPE, check=True)
             except CalledProcessError as ffmpeg_error:
                 error_message = ffmpeg_error.stderr.decode('utf-8')
                 raise OperatorError('Could not convert video asset: %s' % error_message)
 
         return Asset(essence=result, mime_type=mime_type,
-                     width=asset.width, height=asset.height)
+                     width=width or asset.width, height=height or asset.height)
+
+    @staticmethod
+    def _lowres_factor(asset, width, height):
+        """
+        Returns the power of two by which the decoder can reduce the
+        resolution of the specified video asset without falling below the
+        specified dimensions.
+
+        :param asset: Video asset
+        :param width: Width of the decoded frames, or `None` for the width of the video
+        :param height: Height of the decoded frames, or `None` for the height of the video
+        :return: Exponent of the reduction, or 0 if the resolution cannot be reduced
+        """
+        max_lowres = _LOWRES_DECODERS.get(asset.metadata.get('video', {}).get('codec'), 0)
+        if width is None or not (asset.metadata.get('width') and asset.metadata.get('height')):
+            return 0
+        lowres = 0
+        while (lowres < max_lowres and asset.width >> (lowres + 1) >= width and
+               asset.height >> (lowres + 1) >= height):
+            lowres += 1
+        return lowres
+
+    @operator
+    def package(self, asset, renditions, protocol='hls', segment_duration=4):
+        """
+        Creates an adaptive streaming package with several renditions of the
+        specified video asset.
+
+        The source is decoded once and all renditions are encoded by a single
+        ffmpeg invocation. Keyframes are forced at the segment boundaries, so
+        that players can switch between renditions at every segment.
+
+        The package is returned as a tar archive with the manifest, the media
+        playlists, and the segments. The name of the manifest and the names of
+        all files are stored in the metadata keys `manifest` and `files`.
+
+        Each rendition is a dictionary with the keys **width** and
+        **height**, and optionally **video** and **audio** with stream options
+        as in :func:`~madam.ffmpeg.FFmpegProcessor.convert`. HLS renditions
+        have their own audio streams, while DASH renditions share the audio
+        stream of the first rendition.
+
+        Packaging requires FFmpeg 4.1 or later, which supports variant
+        streams for HLS and adaptation sets with segment durations for DASH.
+
+        :param asset: Video asset that will serve as the source
+        :param renditions: Sequence of dictionaries with the options for each rendition
+        :param protocol: `'hls'` for HTTP Live Streaming or `'dash'` for MPEG-DASH
+        :type protocol: str
+        :param segment_duration: Target duration of the segments in seconds
+        :type segment_duration: float
+        :return: New asset with a tar archive of the package
+        :raise ValueError: if no renditions or an unknown protocol is specified
+        :raise UnsupportedFormatError: if the installed version of FFmpeg cannot create packages
+        """
+        if not asset.mime_type.startswith('video/'):
+            raise UnsupportedFormatError('Unsupported source asset type: %s' % asset.mime_type)
+        min_package_version = _parse_version(self._min_package_version)
+        if self._ffmpeg_version is not None and self._ffmpeg_version < min_package_version:
+            raise UnsupportedFormatError('Packaging requires FFmpeg %s or later, found version %s'
+                                         % (self._min_package_version, '.'.join(map(str, self._ffmpeg_version))))
+        if not renditions:
+            raise ValueError('No renditions specified')
+        if protocol not in ('hls', 'dash'):
+            raise ValueError('Unsupported streaming protocol: %r' % protocol)
+        for rendition in renditions:
+            if rendition['width'] < 1 or rendition['height'] < 1:
+                raise ValueError('Invalid dimensions: %dx%d' % (rendition['width'], rendition['height']))
+
+        probe_data = _probe(asset.essence)
+        has_audio = any(stream.get('codec_type') == 'audio' for stream in probe_data['streams'])
+
+        filters = ['[0:v]split=%d%s' % (len(renditions), ''.join('[s%d]' % index
+                                                                  for index in range(len(renditions))))]
+        for index, rendition in enumerate(renditions):
+            filters.append('[s%d]scale=%d:%d[v%d]' % (index, rendition['width'], rendition['height'], index))
+
+        result = io.BytesIO()
+        with _FFmpegContext(asset.essence, result, input_mime_type=asset.mime_type) as ctx:
+            package_path = os.path.join(ctx.directory, 'package')
+            os.mkdir(package_path)
+            command = ['ffmpeg', '-loglevel', 'error', '-i', ctx.input_path,
+                       '-filter_complex', ';'.join(filters)]
+            audio_streams = []
+            for index, rendition in enumerate(renditions):
+                command.extend(['-map', '[v%d]' % index])
+                if has_audio and (protocol == 'hls' or index == 0):
+                    command.extend(['-map', '0:a:0'])
+                    audio_streams.append(rendition.get('audio') or {})
+            for index, rendition in enumerate(renditions):
+                video = dict(codec='libx264')
+                video.update(rendition.get('video') or {})
+                command.extend(self._typed_stream_options('v', index, video))
+            for index, audio_options in enumerate(audio_streams):
+                audio = dict(codec='aac')
+                audio.update(audio_options)
+                command.extend(self._typed_stream_options('a', index, audio))
+            command.extend(['-force_key_frames', 'expr:gte(t,n_forced*%s)' % segment_duration])
+            if protocol == 'hls':
+                stream_map = ' '.join('v:%d,a:%d' % (index, index) if has_audio else 'v:%d' % index
+                                      for index in range(len(renditions)))
+                manifest = 'master.m3u8'
+                command.extend(['-f', 'hls', '-hls_time', str(segment_duration), '-hls_playlist_type', 'vod',
+                                '-master_pl_name', manifest, '-var_stream_map', stream_map,
+                                '-hls_segment_filename', os.path.join(package_path, 'stream_%v_%05d.ts'),
+                                os.path.join(package_path, 'stream_%v.m3u8')])
+            else:
+                adaptation_sets = 'id=0,streams=v id=1,streams=a' if has_audio else 'id=0,streams=v'
+                manifest = 'manifest.mpd'
+                command.extend(['-f', 'dash', '-seg_duration', str(segment_duration),
+                                '-adaptation_sets', adaptation_sets, os.path.join(package_path, manifest)])
+
+            try:
+                ctx.run(command, threaded=True, stderr=subprocess.PIPE, check=True)
+            except CalledProcessError as ffmpeg_error:
+                error_message = ffmpeg_error.stderr.decode('utf-8')
+                raise OperatorError('Could not package video asset: %s' % error_message)
+
+            file_names = sorted(os.listdir(package_path))
+            with tarfile.open(fileobj=result, mode='w') as archive:
+                for file_name in file_names:
+                    archive.add(os.path.join(package_path, file_name), arcname=file_name)
+            result.seek(0)
+
+        return Asset(essence=result, mime_type='application/x-tar', manifest=manifest, files=tuple(file_names),
+                     duration=asset.duration)
+
+    @staticmethod
+    def _typed_stream_options(stream_type, index, options):
+        """
+        Returns the ffmpeg output options for a single output stream.
+
+        :param stream_type: `'v'` for video or `'a'` for audio streams
+        :param index: Index of the output stream among the streams of its type
+        :param options: Dictionary with the codec and the bitrate of the stream
+        :return: List of command line arguments
+        """
+        stream_options = ['-c:%s:%d' % (stream_type, index), options['codec']]
+        if options.get('bitrate'):
+            stream_options.extend(['-b:%s:%d' % (stream_type, index), '%dk' % options['bitrate']])
+        return stream_options
+
+    def extract_frames(self, asset, mime_type, seconds=None, interval=None, scene_threshold=None,
+                       width=None, height=None):
+        """
+        Creates new image assets of the specified MIME type from several
+        frames of the specified video asset in a single pass over the video.
+
+        This method is not an operator, because it returns several assets.
+
+        Frames are selected by exactly one of these criteria: the first frames
+        at or after a list of offsets, frames that are at least an interval
+        apart, or frames whose scene change score exceeds a threshold.
+
+        The offset of each frame in seconds is stored in the metadata key
+        `timestamp`.
+
+        :param asset: Video asset which will serve as the source for the frames
+        :param mime_type: MIME type of the frames
+        :type mime_type: str
+        :param seconds: Sequence of offsets in seconds
+        :param interval: Minimum distance between the frames in seconds
+        :type interval: float
+        :param scene_threshold: Minimum scene change score between 0 and 1
+        :type scene_threshold: float
+        :param width: Width of the frames, or `None` for the width of the video
+        :type width: int
+        :param height: Height of the frames, or `None` for the height of the video
+        :type height: int
+        :return: Tuple with new image assets
+        :raise ValueError: if not exactly one selection criterion is specified, or if only one
+            dimension is specified
+        """
+        frames = self._extract_selected_frames(asset, mime_type, seconds=seconds, interval=interval,
+                                               scene_threshold=scene_threshold, width=width, height=height)
+        return tuple(Asset(essence=essence, mime_type=mime_type, width=width or asset.width,
+                           height=height or asset.height, timestamp=timestamps[0])
+                     for essence, timestamps in frames)
+
+    def storyboard(self, asset, mime_type, width, height, columns=10, rows=10, seconds=None, interval=None,
+                   scene_threshold=None):
+        """
+        Creates sprite sheets with thumbnails of several frames of the
+        specified video asset in a single pass over the video.
+
+        This method is not an operator, because it returns several assets.
+
+        Frames are selected like in :func:`~madam.ffmpeg.FFmpegProcessor.extract_frames`,
+        scaled to the specified size, and tiled row by row into sheets of the
+        specified number of columns and rows. Unused tiles of the last sheet
+        are empty.
+
+        The position of each thumbnail is stored in the metadata key `tiles`
+        of its sheet as a dictionary with the keys `timestamp`, `x`, `y`,
+        `width`, and `height`. A WebVTT index can be created with
+        :func:`~madam.ffmpeg.storyboard_webvtt`.
+
+        :param asset: Video asset which will serve as the source for the thumbnails
+        :param mime_type: MIME type of the sheets
+        :type mime_type: str
+        :param width: Width of a thumbnail
+        :type width: int
+        :param height: Height of a thumbnail
+        :type height: int
+        :param columns: Number of thumbnails in a row
+        :type columns: int
+        :param rows: Number of thumbnails in a column
+        :type rows: int
+        :param seconds: Sequence of offsets in seconds
+        :param interval: Minimum distance between the frames in seconds
+        :type interval: float
+        :param scene_threshold: Minimum scene change score between 0 and 1
+        :type scene_threshold: float
+        :return: Tuple with new image assets of the sheets
+        :raise ValueError: if not exactly one selection criterion is specified
+        """
+        if columns < 1 or rows < 1:
+            raise ValueError('Invalid sheet layout: %dx%d' % (columns, rows))
+        sheets = self._extract_selected_frames(asset, mime_type, seconds=seconds, interval=interval,
+                                               scene_threshold=scene_threshold, width=width, height=height,
+                                               tiles=(columns, rows))
+        sheet_assets = []
+        for essence, timestamps in sheets:
+            tiles = [dict(timestamp=timestamp, x=(index % columns)*width, y=(index//columns)*height,
+                          width=width, height=height)
+                     for index, timestamp in enumerate(timestamps)]
+            sheet_assets.append(Asset(essence=essence, mime_type=mime_type, width=columns*width,
+                                      height=rows*height, tiles=tiles))
+        return tuple(sheet_assets)
+
+    def _extract_selected_frames(self, asset, mime_type, seconds=None, interval=None, scene_threshold=None,
+                                 width=None, height=None, tiles=None):
+        """
+        Encodes the selected frames of the specified video asset with a single
+        ffmpeg invocation.
+
+        :param asset: Video asset which will serve as the source for the frames
+        :param mime_type: MIME type of the images
+        :param seconds: Sequence of offsets in seconds
+        :param interval: Minimum distance between the frames in seconds
+        :param scene_threshold: Minimum scene change score between 0 and 1
+        :param width: Width of the frames, or `None` for the width of the video
+        :param height: Height of the frames, or `None` for the height of the video
+        :param tiles: Tuple with the number of columns and rows of tiled images, or `None`
+        :return: List of tuples with the essence of an image and the offsets of its frames in seconds
+        """
+        if not asset.mime_type.startswith('video/'):
+            raise UnsupportedFormatError('Unsupported source asset type: %s' % asset.mime_type)
+        codec_name = self.__mime_type_to_codec.get(mime_type)
+        if not codec_name:
+            raise UnsupportedFormatError('Unsupported target asset type: %s' % mime_type)
+        if sum(criterion is not None for criterion in (seconds, interval, scene_threshold)) != 1:
+            raise ValueError('Exactly one of seconds, interval, and scene_threshold must be specified')
+        if (width is None) != (height is None) or (width is not None and (width < 1 or height < 1)):
+            raise ValueError('Invalid dimensions: %rx%r' % (width, height))
+
+        if seconds is not None:
+            if not seconds:
+                return []
+            # Select the first frame at or after each offset
+            selection = '+'.join('(isnan(prev_t)+lt(prev_t,%(t)f))*gte(t,%(t)f)' % dict(t=float(offset))
+                                 for offset in sorted(set(seconds)))
+        elif interval is not None:
+            if interval <= 0:
+                raise ValueError('Invalid interval: %r' % interval)
+            selection = 'isnan(prev_selected_t)+gte(t-prev_selected_t,%f)' % interval
+        else:
+            selection = 'gt(scene,%f)' % scene_threshold
+
+        with _FFmpegContext(asset.essence, io.BytesIO(), input_mime_type=asset.mime_type) as ctx:
+            frame_info_path = os.path.join(ctx.directory, 'frames.txt')
+            filters = ["select='%s'" % selection,
+                       'metadata=mode=add:key=madam.selected:value=1',
+                       'metadata=mode=print:file=%s' % _escape_filter_option(frame_info_path)]
+            if width is not None:
+                filters.append('scale=%d:%d' % (width, height))
+            if tiles:
+                filters.append('tile=%dx%d' % tiles)
+            command = ['ffmpeg', '-loglevel', 'error', '-i', ctx.input_path,
+                       '-filter:v', ','.join(filters), '-vsync', 'vfr', '-an', '-sn',
+                       '-codec:v', codec_name, '-f', 'image2', os.path.join(ctx.directory, 'frame_%06d')]
+
+            try:
+                ctx.run(command, threaded=True, stderr=subprocess.PIPE, check=True)
+            except CalledProcessError as ffmpeg_error:
+                error_message = ffmpeg_error.stderr.decode('utf-8')
+                raise OperatorError('Could not extract frames from video asset: %s' % error_message)
+
+            timestamps = []
+            if os.path.exists(frame_info_path):
+                with open(frame_info_path) as frame_info_file:
+                    for line in frame_info_file:
+                        if line.startswith('frame:'):
+                            timestamps.append(float(line.split('pts_time:')[1].split()[0]))
+
+            frames_per_image = tiles[0]*tiles[1] if tiles else 1
+            images = []
+            for image_index in range((len(timestamps) + frames_per_image - 1)//frames_per_image):
+                essence = io.BytesIO()
+                with open(os.path.join(ctx.directory, 'frame_%06d' % (image_index + 1)), 'rb') as image_file:
+                    shutil.copyfileobj(image_file, essence)
+                essence.seek(0)
+                images.append((essence, timestamps[image_index*frames_per_image:(image_index + 1)*frames_per_image]))
+
+        return images
+
+    def decode_audio(self, asset, sample_format='f32le', sample_rate=None, channels=None):
+        """
+        Decodes the first audio stream of the specified asset to raw samples.
+
+        The samples are read from FFmpeg directly into an array that is
+        allocated according to the duration of the asset.
+
+        :param asset: Audio or video asset with an audio stream
+        :param sample_format: Raw sample format: 'u8', 's16le', 's32le', 'f32le', or 'f64le'
+        :type sample_format: str
+        :param sample_rate: Sample rate in Hz, or `None` for the rate of the stream
+        :type sample_rate: int
+        :param channels: Number of channels, or `None` for the channels of the stream
+        :type channels: int
+        :return: NumPy array of shape (frames, channels)
+        :raise UnsupportedFormatError: if the sample format is unknown or the asset has no audio
+        :raise OperatorError: if the audio could not be decoded
+        """
+        sample_type, sample_rate, channels = self._pcm_parameters(asset, sample_format, sample_rate, channels)
+
+        # Decoded streams can be slightly longer than the container duration
+        frame_count = int(math.ceil(asset.duration*sample_rate)) + sample_rate
+        samples = numpy.empty((frame_count, channels), dtype=sample_type)
+        read_frame_count = 0
+        with self._decode_pcm(asset, sample_format, sample_rate, channels) as pipe:
+            while True:
+                read_frame_count += _read_frames(pipe, samples[read_frame_count:])
+                if read_frame_count < len(samples):
+                    break
+                grown_samples = numpy.empty((2*len(samples), channels), dtype=sample_type)
+                grown_samples[:read_frame_count] = samples
+                samples = grown_samples
+
+        return samples[:read_frame_count]
+
+    def decode_audio_chunks(self, asset, chunk_frames=65536, sample_format='f32le', sample_rate=None,
+                            channels=None):
+        """
+        Decodes the first audio stream of the specified asset to chunks of raw
+        samples.
+
+        Only one chunk is held in memory at a time, so that long files can be
+        analyzed. The FFmpeg process decodes only as fast as the chunks are
+        consumed, so it releases its scheduler slot once it has started and
+        other FFmpeg operators can be used while iterating.
+
+        :param asset: Audio or video asset with an audio stream
+        :param chunk_frames: Maximum number of frames per chunk
+        :type chunk_frames: int
+        :param sample_format: Raw sample format: 'u8', 's16le', 's32le', 'f32le', or 'f64le'
+        :type sample_format: str
+        :param sample_rate: Sample rate in Hz, or `None` for the rate of the stream
+        :type sample_rate: int
+        :param channels: Number of channels, or `None` for the channels of the stream
+        :type channels: int
+        :return: Iterator of NumPy arrays of shape (frames, channels)
+        :raise UnsupportedFormatError: if the sample format is unknown or the asset has no audio
+        :raise OperatorError: if the audio could not be decoded
+        """
+        if chunk_frames < 1:
+            raise ValueError('Invalid number of frames per chunk: %r' % chunk_frames)
+        sample_type, sample_rate, channels = self._pcm_parameters(asset, sample_format, sample_rate, channels)
+        return self._iter_chunks(asset, chunk_frames, sample_format, sample_type, sample_rate, channels)
+
+    def _iter_chunks(self, asset, chunk_frames, sample_format, sample_type, sample_rate, channels):
+        with self._decode_pcm(asset, sample_format, sample_rate, channels) as pipe:
+            while True:
+                check_deadline()
+                chunk = numpy.empty((chunk_frames, channels), dtype=sample_type)
+                frame_count = _read_frames(pipe, chunk)
+                if frame_count:
+                    yield chunk[:frame_count]
+                if frame_count < chunk_frames:
+                    break
+
+    @staticmethod
+    def _pcm_parameters(asset, sample_format, sample_rate, channels):
+        """
+        Returns the data type, sample rate, and number of channels of the raw
+        samples that are decoded from the specified asset.
+
+        :param asset: Audio or video asset
+        :param sample_format: Raw sample format
+        :param sample_rate: Sample rate in Hz, or `None` for the rate of the stream
+        :param channels: Number of channels, or `None` for the channels of the stream
+        :return: Tuple of NumPy data type, sample rate, and number of channels
+        """
+        sample_type = _PCM_SAMPLE_TYPES.get(sample_format)
+        if sample_type is None:
+            raise UnsupportedFormatError('Unsupported sample format: %s' % sample_format)
+        if (sample_rate is not None and sample_rate < 1) or (channels is not None and channels < 1):
+            raise ValueError('Invalid sample rate or number of channels: %r, %r' % (sample_rate, channels))
+
+        audio_streams = [stream for stream in _probe(asset.essence)['streams'] if stream.get('codec_type') == 'audio']
+        if not audio_streams:
+            raise UnsupportedFormatError('Asset has no audio stream')
+        audio_stream = audio_streams[0]
+        return sample_type, sample_rate or int(audio_stream['sample_rate']), channels or int(audio_stream['channels'])
+
+    @contextlib.contextmanager
+    def _decode_pcm(self, asset, sample_format, sample_rate, channels):
+        """
+        Returns a context manager whose value is a pipe with the raw samples
+        of the first audio stream of the specified asset.
+        """
+        with _FFmpegContext(asset.essence, None, input_mime_type=asset.mime_type,
+                            output_format=sample_format) as ctx:
+            command = ['ffmpeg', '-v', 'error', '-i', ctx.input_path, '-map', '0:a:0',
+                       '-codec:a', 'pcm_' + sample_format, '-ar', str(sample_rate), '-ac', str(channels),
+                       '-f', ctx.output_format, ctx.output_path]
+            try:
+                with ctx.stream(command) as pipe:
+                    yield pipe
+            except CalledProcessError as ffmpeg_error:
+                error_message = ffmpeg_error.stderr.decode('utf-8')
+                raise OperatorError('Could not decode audio asset: %s' % error_message)
+
+    #: Operators that can be fused
+    _FUSIBLE_OPERATORS = frozenset(['trim', 'resize', 'convert'])
+
+    def fuse(self, operators):
+        steps = []
+        for configured_operator in operators:
+            operator_name = configured_operator.func.__name__
+            if operator_name not in self._FUSIBLE_OPERATORS:
+                return None
+            if configured_operator.keywords.get('segments', 1) > 1:
+                return None
+            steps.append((operator_name, dict(configured_operator.keywords)))
+        return self._apply_steps(steps=tuple(steps))
+
+    @staticmethod
+    def _merge_stream_options(options, new_options):
+        """
+        Returns the stream options of two consecutive conversions.
+
+        Later options override earlier ones, but streams that were removed
+        by the earlier conversion stay removed.
+
+        :param options: Dictionary with the earlier stream options, or `None`
+        :param new_options: Dictionary with the later stream options, or `None`
+        :return: Dictionary with the merged stream options, or `None`
+        """
+        if options is None or new_options is None:
+            return new_options if options is None else options
+        merged_options = dict(options)
+        merged_options.update(new_options)
+        if 'codec' in options and not options['codec']:
+            merged_options['codec'] = options['codec']
+        return merged_options
+
+    @operator
+    def _apply_steps(self, asset, steps):
+        """
+        Creates a new asset by applying several operations on the specified
+        asset with a single ffmpeg invocation.
+
+        Trims are combined into a single input range, resizes into a single
+        filter chain, and the streams are encoded once with the settings of
+        the last conversion.
+
+        :param asset: Audio or video asset to be processed
+        :param steps: Sequence of tuples of operator names and keyword arguments
+        :return: New asset with processed essence
+        """
+        mime_type = asset.mime_type
+        width = asset.metadata.get('width')
+        height = asset.metadata.get('height')
+        duration = asset.metadata.get('duration')
+        start_seconds = 0.0
+        is_trimmed = False
+        filters = []
+        stream_options = dict(video=None, audio=None, subtitles=None)
+        is_converted = False
+
+        for operator_name, keywords in steps:
+            if operator_name == 'trim':
+                encoder_name = self.__mime_type_to_encoder.get(mime_type)
+                if not encoder_name or not (mime_type.startswith('audio/') or mime_type.startswith('video/')):
+                    raise UnsupportedFormatError('Unsupported source asset type: %s' % mime_type)
+                from_seconds = float(keywords.get('from_seconds', 0))
+                to_seconds = float(keywords.get('to_seconds', 0))
+                if to_seconds <= 0:
+                    to_seconds = duration + to_seconds
+                # Like single trims, the clip cannot extend beyond the previous clip
+                to_seconds = min(to_seconds, duration)
+                if to_seconds - from_seconds <= 0:
+                    raise ValueError('Start time must be before end time')
+                start_seconds += from_seconds
+                duration = to_seconds - from_seconds
+                is_trimmed = True
+            elif operator_name == 'resize':
+                resize_width, resize_height = keywords['width'], keywords['height']
+                if resize_width < 1 or resize_height < 1:
+                    raise ValueError('Invalid dimensions: %dx%d' % (resize_width, resize_height))
+                if not self.__mime_type_to_encoder.get(mime_type):
+                    raise UnsupportedFormatError('Unsupported asset type: %s' % mime_type)
+                if mime_type.split('/')[0] not in ('image', 'video'):
+                    raise OperatorError('Cannot resize asset of type %s' % mime_type)
+                filters.append('scale=%d:%d' % (resize_width, resize_height))
+                width, height = resize_width, resize_height
+            elif operator_name == 'convert':
+                mime_type = keywords['mime_type']
+                if not self.__mime_type_to_encoder.get(mime_type):
+                    raise UnsupportedFormatError('Unsupported asset type: %s' % mime_type)
+                for stream_type in stream_options:
+                    stream_options[stream_type] = self._merge_stream_options(
+                        stream_options[stream_type], keywords.get(stream_type))
+                is_converted = True
+
+        encoder_name = self.__mime_type_to_encoder[mime_type]
+        result = io.BytesIO()
+        # Seeking to the start of a trimmed range requires a seekable input
+        input_mime_type = None if is_trimmed else asset.mime_type
+        with _FFmpegContext(asset.essence, result, input_mime_type=input_mime_type,
+                            output_format=encoder_name) as ctx:
+            command = ['ffmpeg', '-loglevel', 'error']
+            if is_trimmed:
+                command.extend(['-ss', str(start_seconds), '-t', str(duration)])
+            command.extend(['-i', ctx.input_path])
+            if filters:
+                command.extend(['-filter:v', ','.join(filters)])
+            command.extend(self._stream_options(**stream_options))
+            if not (filters or is_converted):
+                command.extend(['-codec', 'copy'])
+            command.extend(['-f', ctx.output_format, '-y', ctx.output_path])
+
+            try:
+                ctx.run(command, threaded=True, stderr=subprocess.PIPE, check=True)
+            except CalledProcessError as ffmpeg_error:
+                error_message = ffmpeg_error.stderr.decode('utf-8')
+                raise OperatorError('Could not process asset: %s' % error_message)
+
+        metadata = dict(mime_type=mime_type)
+        mime_category = mime_type.split('/')[0]
+        if mime_category in ('image', 'video'):
+            metadata['width'] = width
+            metadata['height'] = height
+        if mime_category in ('audio', 'video'):
+            metadata['duration'] = duration
+
+        return Asset(essence=result, **metadata)
+
+
+def _format_webvtt_time(seconds):
+    """
+    Returns a WebVTT timestamp for the specified offset.
+
+    :param seconds: Offset in seconds
+    :return: Timestamp string
+    """
+    milliseconds = int(round(seconds*1000))
+    return '%02d:%02d:%02d.%03d' % (milliseconds//3600000, milliseconds//60000 % 60, milliseconds//1000 % 60,
+                                    milliseconds % 1000)
+
+
+def storyboard_webvtt(sheets, urls, duration):
+    """
+    Returns a WebVTT index for sprite sheets that were created with
+    :func:`~madam.ffmpeg.FFmpegProcessor.storyboard`.
+
+    Each thumbnail is shown from its timestamp until the timestamp of the
+    next thumbnail, or until the end of the video.
+
+    :param sheets: Sequence of sheet assets
+    :param urls: Sequence with the URL of each sheet
+    :param duration: Duration of the video in seconds
+    :return: WebVTT document as string
+    """
+    cues = [(tile['timestamp'], '%s#xywh=%d,%d,%d,%d' % (url, tile['x'], tile['y'], tile['width'], tile['height']))
+            for sheet, url in zip(sheets, urls) for tile in sheet.tiles]
+    lines = ['WEBVTT', '']
+    for index, (start, target) in enumerate(cues):
+        end = cues[index + 1][0] if index + 1 < len(cues) else max(duration, start)
+        lines.extend(['%s --> %s' % (_format_webvtt_time(start), _format_webvtt_time(end)), target, ''])
+    return '\n'.join(lines)
 
 
 class FFmpegMetadataProcessor(MetadataProcessor):
@@ -520,14 +1876,14 @@ class FFmpegMetadataProcessor(MetadataProcessor):
 
         # Strip metadata
         result = io.BytesIO()
-        with _FFmpegContext(file, result) as ctx:
-            encoder_name = self.__mime_type_to_encoder[mime_type]
+        encoder_name = self.__mime_type_to_encoder[mime_type]
+        with _FFmpegContext(file, result, input_mime_type=mime_type, output_format=encoder_name) as ctx:
             command = ['ffmpeg', '-loglevel', 'error',
                        '-i', ctx.input_path,
                        '-map_metadata', '-1', '-codec', 'copy',
-                       '-y', '-f', encoder_name, ctx.output_path]
+                       '-y', '-f', ctx.output_format, ctx.output_path]
             try:
-                subprocess_run(command, stderr=subprocess.PIPE, check=True)
+                ctx.run(command, stderr=subprocess.PIPE, check=True)
             except CalledProcessError as ffmpeg_error:
                 error_message = ffmpeg_error.stderr.decode('utf-8')
                 raise OperatorError('Could not strip metadata: %s' % error_message)
@@ -556,8 +1912,8 @@ class FFmpegMetadataProcessor(MetadataProcessor):
 
         # Add metadata to file
         result = io.BytesIO()
-        with _FFmpegContext(file, result) as ctx:
-            encoder_name = self.__mime_type_to_encoder[mime_type]
+        encoder_name = self.__mime_type_to_encoder[mime_type]
+        with _FFmpegContext(file, result, input_mime_type=mime_type, output_format=encoder_name) as ctx:
             command = ['ffmpeg', '-loglevel', 'error',
                        '-f', encoder_name, '-i', ctx.input_path]
 
@@ -571,10 +1927,10 @@ class FFmpegMetadataProcessor(MetadataProcessor):
                 command.append('%s=%s' % (ffmetadata_key, value))
 
             command.extend(['-codec', 'copy',
-                            '-y', '-f', encoder_name, ctx.output_path])
+                            '-y', '-f', ctx.output_format, ctx.output_path])
 
             try:
-                subprocess_run(command, stderr=subprocess.PIPE, check=True)
+                ctx.run(command, stderr=subprocess.PIPE, check=True)
             except CalledProcessError as ffmpeg_error:
                 error_message = ffmpeg_error.stderr.decode('utf-8')
                 raise OperatorError('Could not add metadata: %s' % error_message)
@@ -1,11 +1,13 @@
 import collections
 import subprocess
+import threading
+import time
 
 try:
-    from subprocess import run as subprocess_run
+    from subprocess import CompletedProcess as _CompletedProcess
     from subprocess import CalledProcessError
 except ImportError:
-    _CompletedProcess = collections.namedtuple('_CompletedProcess', ['args', 'retcode', 'stdout', 'stderr'])
+    _CompletedProcess = collections.namedtuple('_CompletedProcess', ['args', 'returncode', 'stdout', 'stderr'])
 
     class CalledProcessError(subprocess.CalledProcessError):
         def __init__(self, returncode, cmd, output=None, stderr=None):
@@ -20,23 +22,93 @@ except ImportError:
         def stdout(self, value):
             self.output = value
 
-    def subprocess_run(command, stdin=None, input=None, check=False, stdout=None, stderr=None):
-        if input is not None:
-            if stdin is not None:
-                raise ValueError('stdin and input arguments can not be used at the same time.')
-            stdin = subprocess.PIPE
-
-        with subprocess.Popen(command, stdin=stdin,
-                              stdout=stdout, stderr=stderr) as process:
-            try:
-                stdout, stderr = process.communicate(input=input)
-            except:
-                process.kill()
-                process.wait()
-                raise
-            retcode = process.poll()
-            if check and retcode:
-                raise CalledProcessError(returncode=retcode, cmd=process.args,
-                                         output=stdout, stderr=stderr)
-        return _CompletedProcess(args=process.args, retcode=retcode,
-                                 stdout=stdout, stderr=stderr)
+#: Interval in seconds in which the poll function of a running command is called
+POLL_INTERVAL = 0.05
+
+
+def write_input(pipe, data):
+    """
+    Writes the specified bytes to a pipe and closes it.
+
+    Writing stops silently when the reading process exits.
+
+    :param pipe: File-like object of the pipe
+    :param data: Bytes to be written
+    """
+    view = memoryview(data)
+    try:
+        while view:
+            view = view[pipe.write(view):]
+    except BrokenPipeError:
+        pass
+    finally:
+        try:
+            pipe.close()
+        except BrokenPipeError:
+            pass
+
+
+def subprocess_run(command, stdin=None, input=None, check=False, stdout=None, stderr=None,
+                   timeout=None, poll=None):
+    """
+    Runs a command like :func:`subprocess.run`.
+
+    If a poll function is specified, it is called regularly while the
+    command runs. The process is killed when the timeout expires or when the
+    poll function raises an error.
+
+    :param command: Command line as list of strings
+    :param stdin: Standard input of the process
+    :param input: Bytes that are passed to the standard input of the process
+    :param check: Whether an error is raised for a non-zero exit code
+    :param stdout: Standard output of the process
+    :param stderr: Standard error of the process
+    :param timeout: Maximum time in seconds, or `None`
+    :param poll: Callable without arguments, or `None`
+    :return: Completed process
+    :raise CalledProcessError: if the exit code is not zero and check is `True`
+    :raise subprocess.TimeoutExpired: if the command did not finish in time
+    """
+    if input is not None:
+        if stdin is not None:
+            raise ValueError('stdin and input arguments can not be used at the same time.')
+        stdin = subprocess.PIPE
+
+    with subprocess.Popen(command, stdin=stdin,
+                          stdout=stdout, stderr=stderr) as process:
+        writer = None
+        try:
+            if poll is None:
+                stdout, stderr = process.communicate(input=input, timeout=timeout)
+            else:
+                if input is not None:
+                    # Input is only written by the first call of communicate,
+                    # so it is written by a separate thread instead
+                    writer = threading.Thread(target=write_input, args=(process.stdin, input), daemon=True)
+                    process.stdin = None
+                    writer.start()
+                end_time = None if timeout is None else time.monotonic() + timeout
+                while True:
+                    poll()
+                    wait_time = POLL_INTERVAL
+                    if end_time is not None:
+                        wait_time = min(wait_time, max(end_time - time.monotonic(), 0.0))
+                    try:
+                        stdout, stderr = process.communicate(timeout=wait_time)
+                        break
+                    except subprocess.TimeoutExpired:
+                        if end_time is not None and time.monotonic() >= end_time:
+                            raise subprocess.TimeoutExpired(process.args, timeout)
+        except:
+            process.kill()
+            process.wait()
+            raise
+        finally:
+            if writer is not None:
+                writer.join()
+        retcode = process.poll()
+        if check and retcode:
+            raise CalledProcessError(returncode=retcode, cmd=process.args,
+                                     output=stdout, stderr=stderr)
+    return _CompletedProcess(args=process.args, returncode=retcode,
+                             stdout=stdout, stderr=stderr)
@@ -2,6 +2,7 @@ import io
 from enum import Enum
 
 from bidict import bidict
+import numpy
 import PIL.ExifTags
 import PIL.Image
 
@@ -31,6 +32,100 @@ class FlipOrientation(Enum):
     VERTICAL = 1
 
 
+_HASH_SIZE = 8
+_DCT_SIZE = 32
+
+
+def _dct_matrix(size):
+    """
+    Returns the orthonormal DCT-II matrix of the specified size.
+
+    :param size: Number of rows and columns
+    :return: DCT matrix
+    """
+    frequencies = numpy.arange(size).reshape(-1, 1)
+    samples = numpy.arange(size).reshape(1, -1)
+    matrix = numpy.sqrt(2 / size) * numpy.cos(numpy.pi * (2 * samples + 1) * frequencies / (2 * size))
+    matrix[0, :] /= numpy.sqrt(2)
+    return matrix
+
+
+_DCT_MATRIX = _dct_matrix(_DCT_SIZE)
+
+
+def _pack_hashes(bits):
+    """
+    Converts an array of bits to integers.
+
+    :param bits: Boolean array with one row of bits per hash
+    :return: List of integer hashes
+    """
+    packed_bits = numpy.packbits(bits.reshape(bits.shape[0], -1), axis=1)
+    return [int.from_bytes(row.tobytes(), 'big') for row in packed_bits]
+
+
+def _hash_thumbnail(image):
+    """
+    Returns the grayscale thumbnail from which the perceptual hashes of the
+    specified image are computed.
+
+    :param image: Image to be hashed
+    :return: Grayscale image with a size of 32x32 pixels
+    """
+    if image.mode in ('1', 'P'):
+        image = image.convert('L')
+    # Subsampling large images first avoids filtering every pixel
+    subsampled_size = 4*_DCT_SIZE
+    if image.width > subsampled_size or image.height > subsampled_size:
+        image = image.resize((min(image.width, subsampled_size), min(image.height, subsampled_size)),
+                             resample=PIL.Image.NEAREST)
+    return image.resize((_DCT_SIZE, _DCT_SIZE), resample=PIL.Image.BILINEAR).convert('L')
+
+
+def perceptual_hashes(images):
+    """
+    Computes perceptual hashes for the specified images.
+
+    Three 64-bit hashes are computed for each image:
+
+    - **ahash** – Average hash: pixels brighter than the mean of an 8x8 thumbnail
+    - **dhash** – Difference hash: horizontal brightness gradients of a 9x8 thumbnail
+    - **phash** – DCT hash: low-frequency DCT coefficients of a 32x32 thumbnail that
+      are larger than their median
+
+    Similar images have hashes with a small Hamming distance. All hashes of
+    an image are derived from one 32x32 grayscale thumbnail, and the
+    thumbnails of all images are processed at once, so hashing a batch of
+    images is considerably faster than hashing them one by one.
+
+    :param images: Sequence of :class:`PIL.Image.Image` objects
+    :return: List with a dictionary of hashes for each image
+    """
+    if not images:
+        return []
+    thumbnails = [_hash_thumbnail(image) for image in images]
+    thumbnails_by_size = {}
+    for size in ((_HASH_SIZE, _HASH_SIZE), (_HASH_SIZE + 1, _HASH_SIZE), (_DCT_SIZE, _DCT_SIZE)):
+        thumbnails_by_size[size] = numpy.stack([
+            numpy.asarray(thumbnail.resize(size, resample=PIL.Image.BILINEAR), dtype=numpy.float64)
+            for thumbnail in thumbnails
+        ])
+
+    average_pixels = thumbnails_by_size[_HASH_SIZE, _HASH_SIZE]
+    average_bits = average_pixels > average_pixels.mean(axis=(1, 2), keepdims=True)
+
+    difference_pixels = thumbnails_by_size[_HASH_SIZE + 1, _HASH_SIZE]
+    difference_bits = difference_pixels[:, :, 1:] > difference_pixels[:, :, :-1]
+
+    dct_pixels = thumbnails_by_size[_DCT_SIZE, _DCT_SIZE]
+    dct_coefficients = numpy.matmul(numpy.matmul(_DCT_MATRIX, dct_pixels), _DCT_MATRIX.T)[:, :_HASH_SIZE, :_HASH_SIZE]
+    ac_coefficients = dct_coefficients.reshape(len(images), -1)[:, 1:]
+    dct_bits = dct_coefficients > numpy.median(ac_coefficients, axis=1).reshape(-1, 1, 1)
+
+    return [dict(ahash=ahash, dhash=dhash, phash=phash) for ahash, dhash, phash in zip(
+        _pack_hashes(average_bits), _pack_hashes(difference_bits), _pack_hashes(dct_bits))]
+
+
 class PillowProcessor(Processor):
     """
     Represents a processor that uses Pillow as a backend.
@@ -74,6 +169,21 @@ class PillowProcessor(Processor):
         :return: Asset with resized essence
         """
         image = PIL.Image.open(asset.essence)
+        resized_image = self._resize_image(image, width=width, height=height, mode=mode)
+        resized_asset = self._image_to_asset(resized_image, mime_type=asset.mime_type)
+        return resized_asset
+
+    @staticmethod
+    def _resize_image(image, width, height, mode=ResizeMode.EXACT):
+        """
+        Returns a copy of the specified image which is resized according to the specified parameters.
+
+        :param image: Image to be resized
+        :param width: target width
+        :param height: target height
+        :param mode: resize behavior
+        :return: Resized image
+        """
         width_delta = width - image.width
         height_delta = height - image.height
         resized_width = width
@@ -86,18 +196,49 @@ class PillowProcessor(Processor):
                 resize_factor = height / image.height
             resized_width = round(resize_factor * image.width)
             resized_height = round(resize_factor * image.height)
-        resized_image = image.resize((resized_width, resized_height),
-                                     resample=PIL.Image.LANCZOS)
-        resized_asset = self._image_to_asset(resized_image, mime_type=asset.mime_type)
-        return resized_asset
+        return image.resize((resized_width, resized_height), resample=PIL.Image.LANCZOS)
 
     def _image_to_asset(self, image, mime_type):
+        """
+        Encodes the specified image and creates a new asset from it.
+
+        The metadata is derived from the image in memory, so the encoded
+        essence does not need to be decoded again.
+
+        :param image: Image to be encoded
+        :param mime_type: MIME type of the encoded image
+        :return: New image asset
+        """
         image_buffer = io.BytesIO()
         image.save(image_buffer, self.__mime_type_to_pillow_type[mime_type])
         image_buffer.seek(0)
-        asset = self.read(image_buffer)
+        metadata = dict(
+            mime_type=mime_type,
+            width=image.width,
+            height=image.height
+        )
+        asset = Asset(image_buffer, **metadata)
         return asset
 
+    @operator
+    def add_perceptual_hash(self, asset):
+        """
+        Creates a new image asset with the same essence as the specified asset
+        and its perceptual hashes in the `perceptual_hash` metadata, where
+        :class:`~madam.core.PerceptualHashIndex` expects them.
+
+        The hashes are computed by :func:`~madam.image.perceptual_hashes`.
+
+        :param asset: Image asset to be hashed
+        :return: New image asset with perceptual hashes
+        """
+        image = PIL.Image.open(asset.essence)
+        # Decoding a downscaled version is sufficient for hashing
+        image.draft('L', (_DCT_SIZE, _DCT_SIZE))
+        metadata = dict(asset.metadata)
+        metadata['perceptual_hash'] = perceptual_hashes([image])[0]
+        return Asset(asset.essence, **metadata)
+
     def _rotate(self, asset, rotation):
         """
         Creates a new image asset from specified asset whose essence is rotated
@@ -135,11 +276,45 @@ class PillowProcessor(Processor):
         :param orientation: axis of the flip operation
         :return: Asset with flipped essence
         """
+        return self._rotate(asset, self._flip_rotation(orientation))
+
+    @staticmethod
+    def _flip_rotation(orientation):
+        """
+        Returns the Pillow transposition for the specified flip orientation.
+
+        :param orientation: axis of the flip operation
+        :return: ``PIL.Image.FLIP_LEFT_RIGHT`` or ``PIL.Image.FLIP_TOP_BOTTOM``
+        """
         if orientation == FlipOrientation.HORIZONTAL:
-            flip_orientation = PIL.Image.FLIP_LEFT_RIGHT
-        else:
-            flip_orientation = PIL.Image.FLIP_TOP_BOTTOM
-        return self._rotate(asset, flip_orientation)
+            return PIL.Image.FLIP_LEFT_RIGHT
+        return PIL.Image.FLIP_TOP_BOTTOM
+
+    #: Pillow transpositions that correct each Exif orientation
+    _ORIENTATION_ROTATIONS = {
+        2: (PIL.Image.FLIP_LEFT_RIGHT,),
+        3: (PIL.Image.ROTATE_180,),
+        4: (PIL.Image.FLIP_TOP_BOTTOM,),
+        5: (PIL.Image.ROTATE_90, PIL.Image.FLIP_TOP_BOTTOM),
+        6: (PIL.Image.ROTATE_270,),
+        7: (PIL.Image.ROTATE_90, PIL.Image.FLIP_LEFT_RIGHT),
+        8: (PIL.Image.ROTATE_90,),
+    }
+
+    def _orientation_rotations(self, orientation):
+        """
+        Returns the Pillow transpositions that correct the specified Exif orientation.
+
+        :param orientation: Exif orientation value
+        :return: Tuple of transpositions
+        :raise OperatorError: if the orientation value is invalid
+        """
+        if orientation == 1:
+            return ()
+        try:
+            return self._ORIENTATION_ROTATIONS[orientation]
+        except KeyError:
+            raise OperatorError('Unable to correct image orientation with value %s' % orientation)
 
     @operator
     def auto_orient(self, asset):
@@ -154,25 +329,14 @@ class PillowProcessor(Processor):
         if orientation is None:
             return asset
 
-        if orientation == 1:
-            oriented_asset = Asset(asset.essence, metadata={})
-        elif orientation == 2:
-            oriented_asset = self.flip(orientation=FlipOrientation.HORIZONTAL)(asset)
-        elif orientation == 3:
-            oriented_asset = self._rotate(asset, PIL.Image.ROTATE_180)
-        elif orientation == 4:
-            oriented_asset = self.flip(orientation=FlipOrientation.VERTICAL)(asset)
-        elif orientation == 5:
-            oriented_asset = self.flip(orientation=FlipOrientation.VERTICAL)(self._rotate(asset, PIL.Image.ROTATE_90))
-        elif orientation == 6:
-            oriented_asset = self._rotate(asset, PIL.Image.ROTATE_270)
-        elif orientation == 7:
-            oriented_asset = self.flip(orientation=FlipOrientation.HORIZONTAL)(self._rotate(asset, PIL.Image.ROTATE_90))
-        elif orientation == 8:
-            oriented_asset = self._rotate(asset, PIL.Image.ROTATE_90)
-        else:
-            raise OperatorError('Unable to correct image orientation with value %s' % orientation)
+        rotations = self._orientation_rotations(orientation)
+        if not rotations:
+            return Asset(asset.essence, metadata={})
 
+        image = PIL.Image.open(asset.essence)
+        for rotation in rotations:
+            image = image.transpose(rotation)
+        oriented_asset = self._image_to_asset(image, mime_type=asset.mime_type)
         return oriented_asset
 
     @operator
@@ -196,3 +360,56 @@ class PillowProcessor(Processor):
 
         converted_asset = Asset(converted_essence_data, mime_type=mime_type)
         return converted_asset
+
+    #: Operators that can be fused
+    _FUSIBLE_OPERATORS = frozenset(['resize', 'transpose', 'flip', 'auto_orient', 'convert'])
+
+    def fuse(self, operators):
+        steps = []
+        for configured_operator in operators:
+            operator_name = configured_operator.func.__name__
+            if operator_name not in self._FUSIBLE_OPERATORS:
+                return None
+            steps.append((operator_name, dict(configured_operator.keywords)))
+        return self._apply_steps(steps=tuple(steps))
+
+    @operator
+    def _apply_steps(self, asset, steps):
+        """
+        Creates a new asset by applying several operations on the decoded
+        image of the specified asset and encoding the result only once.
+
+        :param asset: Asset to be processed
+        :param steps: Sequence of tuples of operator names and keyword arguments
+        :return: New image asset
+        """
+        try:
+            image = PIL.Image.open(asset.essence)
+        except IOError as pil_error:
+            raise OperatorError('Could not read image: %s' % pil_error)
+        mime_type = asset.mime_type
+        metadata = asset.metadata
+        for operator_name, keywords in steps:
+            if operator_name == 'resize':
+                image = self._resize_image(image, **keywords)
+            elif operator_name == 'transpose':
+                image = image.transpose(PIL.Image.TRANSPOSE)
+            elif operator_name == 'flip':
+                image = image.transpose(self._flip_rotation(keywords['orientation']))
+            elif operator_name == 'auto_orient':
+                orientation = (metadata.get('exif') or {}).get('orientation')
+                if orientation is None:
+                    # The asset is returned unchanged and keeps its metadata
+                    continue
+                for rotation in self._orientation_rotations(orientation):
+                    image = image.transpose(rotation)
+            elif operator_name == 'convert':
+                if keywords['mime_type'] not in self.__mime_type_to_pillow_type:
+                    raise OperatorError('Could not convert image: unsupported MIME type %r' % keywords['mime_type'])
+                mime_type = keywords['mime_type']
+            # Intermediate assets only contain the metadata read from the essence
+            metadata = {}
+        try:
+            return self._image_to_asset(image, mime_type=mime_type)
+        except IOError as pil_error:
+            raise OperatorError('Could not write image: %s' % pil_error)
@@ -1,11 +1,16 @@
+import io
 import json
 import subprocess
+import unittest.mock
 
+import numpy
 import pytest
 from mutagen.mp3 import EasyMP3
 from mutagen.oggopus import OggOpus
 
 import madam.audio
+import madam.core
+import madam.ffmpeg
 from madam.core import OperatorError, UnsupportedFormatError
 from madam.future import subprocess_run
 from assets import DEFAULT_DURATION
@@ -47,6 +52,80 @@ class TestFFmpegProcessor:
     def test_converted_essence_stream_has_same_duration_as_source(self, converted_asset):
         assert converted_asset.duration == pytest.approx(DEFAULT_DURATION, rel=0.5)
 
+    def test_convert_many_creates_bitrate_ladder(self, processor, audio_asset):
+        high_bitrate_asset, low_bitrate_asset = processor.convert_many(audio_asset, outputs=[
+            dict(mime_type='audio/mpeg', audio=dict(bitrate=192)),
+            dict(mime_type='audio/mpeg', audio=dict(bitrate=64)),
+        ])
+
+        assert high_bitrate_asset.mime_type == low_bitrate_asset.mime_type == 'audio/mpeg'
+        assert len(high_bitrate_asset.essence.read()) > len(low_bitrate_asset.essence.read())
+        assert high_bitrate_asset.duration == audio_asset.duration
+
+    def test_convert_streams_pipeable_formats_without_temporary_files(self, processor, mp3_asset):
+        conversion_operator = processor.convert(mime_type='audio/ogg', audio=dict(codec='libopus'))
+
+        with unittest.mock.patch('tempfile.TemporaryDirectory') as temporary_directory_mock:
+            converted_asset = conversion_operator(mp3_asset)
+
+        assert not temporary_directory_mock.called
+        command = 'ffprobe -print_format json -loglevel error -show_format -i pipe:'.split()
+        result = subprocess_run(command, input=converted_asset.essence.read(), stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, check=True)
+        assert json.loads(result.stdout.decode('utf-8'))['format']['format_name'] == 'ogg'
+
+    def test_convert_streams_input_larger_than_pipe_buffer(self, processor):
+        command = ('ffmpeg -loglevel error -f lavfi -i sine=frequency=440:duration=10 '
+                   '-c:a pcm_s16le -f wav pipe:1').split()
+        essence = subprocess_run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True).stdout
+        assert len(essence) > 1024**2 / 2
+        asset = processor.read(io.BytesIO(essence))
+        conversion_operator = processor.convert(mime_type='audio/mpeg')
+
+        with madam.core.deadline(timeout=30):
+            converted_asset = conversion_operator(asset)
+
+        assert converted_asset.duration == pytest.approx(10, abs=0.1)
+
+    def test_decode_audio_returns_samples_of_stream(self, processor, wav_asset):
+        samples = processor.decode_audio(wav_asset)
+
+        assert samples.dtype == numpy.float32
+        assert samples.shape == (int(DEFAULT_DURATION*44100), 1)
+        assert numpy.abs(samples).max() == pytest.approx(0.125, rel=0.01)
+
+    def test_decode_audio_converts_sample_format_rate_and_channels(self, processor, wav_asset):
+        samples = processor.decode_audio(wav_asset, sample_format='s16le', sample_rate=8000, channels=2)
+
+        assert samples.dtype == numpy.int16
+        assert samples.shape == (int(DEFAULT_DURATION*8000), 2)
+        assert numpy.array_equal(samples[:, 0], samples[:, 1])
+
+    def test_decode_audio_chunks_yields_same_samples_in_bounded_chunks(self, processor, audio_asset):
+        samples = processor.decode_audio(audio_asset)
+
+        chunks = list(processor.decode_audio_chunks(audio_asset, chunk_frames=4096))
+
+        assert all(len(chunk) == 4096 for chunk in chunks[:-1])
+        assert 0 < len(chunks[-1]) <= 4096
+        assert numpy.array_equal(numpy.concatenate(chunks), samples)
+
+    def test_decode_audio_chunks_allows_other_operators_while_iterating(self, processor, audio_asset):
+        scheduler = madam.ffmpeg.FFmpegScheduler(max_processes=1)
+        convert_operator = processor.convert(mime_type='audio/wav')
+
+        with unittest.mock.patch('madam.ffmpeg.scheduler', scheduler), madam.core.deadline(timeout=10):
+            chunks = processor.decode_audio_chunks(audio_asset)
+            next(chunks)
+            converted_asset = convert_operator(audio_asset)
+            chunks.close()
+
+        assert converted_asset.mime_type == 'audio/wav'
+
+    def test_decode_audio_raises_error_for_unknown_sample_format(self, processor, wav_asset):
+        with pytest.raises(UnsupportedFormatError):
+            processor.decode_audio(wav_asset, sample_format='s24be')
+
 
 class TestFFmpegMetadataProcessor:
     @pytest.fixture(name='processor')
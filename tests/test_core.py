@@ -1,13 +1,24 @@
 import unittest.mock
 
+import dbm
+import fcntl
 import io
+import math
 import os
+import pickle
 import pytest
 import tempfile
+import threading
+import time
+import zlib
 
 from madam.core import Asset
-from madam.core import InMemoryStorage, ShelveStorage
-from madam.core import Pipeline
+from madam.core import AssetStorage, InMemoryStorage, LockTimeoutError, ShardedStorage, ShelveStorage
+from madam.core import FullTextIndex, GeoIndex, PerceptualHashIndex, decimal_degrees, hamming_distance
+from madam.core import OperatorCache, OperatorStatistics, Pipeline, ProcessingError, operator
+from madam.core import add_observer, remove_observer, track_subprocess
+from madam.core import CancellationToken, OperatorCancelledError, OperatorTimeoutError
+from madam.core import check_deadline, deadline, remaining_time
 
 
 @pytest.fixture
@@ -21,14 +32,22 @@ def shelve_storage(tmpdir):
     return ShelveStorage(storage_path)
 
 
-@pytest.mark.usefixtures('asset', 'in_memory_storage', 'shelve_storage')
+@pytest.fixture
+def sharded_storage(tmpdir):
+    storage_path = str(tmpdir.join('storage.shards'))
+    return ShardedStorage(storage_path, shard_count=4)
+
+
+@pytest.mark.usefixtures('asset', 'in_memory_storage', 'shelve_storage', 'sharded_storage')
 class TestStorages:
-    @pytest.fixture(params=['in_memory_storage', 'shelve_storage'])
-    def storage(self, request, in_memory_storage, shelve_storage):
+    @pytest.fixture(params=['in_memory_storage', 'shelve_storage', 'sharded_storage'])
+    def storage(self, request, in_memory_storage, shelve_storage, sharded_storage):
         if request.param == 'in_memory_storage':
             return in_memory_storage
         elif request.param == 'shelve_storage':
             return shelve_storage
+        elif request.param == 'sharded_storage':
+            return sharded_storage
 
     def test_contains_is_false_when_storage_is_empty(self, storage, asset):
         asset_key = str(hash(asset))
@@ -164,6 +183,188 @@ class TestStorages:
         assert len(asset_keys_with_1s_duration) == 1
         assert list(asset_keys_with_1s_duration)[0] == asset_key
 
+    def test_get_many_returns_assets_and_tags_stored_with_put_many(self, storage):
+        assets_and_tags = {
+            '0': (Asset(io.BytesIO(b'0')), {'foo'}),
+            '1': (Asset(io.BytesIO(b'1')), {'foo', 'bar'}),
+        }
+
+        storage.put_many(assets_and_tags)
+
+        assert storage.get_many(['0', '1']) == assets_and_tags
+
+    def test_get_many_fails_for_unknown_asset(self, storage, asset):
+        storage['known'] = asset, None
+
+        with pytest.raises(KeyError):
+            storage.get_many(['known', 'unknown'])
+
+    def test_contains_many_returns_whether_assets_are_stored(self, storage, asset):
+        storage['known'] = asset, None
+
+        contains_by_key = storage.contains_many(['known', 'unknown'])
+
+        assert contains_by_key == {'known': True, 'unknown': False}
+
+    def test_delete_many_removes_assets_from_storage(self, storage, asset):
+        storage.put_many([('0', (asset, None)), ('1', (asset, None)), ('2', (asset, None))])
+
+        storage.delete_many(['0', '2'])
+
+        assert set(storage) == {'1'}
+
+    def test_delete_many_removes_nothing_when_one_asset_is_unknown(self, storage, asset):
+        storage['known'] = asset, None
+
+        with pytest.raises(KeyError):
+            storage.delete_many(['known', 'unknown'])
+
+        assert 'known' in storage
+
+    @pytest.fixture
+    def hashed_assets(self):
+        return {
+            'original': Asset(io.BytesIO(b'0'), perceptual_hash={'dhash': 0xF0F0F0F0F0F0F0F0}),
+            'similar': Asset(io.BytesIO(b'1'), perceptual_hash={'dhash': 0xF0F0F0F0F0F0F0F3}),
+            'different': Asset(io.BytesIO(b'2'), perceptual_hash={'dhash': 0x0F0F0F0F0F0F0F0F}),
+            'unhashed': Asset(io.BytesIO(b'3')),
+        }
+
+    def test_perceptual_hash_index_finds_similar_assets(self, storage, hashed_assets):
+        storage.add_index('hash', PerceptualHashIndex())
+        storage.put_many((asset_key, (asset, None)) for asset_key, asset in hashed_assets.items())
+
+        results = storage.query_index('hash', 0xF0F0F0F0F0F0F0F0, max_distance=4)
+
+        assert results == [('original', 0), ('similar', 2)]
+
+    def test_index_contains_assets_stored_before_index_was_added(self, storage, hashed_assets):
+        storage.put_many((asset_key, (asset, None)) for asset_key, asset in hashed_assets.items())
+
+        storage.add_index('hash', PerceptualHashIndex())
+
+        results = storage.query_index('hash', 0x0F0F0F0F0F0F0F0F, max_distance=0)
+        assert results == [('different', 0)]
+
+    def test_index_does_not_contain_deleted_assets(self, storage, hashed_assets):
+        storage.add_index('hash', PerceptualHashIndex())
+        storage.put_many((asset_key, (asset, None)) for asset_key, asset in hashed_assets.items())
+
+        del storage['original']
+        storage.delete_many(['different'])
+
+        results = storage.query_index('hash', 0xF0F0F0F0F0F0F0F0, max_distance=64)
+        assert results == [('similar', 2)]
+
+    def test_index_is_updated_when_asset_is_replaced(self, storage, hashed_assets):
+        storage.add_index('hash', PerceptualHashIndex())
+        storage['key'] = hashed_assets['original'], None
+
+        storage['key'] = hashed_assets['different'], None
+
+        assert storage.query_index('hash', 0xF0F0F0F0F0F0F0F0, max_distance=4) == []
+
+    @pytest.fixture
+    def described_assets(self):
+        return {
+            'bag': Asset(io.BytesIO(b'0'), iptc={'caption': 'A plastic bag in the street',
+                                                 'keywords': ('plastic', 'street')}),
+            'street': Asset(io.BytesIO(b'1'), exif={'description': 'Empty street at night in the rain'}),
+            'song': Asset(io.BytesIO(b'2'), ffmetadata={'title': 'Streets of Philadelphia',
+                                                        'artist': 'Bruce Springsteen'}),
+        }
+
+    def test_full_text_index_returns_assets_containing_all_tokens(self, storage, described_assets):
+        storage.add_index('text', FullTextIndex())
+        storage.put_many((asset_key, (asset, None)) for asset_key, asset in described_assets.items())
+
+        results = storage.query_index('text', 'Street')
+
+        assert [asset_key for asset_key, _ in results] == ['bag', 'street']
+        assert storage.query_index('text', 'street night')[0][0] == 'street'
+
+    def test_full_text_index_finds_token_prefixes(self, storage, described_assets):
+        storage.add_index('text', FullTextIndex())
+        storage.put_many((asset_key, (asset, None)) for asset_key, asset in described_assets.items())
+
+        results = storage.query_index('text', 'stre', prefix=True)
+
+        assert {asset_key for asset_key, _ in results} == {'bag', 'street', 'song'}
+        assert storage.query_index('text', 'stre') == []
+
+    @pytest.fixture
+    def located_assets(self):
+        return {
+            'munich': Asset(io.BytesIO(b'0'), exif={'gps.latitude': (48, 8, 6), 'gps.latitude_ref': 'north',
+                                                    'gps.longitude': (11, 34, 55), 'gps.longitude_ref': 'east'}),
+            'garching': Asset(io.BytesIO(b'1'), exif={'gps.latitude': 48.2489, 'gps.latitude_ref': 'north',
+                                                      'gps.longitude': 11.6532, 'gps.longitude_ref': 'east'}),
+            'sydney': Asset(io.BytesIO(b'2'), exif={'gps.latitude': (33, 52, 4), 'gps.latitude_ref': 'south',
+                                                    'gps.longitude': (151, 12, 26), 'gps.longitude_ref': 'east'}),
+            'fiji': Asset(io.BytesIO(b'3'), exif={'gps.latitude': 17.7134, 'gps.latitude_ref': 'south',
+                                                  'gps.longitude': 178.065, 'gps.longitude_ref': 'west'}),
+            'unlocated': Asset(io.BytesIO(b'4'), exif={'artist': 'Nobody'}),
+        }
+
+    def test_geo_index_returns_assets_within_radius_ordered_by_distance(self, storage, located_assets):
+        storage.add_index('geo', GeoIndex())
+        storage.put_many((asset_key, (asset, None)) for asset_key, asset in located_assets.items())
+
+        results = storage.query_index('geo', center=(48.137, 11.575), radius=20)
+
+        assert [asset_key for asset_key, _ in results] == ['munich', 'garching']
+        assert results[0][1] < 1
+        assert storage.query_index('geo', center=(48.137, 11.575), radius=5)[0][0] == 'munich'
+        assert len(storage.query_index('geo', center=(48.137, 11.575), radius=5)) == 1
+
+    def test_geo_index_returns_assets_within_bounding_box(self, storage, located_assets):
+        storage.add_index('geo', GeoIndex())
+        storage.put_many((asset_key, (asset, None)) for asset_key, asset in located_assets.items())
+
+        results = storage.query_index('geo', bbox=(-40, 140, -10, -170))
+
+        assert {asset_key for asset_key, _ in results} == {'sydney', 'fiji'}
+
+    def test_geo_index_raises_error_for_incomplete_query(self, storage, located_assets):
+        storage.add_index('geo', GeoIndex())
+
+        with pytest.raises(ValueError):
+            storage.query_index('geo', center=(48.137, 11.575))
+
+
+class _LegacyStorage(AssetStorage):
+    def __init__(self):
+        self.store = {}
+
+    def __getitem__(self, asset_key):
+        return self.store[asset_key]
+
+    def __setitem__(self, asset_key, asset_and_tags):
+        self.store[asset_key] = asset_and_tags
+
+    def __delitem__(self, asset_key):
+        del self.store[asset_key]
+
+    def __iter__(self):
+        return iter(self.store)
+
+    def __len__(self):
+        return len(self.store)
+
+
+@pytest.mark.usefixtures('asset')
+class TestAssetStorage:
+    def test_subclass_without_super_init_supports_bulk_operations_and_indexes(self, asset):
+        storage = _LegacyStorage()
+
+        storage.put_many({'key': (asset, {'tag'}),
+                          'other': (Asset(io.BytesIO(b'0'), perceptual_hash={'dhash': 42}), None)})
+        storage.delete_many(['key'])
+        storage.add_index('hash', PerceptualHashIndex())
+
+        assert storage.get_many(['other'])['other'][0].perceptual_hash == {'dhash': 42}
+        assert storage.query_index('hash', 42, max_distance=0) == [('other', 0)]
+
 
 @pytest.mark.usefixtures('asset', 'shelve_storage')
 class TestShelveStorage:
@@ -181,6 +382,296 @@ class TestShelveStorage:
 
         assert os.path.exists(storage.path)
 
+    @pytest.fixture
+    def locked_storage(self, storage):
+        def lock(operation):
+            lock_file = open(storage.path + '.lock', 'a')
+            fcntl.flock(lock_file, operation)
+            return lock_file
+        return lock
+
+    def test_read_does_not_wait_for_other_readers(self, storage, asset, locked_storage):
+        storage['key'] = asset, None
+        storage.lock_timeout = 0.05
+
+        with locked_storage(fcntl.LOCK_SH):
+            read_asset, _ = storage['key']
+
+        assert read_asset == asset
+
+    def test_read_raises_error_when_storage_is_locked_by_writer(self, storage, asset, locked_storage):
+        storage['key'] = asset, None
+        storage.lock_timeout = 0.05
+
+        with locked_storage(fcntl.LOCK_EX):
+            with pytest.raises(LockTimeoutError):
+                storage['key']
+
+    def test_write_raises_error_when_storage_is_locked_by_reader(self, storage, asset, locked_storage):
+        storage.lock_timeout = 0.05
+
+        with locked_storage(fcntl.LOCK_SH):
+            with pytest.raises(LockTimeoutError):
+                storage['key'] = asset, None
+
+        assert 'key' not in storage
+
+    def test_lock_statistics_count_shared_and_exclusive_locks(self, storage, asset):
+        storage['key'] = asset, None
+        storage['key']
+        'key' in storage
+
+        assert storage.lock_statistics.exclusive_acquisitions == 1
+        assert storage.lock_statistics.shared_acquisitions == 2
+        assert storage.lock_statistics.timeouts == 0
+
+    def test_read_does_not_create_storage_file(self, storage):
+        assert len(storage) == 0
+        assert 'key' not in storage
+        assert dbm.whichdb(storage.path) is None
+
+    @pytest.fixture
+    def wav_like_asset(self):
+        return Asset(io.BytesIO(b'RIFF' + 1000 * b'\x00\x01'), mime_type='audio/wav')
+
+    @pytest.mark.parametrize('codec', ['zlib', 'lzma', 'bz2'])
+    def test_compressed_asset_is_identical_after_reading(self, tmpdir, wav_like_asset, codec):
+        storage = ShelveStorage(str(tmpdir.join('storage.shelve')), compression=codec)
+
+        storage['key'] = wav_like_asset, {'tag'}
+
+        assert storage['key'] == (wav_like_asset, {'tag'})
+
+    def test_compression_reduces_size_of_stored_data(self, tmpdir, wav_like_asset):
+        uncompressed_storage = ShelveStorage(str(tmpdir.join('uncompressed.shelve')))
+        compressed_storage = ShelveStorage(str(tmpdir.join('compressed.shelve')), compression='zlib')
+
+        uncompressed_storage['key'] = wav_like_asset, None
+        compressed_storage['key'] = wav_like_asset, None
+
+        def data_size(storage):
+            return sum(os.path.getsize(str(path)) for path in tmpdir.listdir()
+                       if path.basename.startswith(os.path.basename(storage.path) + '.')
+                       and path.ext != '.lock')
+        assert data_size(compressed_storage) < data_size(uncompressed_storage)
+
+    def test_zlib_codec_stores_zlib_stream(self, tmpdir):
+        storage = ShelveStorage(str(tmpdir.join('storage.shelve')), compression='zlib')
+        essence_data = b'RIFF' + 100000 * b'\x00\x01'
+
+        compressed_asset = storage._pack(Asset(io.BytesIO(essence_data), mime_type='audio/wav'))
+
+        assert zlib.decompress(compressed_asset.compressed_essence) == essence_data
+        assert compressed_asset.decompress().essence.read() == essence_data
+
+    def test_compression_skips_compressed_mime_types(self, tmpdir):
+        storage = ShelveStorage(str(tmpdir.join('storage.shelve')), compression='zlib')
+
+        assert storage._compression_codec('image/jpeg') is None
+        assert storage._compression_codec('audio/wav') == 'zlib'
+
+    def test_compression_stores_incompressible_essence_uncompressed(self, tmpdir):
+        storage = ShelveStorage(str(tmpdir.join('storage.shelve')), compression='zlib')
+        incompressible_asset = Asset(io.BytesIO(os.urandom(256*1024)), mime_type='image/png')
+
+        assert storage._compression_codec('image/png') == 'zlib'
+        assert storage._pack(incompressible_asset) is incompressible_asset
+
+    def test_compression_uses_codec_for_mime_type(self, tmpdir):
+        storage = ShelveStorage(str(tmpdir.join('storage.shelve')),
+                                compression={'audio/wav': 'lzma', 'image/svg+xml': 'bz2'})
+
+        assert storage._compression_codec('audio/wav') == 'lzma'
+        assert storage._compression_codec('image/svg+xml') == 'bz2'
+        assert storage._compression_codec('image/jpeg') is None
+
+    def test_compressed_assets_can_be_read_without_compression_settings(self, tmpdir, wav_like_asset):
+        storage_path = str(tmpdir.join('storage.shelve'))
+        ShelveStorage(storage_path, compression='bz2')['key'] = wav_like_asset, None
+
+        asset, _ = ShelveStorage(storage_path)['key']
+
+        assert asset == wav_like_asset
+
+    def test_raises_error_for_unknown_compression_codec(self, tmpdir):
+        with pytest.raises(ValueError):
+            ShelveStorage(str(tmpdir.join('storage.shelve')), compression='rar')
+
+    def test_index_is_persisted_with_storage(self, storage):
+        asset = Asset(io.BytesIO(b'0'), perceptual_hash={'dhash': 42})
+        storage.add_index('hash', PerceptualHashIndex())
+        storage['key'] = asset, None
+
+        reopened_storage = ShelveStorage(storage.path)
+        with unittest.mock.patch.object(ShelveStorage, '_rebuild_index') as rebuild_index:
+            reopened_storage.add_index('hash', PerceptualHashIndex())
+
+        assert not rebuild_index.called
+        assert reopened_storage.query_index('hash', 42, max_distance=0) == [('key', 0)]
+
+
+@pytest.mark.usefixtures('sharded_storage')
+class TestShardedStorage:
+    @pytest.fixture
+    def storage(self, sharded_storage):
+        return sharded_storage
+
+    def test_raises_error_when_storage_path_is_not_a_directory(self, tmpdir):
+        file_path = tmpdir.join('file')
+        file_path.write('')
+
+        with pytest.raises(ValueError):
+            ShardedStorage(str(file_path))
+
+    def test_put_many_distributes_assets_across_shards(self, storage):
+        assets_and_tags = {str(index): (Asset(io.BytesIO(str(index).encode())), None) for index in range(32)}
+
+        storage.put_many(assets_and_tags)
+
+        assert sum(1 for shard in storage.shards if len(shard) > 0) > 1
+        assert sum(len(shard) for shard in storage.shards) == 32
+
+    def test_assets_are_found_when_storage_is_reopened(self, storage):
+        assets_and_tags = {str(index): (Asset(io.BytesIO(str(index).encode())), {'tag'}) for index in range(8)}
+        storage.put_many(assets_and_tags)
+
+        reopened_storage = ShardedStorage(storage.path, shard_count=len(storage.shards))
+
+        assert reopened_storage.get_many(assets_and_tags.keys()) == assets_and_tags
+        assert reopened_storage.filter_by_tags('tag') == set(assets_and_tags.keys())
+
+
+class TestPerceptualHashIndex:
+    @pytest.fixture
+    def index(self):
+        return PerceptualHashIndex()
+
+    def test_query_returns_same_assets_as_exhaustive_search(self, index):
+        index_store = {}
+        hashes = {str(i): (i * 0x9E3779B97F4A7C15) % (1 << 64) for i in range(500)}
+        hashes.update({'near%d' % i: hashes['0'] ^ (1 << (7 * i)) ^ (1 << (5 * i + 1)) for i in range(8)})
+        for asset_key, perceptual_hash in hashes.items():
+            asset = Asset(io.BytesIO(b''), perceptual_hash={'dhash': perceptual_hash})
+            index.add(index_store, asset_key, asset, None)
+
+        results = index.query(index_store, hashes['0'], max_distance=5)
+
+        expected_results = [(asset_key, hamming_distance(hashes['0'], perceptual_hash))
+                            for asset_key, perceptual_hash in hashes.items()
+                            if hamming_distance(hashes['0'], perceptual_hash) <= 5]
+        assert len(expected_results) > 1
+        assert sorted(results) == sorted(expected_results)
+
+    def test_remove_deletes_all_index_data_of_asset(self, index):
+        index_store = {}
+        asset = Asset(io.BytesIO(b''), perceptual_hash={'dhash': 42})
+        index.add(index_store, 'key', asset, None)
+
+        index.remove(index_store, 'key')
+
+        assert index_store == {'n:': 0}
+
+
+class TestFullTextIndex:
+    @pytest.fixture
+    def index(self):
+        index = FullTextIndex()
+        index.BLOCK_SIZE = 4
+        return index
+
+    @pytest.fixture
+    def assets(self):
+        return {'key%d' % i: Asset(io.BytesIO(b''), iptc={'caption': 'common caption %d' % i}) for i in range(10)}
+
+    def test_add_writes_posting_lists_in_bounded_blocks(self, index, assets):
+        written_sizes = []
+
+        class RecordingStore(dict):
+            def __setitem__(self, key, value):
+                if isinstance(value, dict):
+                    written_sizes.append(len(value))
+                super().__setitem__(key, value)
+        index_store = RecordingStore()
+
+        for asset_key, asset in assets.items():
+            index.add(index_store, asset_key, asset, None)
+
+        assert max(written_sizes) == index.BLOCK_SIZE
+        assert set(index.postings(index_store, 'w:common')) == set(assets)
+
+    def test_remove_deletes_all_index_data_of_assets(self, index, assets):
+        index_store = {}
+        for asset_key, asset in assets.items():
+            index.add(index_store, asset_key, asset, None)
+
+        for asset_key in sorted(assets, reverse=True)[:7]:
+            index.remove(index_store, asset_key)
+        remaining_keys = sorted(assets, reverse=True)[7:]
+
+        assert {asset_key for asset_key, _ in index.query(index_store, 'caption')} == set(remaining_keys)
+        for asset_key in remaining_keys:
+            index.remove(index_store, asset_key)
+        assert index_store == {'n:': 0}
+
+
+class TestGeoIndex:
+    @pytest.fixture
+    def index(self):
+        return GeoIndex()
+
+    @pytest.fixture
+    def coordinates(self):
+        return {str(i): (47.0 + (i * 0.618034) % 1 * 3.0, 10.0 + (i * 0.414214) % 1 * 4.0) for i in range(2000)}
+
+    @pytest.fixture
+    def index_store(self, index, coordinates):
+        index_store = {}
+        for asset_key, (latitude, longitude) in coordinates.items():
+            asset = Asset(io.BytesIO(b''), exif={'gps.latitude': latitude, 'gps.latitude_ref': 'north',
+                                                 'gps.longitude': longitude, 'gps.longitude_ref': 'east'})
+            index.add(index_store, asset_key, asset, None)
+        return index_store
+
+    def test_decimal_degrees_converts_degrees_minutes_and_seconds(self):
+        assert decimal_degrees((48, 8, 6), 'north') == pytest.approx(48.135)
+        assert decimal_degrees((33, 52, 4), 'south') == pytest.approx(-33.867778)
+        assert decimal_degrees(11.5, 'west') == -11.5
+
+    def test_coordinates_are_derived_from_degrees_and_hemisphere(self, index):
+        asset = Asset(io.BytesIO(b''), exif={'gps.latitude': (33, 52, 4), 'gps.latitude_ref': 'south',
+                                             'gps.longitude': (151, 12, 26), 'gps.longitude_ref': 'east'})
+
+        latitude, longitude = index.coordinates(asset)
+
+        assert latitude == pytest.approx(-33.867778)
+        assert longitude == pytest.approx(151.207222)
+
+    def test_geohash_encodes_coordinates(self, index):
+        assert index.geohash(57.64911, 10.40744, 11) == 'u4pruydqqvj'
+
+    def test_radius_query_returns_same_assets_as_exhaustive_search(self, index, index_store, coordinates):
+        center_latitude, center_longitude = 48.137, 11.575
+
+        results = index.query(index_store, center=(center_latitude, center_longitude), radius=15)
+
+        def distance(latitude, longitude):
+            phi, center_phi = math.radians(latitude), math.radians(center_latitude)
+            a = (math.sin((phi - center_phi)/2)**2 +
+                 math.cos(phi)*math.cos(center_phi)*math.sin(math.radians(longitude - center_longitude)/2)**2)
+            return 2*6371.0088*math.asin(math.sqrt(a))
+        expected_asset_keys = {asset_key for asset_key, (latitude, longitude) in coordinates.items()
+                               if distance(latitude, longitude) <= 15}
+        assert len(expected_asset_keys) > 1
+        assert {asset_key for asset_key, _ in results} == expected_asset_keys
+
+    def test_bbox_query_returns_same_assets_as_exhaustive_search(self, index, index_store, coordinates):
+        results = index.query(index_store, bbox=(48.0, 11.0, 48.2, 11.3))
+
+        expected_asset_keys = {asset_key for asset_key, (latitude, longitude) in coordinates.items()
+                               if 48.0 <= latitude <= 48.2 and 11.0 <= longitude <= 11.3}
+        assert len(expected_asset_keys) > 1
+        assert {asset_key for asset_key, _ in results} == expected_asset_keys
+
 
 @pytest.fixture
 def asset():
@@ -268,3 +759,576 @@ class TestPipeline:
         [processed_asset for processed_asset in pipeline.process(asset)]
 
         operator.assert_called_once_with(asset)
+
+    def test_parallel_process_yields_assets_in_input_order(self, pipeline):
+        assets = [Asset(io.BytesIO(str(index).encode())) for index in range(20)]
+        pipeline.add(_ReversingProcessor().reverse())
+
+        processed_assets = list(pipeline.process(*assets, executor='thread', max_workers=4))
+
+        assert [asset.essence.read() for asset in processed_assets] == \
+            [str(index).encode()[::-1] for index in range(20)]
+
+    def test_unordered_parallel_process_yields_all_assets(self, pipeline):
+        assets = [Asset(io.BytesIO(str(index).encode())) for index in range(20)]
+        pipeline.add(_ReversingProcessor().reverse())
+
+        processed_assets = list(pipeline.process(*assets, executor='thread', max_workers=4, ordered=False))
+
+        assert sorted(asset.essence.read() for asset in processed_assets) == \
+            sorted(str(index).encode()[::-1] for index in range(20))
+
+    def test_parallel_process_can_use_process_pool(self, pipeline):
+        assets = [Asset(io.BytesIO(b'abc')), Asset(io.BytesIO(b'def'))]
+        pipeline.add(_ReversingProcessor().reverse())
+
+        processed_assets = list(pipeline.process(*assets, executor='process', max_workers=2))
+
+        assert [asset.essence.read() for asset in processed_assets] == [b'cba', b'fed']
+
+    def test_parallel_process_yields_errors_in_place_of_failed_assets(self, pipeline):
+        failing_asset = Asset(io.BytesIO(b''))
+        assets = [Asset(io.BytesIO(b'abc')), failing_asset, Asset(io.BytesIO(b'def'))]
+        pipeline.add(_ReversingProcessor().reverse())
+
+        processed_assets = list(pipeline.process(*assets, executor='thread'))
+
+        assert processed_assets[0].essence.read() == b'cba'
+        assert isinstance(processed_assets[1], ProcessingError)
+        assert processed_assets[1].asset is failing_asset
+        assert isinstance(processed_assets[1].__cause__, ValueError)
+        assert processed_assets[2].essence.read() == b'fed'
+
+    def test_parallel_process_submits_at_most_prefetch_assets_in_advance(self, pipeline):
+        assets = [Asset(io.BytesIO(str(index).encode())) for index in range(10)]
+        operator = unittest.mock.MagicMock(side_effect=lambda asset: asset)
+        pipeline.add(operator)
+
+        next(pipeline.process(*assets, executor='thread', max_workers=1, prefetch=2))
+
+        assert operator.call_count <= 2
+
+    def test_parallel_process_raises_error_for_invalid_executor(self, pipeline, asset):
+        with pytest.raises(ValueError):
+            next(pipeline.process(asset, executor='cluster'))
+
+    def test_process_branches_applies_shared_operators_once(self, pipeline):
+        processor = _ReversingProcessor()
+        pipeline.add(processor.reverse())
+        pipeline.branch('original', processor.reverse(repeat=2))
+        pipeline.branch('reversed', processor.reverse(repeat=2), processor.reverse(repeat=3))
+        pipeline.branch('trunk')
+
+        results = pipeline.process_branches(Asset(io.BytesIO(b'abc')))
+
+        assert list(results.keys()) == ['original', 'reversed', 'trunk']
+        assert [asset.essence.read() for asset in results.values()] == [b'abc', b'cba', b'cba']
+        assert processor.call_count == 3
+
+    def test_process_branches_can_process_branches_in_parallel(self, pipeline):
+        processor = _ReversingProcessor()
+        for index in range(8):
+            pipeline.branch(str(index), processor.reverse(repeat=index), processor.reverse())
+
+        results = pipeline.process_branches(Asset(io.BytesIO(b'abc')), executor='thread', max_workers=4)
+
+        assert [asset.essence.read() for asset in results.values()] == [b'abc'] * 8
+
+    def test_process_branches_returns_errors_for_failed_branches(self, pipeline):
+        processor = _ReversingProcessor()
+        failing_operator = unittest.mock.MagicMock(side_effect=ValueError('Failure'))
+        pipeline.branch('failed', processor.reverse(), failing_operator)
+        pipeline.branch('succeeded', processor.reverse())
+
+        results = pipeline.process_branches(Asset(io.BytesIO(b'abc')), executor='thread')
+
+        assert isinstance(results['failed'], ProcessingError)
+        assert results['succeeded'].essence.read() == b'cba'
+
+    def test_process_branches_raises_error_without_branches(self, pipeline, asset):
+        with pytest.raises(ValueError):
+            pipeline.process_branches(asset)
+
+    def test_branch_raises_error_for_duplicate_name(self, pipeline):
+        pipeline.branch('name')
+
+        with pytest.raises(ValueError):
+            pipeline.branch('name')
+
+    def test_stream_processes_assets_from_iterable(self, pipeline):
+        processor = _ReversingProcessor()
+        pipeline.add(processor.reverse())
+        pipeline.add(unittest.mock.MagicMock(side_effect=lambda asset: asset))
+        assets = (Asset(io.BytesIO(str(index).encode() + b'x')) for index in range(50))
+
+        processed_assets = list(pipeline.stream(assets, concurrency=[2, 3]))
+
+        assert sorted(asset.essence.read() for asset in processed_assets) == \
+            sorted(b'x' + str(index).encode()[::-1] for index in range(50))
+
+    def test_stream_processes_assets_from_async_iterable(self, pipeline):
+        pipeline.add(_ReversingProcessor().reverse())
+        assets = _AsyncAssetIterable([Asset(io.BytesIO(b'abc')), Asset(io.BytesIO(b'def'))])
+
+        processed_assets = list(pipeline.stream(assets))
+
+        assert sorted(asset.essence.read() for asset in processed_assets) == [b'cba', b'fed']
+
+    def test_stream_reads_assets_only_when_there_is_room(self, pipeline):
+        read_count = [0]
+
+        def read_assets():
+            for index in range(100):
+                read_count[0] += 1
+                yield Asset(io.BytesIO(b'abc'))
+        pipeline.add(_ReversingProcessor().reverse())
+        stream = pipeline.stream(read_assets(), concurrency=1, queue_size=1)
+
+        next(stream)
+        time.sleep(0.2)
+
+        assert read_count[0] <= 6
+        stream.close()
+
+    def test_stream_can_be_closed_while_iterable_is_blocked(self, pipeline):
+        release = threading.Event()
+
+        def read_assets():
+            yield Asset(io.BytesIO(b'abc'))
+            release.wait()
+            yield Asset(io.BytesIO(b'def'))
+        pipeline.add(_ReversingProcessor().reverse())
+        stream = pipeline.stream(read_assets())
+        next(stream)
+
+        start_time = time.monotonic()
+        stream.close()
+
+        assert time.monotonic() - start_time < 1
+        release.set()
+
+    def test_stream_yields_errors_in_place_of_failed_assets(self, pipeline):
+        pipeline.add(_ReversingProcessor().reverse())
+        pipeline.add(unittest.mock.MagicMock(side_effect=lambda asset: asset))
+
+        processed_assets = list(pipeline.stream([Asset(io.BytesIO(b''))]))
+
+        assert len(processed_assets) == 1
+        assert isinstance(processed_assets[0], ProcessingError)
+
+    def test_stream_raises_errors_of_iterable(self, pipeline):
+        def read_assets():
+            yield Asset(io.BytesIO(b'abc'))
+            raise IOError('Could not read asset')
+        pipeline.add(_ReversingProcessor().reverse())
+
+        with pytest.raises(IOError):
+            list(pipeline.stream(read_assets()))
+
+    def test_process_incremental_stores_outputs_under_output_keys(self, pipeline, in_memory_storage):
+        pipeline.add(_ReversingProcessor().reverse())
+        sources = [Asset(io.BytesIO(b'abc')), Asset(io.BytesIO(b'def'))]
+
+        results = list(pipeline.process_incremental(sources, in_memory_storage))
+
+        assert [output_key for output_key, _ in results] == [pipeline.output_key(source) for source in sources]
+        stored_asset, _ = in_memory_storage[pipeline.output_key(sources[0])]
+        assert stored_asset.essence.read() == b'cba'
+
+    def test_process_incremental_skips_sources_with_existing_outputs(self, pipeline, in_memory_storage):
+        processor = _ReversingProcessor()
+        pipeline.add(processor.reverse())
+        list(pipeline.process_incremental([Asset(io.BytesIO(b'abc'))], in_memory_storage))
+
+        results = list(pipeline.process_incremental([Asset(io.BytesIO(b'abc')), Asset(io.BytesIO(b'def'))],
+                                                    in_memory_storage))
+
+        assert results[0][1] is None
+        assert results[1][1].essence.read() == b'fed'
+        assert processor.call_count == 2
+
+    def test_process_incremental_reprocesses_sources_when_operators_change(self, pipeline, in_memory_storage):
+        processor = _ReversingProcessor()
+        pipeline.add(processor.reverse())
+        list(pipeline.process_incremental([Asset(io.BytesIO(b'abc'))], in_memory_storage))
+        pipeline.operators[0] = processor.reverse(repeat=2)
+
+        list(pipeline.process_incremental([Asset(io.BytesIO(b'abc'))], in_memory_storage))
+
+        assert processor.call_count == 2
+        assert len(in_memory_storage) == 2
+
+    def test_process_incremental_resumes_from_checkpoint(self, pipeline, in_memory_storage, tmpdir):
+        pipeline.add(_ReversingProcessor().reverse())
+        checkpoint_path = str(tmpdir.join('checkpoint.json'))
+        loader = unittest.mock.MagicMock(side_effect=lambda: Asset(io.BytesIO(b'abc')))
+        results = pipeline.process_incremental([loader] * 5, in_memory_storage,
+                                               checkpoint_path=checkpoint_path, batch_size=2)
+        next(results)
+        next(results)
+        next(results)
+        results.close()
+        assert loader.call_count == 4
+        loader.reset_mock()
+
+        resumed_results = list(pipeline.process_incremental([loader] * 5, in_memory_storage,
+                                                            checkpoint_path=checkpoint_path, batch_size=2))
+
+        assert len(resumed_results) == 1
+        assert loader.call_count == 1
+        assert not os.path.exists(checkpoint_path)
+
+    def test_process_incremental_does_not_store_failed_outputs(self, pipeline, in_memory_storage):
+        pipeline.add(_ReversingProcessor().reverse())
+
+        results = list(pipeline.process_incremental([Asset(io.BytesIO(b''))], in_memory_storage))
+
+        assert isinstance(results[0][1], ProcessingError)
+        assert len(in_memory_storage) == 0
+
+
+class _AsyncAssetIterable:
+    def __init__(self, assets):
+        self.assets = list(assets)
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        return _Awaitable(self.assets.pop(0) if self.assets else None)
+
+
+class _Awaitable:
+    def __init__(self, value):
+        self.value = value
+
+    def __await__(self):
+        if self.value is None:
+            raise StopAsyncIteration()
+        return self.value
+        yield
+
+
+class _ReversingProcessor:
+    def __init__(self):
+        self.call_count = 0
+
+    @operator
+    def reverse(self, asset, repeat=1):
+        self.call_count += 1
+        essence = asset.essence.read()
+        if not essence:
+            raise ValueError('Empty essence')
+        return Asset(io.BytesIO(essence[::-1]))
+
+
+class TestOperator:
+    def test_configured_operator_can_be_pickled(self):
+        configured_operator = _ReversingProcessor().reverse()
+
+        unpickled_operator = pickle.loads(pickle.dumps(configured_operator))
+
+        assert unpickled_operator(Asset(io.BytesIO(b'abc'))).essence.read() == b'cba'
+
+    def test_operators_with_same_configuration_have_same_signature(self):
+        processor = _ReversingProcessor()
+
+        assert processor.reverse(repeat=1).signature == processor.reverse(repeat=1).signature
+        assert processor.reverse(repeat=1).signature != processor.reverse(repeat=2).signature
+        assert hash(processor.reverse(repeat=1).signature)
+
+
+class TestOperatorCache:
+    @pytest.fixture
+    def processor(self):
+        return _ReversingProcessor()
+
+    def test_apply_returns_cached_result_for_same_asset_and_operator(self, processor):
+        cache = OperatorCache()
+
+        first_result = cache.apply(processor.reverse(), Asset(io.BytesIO(b'abc')))
+        second_result = cache.apply(processor.reverse(), Asset(io.BytesIO(b'abc')))
+
+        assert first_result.essence.read() == second_result.essence.read() == b'cba'
+        assert processor.call_count == 1
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    def test_apply_does_not_return_results_of_other_assets_or_operators(self, processor):
+        cache = OperatorCache()
+
+        cache.apply(processor.reverse(), Asset(io.BytesIO(b'abc')))
+        cache.apply(processor.reverse(), Asset(io.BytesIO(b'def')))
+        cache.apply(processor.reverse(repeat=2), Asset(io.BytesIO(b'abc')))
+        cache.apply(processor.reverse(), Asset(io.BytesIO(b'abc'), mime_type='text/plain'))
+
+        assert processor.call_count == 4
+        assert cache.hits == 0
+
+    def test_least_recently_used_results_are_evicted(self, processor):
+        cache = OperatorCache(max_size=10)
+        assets = [Asset(io.BytesIO(str(index).encode() * 4)) for index in range(3)]
+
+        cache.apply(processor.reverse(), assets[0])
+        cache.apply(processor.reverse(), assets[1])
+        cache.apply(processor.reverse(), assets[0])
+        cache.apply(processor.reverse(), assets[2])
+
+        assert cache.evictions == 1
+        assert cache.get(cache.key(assets[0], processor.reverse())) is not None
+        assert cache.get(cache.key(assets[1], processor.reverse())) is None
+
+    def test_results_on_disk_are_shared_between_caches(self, processor, tmpdir):
+        asset = Asset(io.BytesIO(b'abc'))
+        OperatorCache(path=str(tmpdir)).apply(processor.reverse(), asset)
+        cache = OperatorCache(path=str(tmpdir))
+
+        result = cache.apply(processor.reverse(), asset)
+
+        assert result.essence.read() == b'cba'
+        assert processor.call_count == 1
+        assert cache.hits == 1
+
+    def test_results_written_by_other_caches_are_found_on_disk(self, processor, tmpdir):
+        asset = Asset(io.BytesIO(b'abc'))
+        cache = OperatorCache(path=str(tmpdir))
+        other_cache = pickle.loads(pickle.dumps(cache))
+        other_cache.apply(processor.reverse(), asset)
+
+        result = cache.apply(processor.reverse(), asset)
+
+        assert result.essence.read() == b'cba'
+        assert processor.call_count == 1
+        assert cache.hits == 1
+
+    def test_size_limit_on_disk_is_shared_between_caches(self, processor, tmpdir):
+        result_size = len(pickle.dumps(Asset(io.BytesIO(b'cba'))))
+        caches = [OperatorCache(max_size=0, path=str(tmpdir), max_disk_size=result_size) for _ in range(2)]
+
+        caches[0].apply(processor.reverse(), Asset(io.BytesIO(b'abc')))
+        caches[1].apply(processor.reverse(), Asset(io.BytesIO(b'def')))
+
+        assert len(tmpdir.listdir()) == 1
+        assert caches[1].evictions == 1
+
+    def test_results_on_disk_are_evicted_when_size_limit_is_exceeded(self, processor, tmpdir):
+        result_size = len(pickle.dumps(Asset(io.BytesIO(b'cba'))))
+        cache = OperatorCache(max_size=0, path=str(tmpdir), max_disk_size=result_size)
+        cache.apply(processor.reverse(), Asset(io.BytesIO(b'abc')))
+        cache.apply(processor.reverse(), Asset(io.BytesIO(b'def')))
+
+        cache.apply(processor.reverse(), Asset(io.BytesIO(b'abc')))
+
+        assert processor.call_count == 3
+        assert cache.evictions == 2
+        assert len(tmpdir.listdir()) == 1
+
+    def test_pipeline_uses_cache(self, processor):
+        cache = OperatorCache()
+        pipeline = Pipeline(cache=cache)
+        pipeline.add(processor.reverse())
+
+        list(pipeline.process(Asset(io.BytesIO(b'abc')), Asset(io.BytesIO(b'abc'))))
+
+        assert processor.call_count == 1
+        assert cache.hits == 1
+
+
+class TestObservers:
+    @pytest.fixture
+    def processor(self):
+        return _ReversingProcessor()
+
+    def test_pipeline_observers_receive_event_for_each_operator_call(self, processor):
+        events = []
+        pipeline = Pipeline(observers=[events.append])
+        pipeline.add(processor.reverse(repeat=2))
+
+        list(pipeline.process(Asset(io.BytesIO(b'abc')), Asset(io.BytesIO(b'defg'))))
+
+        assert [event.name for event in events] == ['_ReversingProcessor.reverse'] * 2
+        assert events[0].keywords == {'repeat': 2}
+        assert [(event.input_size, event.output_size) for event in events] == [(3, 3), (4, 4)]
+        assert all(event.wall_time >= 0 and event.cpu_time >= 0 for event in events)
+
+    def test_events_contain_errors(self, processor):
+        events = []
+        pipeline = Pipeline(observers=[events.append])
+        pipeline.add(processor.reverse())
+
+        with pytest.raises(ValueError):
+            list(pipeline.process(Asset(io.BytesIO(b''))))
+
+        assert isinstance(events[0].error, ValueError)
+        assert events[0].output_size is None
+
+    def test_failing_observers_do_not_change_results_or_errors(self, processor):
+        failing_observer = unittest.mock.MagicMock(side_effect=RuntimeError('Observer failure'))
+        add_observer(failing_observer)
+        try:
+            result = processor.reverse()(Asset(io.BytesIO(b'abc')))
+            with pytest.raises(ValueError):
+                processor.reverse()(Asset(io.BytesIO(b'')))
+        finally:
+            remove_observer(failing_observer)
+
+        assert result.essence.read() == b'cba'
+        assert failing_observer.call_count == 2
+
+    def test_global_observers_receive_events_outside_of_pipelines(self, processor):
+        events = []
+        add_observer(events.append)
+        try:
+            processor.reverse()(Asset(io.BytesIO(b'abc')))
+        finally:
+            remove_observer(events.append)
+
+        processor.reverse()(Asset(io.BytesIO(b'abc')))
+
+        assert len(events) == 1
+
+    def test_tracked_subprocesses_are_counted(self):
+        events = []
+
+        class SubprocessProcessor:
+            @operator
+            def run(self, asset):
+                with track_subprocess():
+                    time.sleep(0.01)
+                return asset
+        add_observer(events.append)
+        try:
+            SubprocessProcessor().run()(Asset(io.BytesIO(b'abc')))
+        finally:
+            remove_observer(events.append)
+
+        assert events[0].subprocess_count == 1
+        assert events[0].subprocess_time >= 0.01
+
+    def test_statistics_aggregate_events_by_operator(self, processor):
+        statistics = OperatorStatistics()
+        pipeline = Pipeline(observers=[statistics])
+        pipeline.add(processor.reverse())
+
+        list(pipeline.process(Asset(io.BytesIO(b'abc')), Asset(io.BytesIO(b'')), executor='thread'))
+
+        operator_statistics = statistics.by_operator['_ReversingProcessor.reverse']
+        assert operator_statistics['calls'] == 2
+        assert operator_statistics['errors'] == 1
+        assert operator_statistics['input_size'] == 3
+        summary_lines = statistics.summary().splitlines()
+        assert summary_lines[0].startswith('Operator')
+        assert summary_lines[1].startswith('_ReversingProcessor.reverse')
+
+
+class TestDeadlines:
+    def test_check_deadline_raises_error_after_timeout(self):
+        with deadline(timeout=0):
+            with pytest.raises(OperatorTimeoutError):
+                check_deadline()
+
+    def test_nested_deadline_cannot_extend_enclosing_deadline(self):
+        with deadline(timeout=0):
+            with deadline(timeout=10):
+                assert remaining_time() == 0
+            assert remaining_time() == 0
+        assert remaining_time() is None
+
+    def test_check_deadline_raises_error_when_token_is_cancelled(self):
+        token = CancellationToken()
+
+        with deadline(token=token):
+            check_deadline()
+            token.cancel()
+            with pytest.raises(OperatorCancelledError):
+                check_deadline()
+        check_deadline()
+
+    def test_pipeline_stops_processing_asset_after_timeout(self):
+        slow_operator = unittest.mock.MagicMock(side_effect=lambda asset: time.sleep(0.05) or asset)
+        next_operator = unittest.mock.MagicMock(side_effect=lambda asset: asset)
+        pipeline = Pipeline(timeout=0.01)
+        pipeline.add(slow_operator)
+        pipeline.add(next_operator)
+
+        with pytest.raises(OperatorTimeoutError):
+            list(pipeline.process(Asset(io.BytesIO(b'abc'))))
+
+        assert not next_operator.called
+
+    def test_pipeline_yields_errors_for_cancelled_assets(self):
+        token = CancellationToken()
+        started = threading.Event()
+
+        def wait_for_cancellation(asset):
+            started.set()
+            while not token.cancelled:
+                time.sleep(0.001)
+            return asset
+        pipeline = Pipeline()
+        pipeline.add(unittest.mock.MagicMock(side_effect=wait_for_cancellation))
+        pipeline.add(unittest.mock.MagicMock(side_effect=lambda asset: asset))
+        threading.Thread(target=lambda: started.wait() and token.cancel()).start()
+
+        processed_assets = list(pipeline.process(Asset(io.BytesIO(b'abc')), executor='thread', token=token))
+
+        assert isinstance(processed_assets[0], ProcessingError)
+        assert isinstance(processed_assets[0].__cause__, OperatorCancelledError)
+
+    def test_stream_stops_processing_asset_after_timeout(self):
+        slow_operator = unittest.mock.MagicMock(side_effect=lambda asset: time.sleep(0.05) or asset)
+        next_operator = unittest.mock.MagicMock(side_effect=lambda asset: asset)
+        pipeline = Pipeline(timeout=0.01)
+        pipeline.add(slow_operator)
+        pipeline.add(next_operator)
+
+        processed_assets = list(pipeline.stream([Asset(io.BytesIO(b'abc'))]))
+
+        assert isinstance(processed_assets[0], ProcessingError)
+        assert isinstance(processed_assets[0].__cause__, OperatorTimeoutError)
+        assert not next_operator.called
+
+    def test_stream_yields_errors_for_cancelled_assets(self):
+        token = CancellationToken()
+        next_operator = unittest.mock.MagicMock(side_effect=lambda asset: asset)
+        pipeline = Pipeline()
+        pipeline.add(unittest.mock.MagicMock(side_effect=lambda asset: token.cancel() or asset))
+        pipeline.add(next_operator)
+
+        processed_assets = list(pipeline.stream([Asset(io.BytesIO(b'abc'))], token=token))
+
+        assert isinstance(processed_assets[0], ProcessingError)
+        assert isinstance(processed_assets[0].__cause__, OperatorCancelledError)
+        assert not next_operator.called
+
+    @pytest.mark.parametrize('executor', [None, 'thread'])
+    def test_branches_stop_processing_asset_after_timeout(self, executor):
+        branch_operator = unittest.mock.MagicMock(side_effect=lambda asset: asset)
+        pipeline = Pipeline(timeout=0.01)
+        pipeline.add(unittest.mock.MagicMock(side_effect=lambda asset: time.sleep(0.05) or asset))
+        pipeline.add(unittest.mock.MagicMock(side_effect=lambda asset: asset))
+        pipeline.branch('branch', branch_operator)
+
+        if executor is None:
+            with pytest.raises(OperatorTimeoutError):
+                pipeline.process_branches(Asset(io.BytesIO(b'abc')))
+        else:
+            results = pipeline.process_branches(Asset(io.BytesIO(b'abc')), executor=executor)
+            assert isinstance(results['branch'].__cause__, OperatorTimeoutError)
+        assert not branch_operator.called
+
+    @pytest.mark.parametrize('executor', [None, 'thread'])
+    def test_branches_stop_processing_asset_when_token_is_cancelled(self, executor):
+        token = CancellationToken()
+        branch_operator = unittest.mock.MagicMock(side_effect=lambda asset: asset)
+        pipeline = Pipeline()
+        pipeline.add(unittest.mock.MagicMock(side_effect=lambda asset: token.cancel() or asset))
+        pipeline.add(unittest.mock.MagicMock(side_effect=lambda asset: asset))
+        pipeline.branch('branch', branch_operator)
+
+        if executor is None:
+            with pytest.raises(OperatorCancelledError):
+                pipeline.process_branches(Asset(io.BytesIO(b'abc')), token=token)
+        else:
+            results = pipeline.process_branches(Asset(io.BytesIO(b'abc')), executor=executor, token=token)
+            assert isinstance(results['branch'].__cause__, OperatorCancelledError)
+        assert not branch_operator.called
@@ -1,9 +1,10 @@
 import io
 import pyexiv2
 import pytest
+from fractions import Fraction
 
 from assets import jpeg_asset
-from madam.core import UnsupportedFormatError
+from madam.core import Asset, GeoIndex, UnsupportedFormatError
 from madam.exiv2 import Exiv2MetadataProcessor
 
 
@@ -33,6 +34,23 @@ class TestExiv2MetadataProcessor:
         assert metadata['iptc']['caption'] == 'Foo bar'
         assert set(metadata.keys()) == {'exif', 'iptc'}
 
+    def test_read_gps_coordinates_are_indexed_in_decimal_degrees(self, processor, jpeg_asset, tmpdir):
+        file = tmpdir.join('asset_with_metadata.jpg')
+        file.write(jpeg_asset.essence.read(), 'wb')
+        metadata = pyexiv2.metadata.ImageMetadata(str(file))
+        metadata.read()
+        metadata['Exif.GPSInfo.GPSLatitude'] = [Fraction(33), Fraction(52), Fraction(4)]
+        metadata['Exif.GPSInfo.GPSLatitudeRef'] = 'S'
+        metadata['Exif.GPSInfo.GPSLongitude'] = [Fraction(151), Fraction(12), Fraction(26)]
+        metadata['Exif.GPSInfo.GPSLongitudeRef'] = 'E'
+        metadata.write()
+
+        metadata = processor.read(io.BytesIO(file.read('rb')))
+
+        latitude, longitude = GeoIndex().coordinates(Asset(io.BytesIO(b''), **metadata))
+        assert latitude == pytest.approx(-33.867778)
+        assert longitude == pytest.approx(151.207222)
+
     def test_read_ignores_unmapped_metadata(self, processor, jpeg_asset, tmpdir):
         file = tmpdir.join('asset_with_metadata.jpg')
         file.write(jpeg_asset.essence.read(), 'wb')
@@ -1,9 +1,12 @@
+import unittest.mock
+
 import PIL.Image
 import PIL.ImageChops
 import pytest
 
+import madam.core
 import madam.image
-from madam.core import OperatorError, UnsupportedFormatError
+from madam.core import OperatorError, UnsupportedFormatError, hamming_distance
 from assets import jpeg_asset, png_asset, gif_asset, image_asset, unknown_asset
 
 
@@ -166,3 +169,81 @@ class TestPillowProcessor:
 
         image = PIL.Image.open(converted_asset.essence)
         assert image.format == 'PNG'
+
+    def test_read_does_not_compute_perceptual_hashes(self, pillow_processor, image_asset):
+        asset = pillow_processor.read(image_asset.essence)
+
+        assert 'perceptual_hash' not in asset.metadata
+
+    def test_add_perceptual_hash_adds_hashes_to_metadata(self, pillow_processor, image_asset):
+        hash_operator = pillow_processor.add_perceptual_hash()
+
+        hashed_asset = hash_operator(image_asset)
+
+        assert set(hashed_asset.perceptual_hash.keys()) == {'ahash', 'dhash', 'phash'}
+        assert hashed_asset.essence.read() == image_asset.essence.read()
+        assert hashed_asset.mime_type == image_asset.mime_type
+
+    def test_pipeline_fuses_consecutive_operators(self, pillow_processor, jpeg_asset):
+        asset = jpeg_asset
+        pipeline = madam.core.Pipeline()
+        pipeline.add(pillow_processor.resize(width=12, height=10))
+        pipeline.add(pillow_processor.transpose())
+        pipeline.add(pillow_processor.flip(orientation=madam.image.FlipOrientation.HORIZONTAL))
+        pipeline.add(pillow_processor.convert(mime_type='image/png'))
+
+        with unittest.mock.patch('PIL.Image.open', wraps=PIL.Image.open) as open_mock:
+            processed_asset, = pipeline.process(asset)
+
+        assert open_mock.call_count == 1
+        assert processed_asset.mime_type == 'image/png'
+        assert (processed_asset.width, processed_asset.height) == (10, 12)
+
+    def test_fused_operators_have_same_effect_as_single_operators(self, pillow_processor, jpeg_asset):
+        asset = madam.core.Asset(jpeg_asset.essence, mime_type=jpeg_asset.mime_type, exif={'orientation': 6})
+        operators = [
+            pillow_processor.auto_orient(),
+            pillow_processor.resize(width=48, height=48, mode=madam.image.ResizeMode.FIT),
+            pillow_processor.flip(orientation=madam.image.FlipOrientation.VERTICAL),
+        ]
+        expected_asset = asset
+        for configured_operator in operators:
+            expected_asset = configured_operator(expected_asset)
+
+        fused_asset = pillow_processor.fuse(operators)(asset)
+
+        assert (fused_asset.width, fused_asset.height) == (expected_asset.width, expected_asset.height)
+        assert fused_asset.mime_type == expected_asset.mime_type
+        assert is_equal_in_black_white_space(PIL.Image.open(fused_asset.essence),
+                                             PIL.Image.open(expected_asset.essence))
+
+
+class TestPerceptualHashes:
+    @pytest.fixture
+    def image(self):
+        image = PIL.Image.new('L', (64, 48))
+        image.putdata([(x * y) % 256 for y in range(48) for x in range(64)])
+        return image
+
+    @pytest.mark.parametrize('method', ['ahash', 'dhash', 'phash'])
+    def test_hashes_of_resized_image_are_similar(self, image, method):
+        resized_image = image.resize((32, 24), resample=PIL.Image.LANCZOS)
+
+        hashes, resized_hashes = madam.image.perceptual_hashes([image, resized_image])
+
+        assert hamming_distance(hashes[method], resized_hashes[method]) <= 8
+
+    @pytest.mark.parametrize('method', ['ahash', 'dhash', 'phash'])
+    def test_hashes_of_different_images_are_not_similar(self, image, method):
+        different_image = image.transpose(PIL.Image.FLIP_LEFT_RIGHT).transpose(PIL.Image.FLIP_TOP_BOTTOM)
+
+        hashes, different_hashes = madam.image.perceptual_hashes([image, different_image])
+
+        assert hamming_distance(hashes[method], different_hashes[method]) > 8
+
+    def test_batch_hashes_are_identical_to_single_hashes(self, image):
+        other_image = image.rotate(90)
+
+        batch_hashes = madam.image.perceptual_hashes([image, other_image])
+
+        assert batch_hashes == madam.image.perceptual_hashes([image]) + madam.image.perceptual_hashes([other_image])
@@ -1,10 +1,18 @@
+import io
 import json
 import subprocess
+import tarfile
+import tempfile
+import threading
+import time
+import unittest.mock
 from collections import defaultdict
 
 import PIL.Image
 import pytest
 
+import madam.core
+import madam.ffmpeg
 import madam.video
 from madam.core import OperatorError, UnsupportedFormatError
 from madam.future import subprocess_run
@@ -190,6 +198,264 @@ class TestFFmpegProcessor:
         video_info = json.loads(result.stdout.decode('utf-8'))
         assert bool(video_info.get('format'))
 
+    def test_convert_uses_temporary_files_for_seekable_containers(self, processor, mkv_video_asset):
+        conversion_operator = processor.convert(mime_type='video/quicktime')
+
+        with unittest.mock.patch('tempfile.TemporaryDirectory', wraps=tempfile.TemporaryDirectory) as \
+                temporary_directory_mock:
+            converted_asset = conversion_operator(mkv_video_asset)
+
+        assert temporary_directory_mock.call_count == 1
+        command = 'ffprobe -print_format json -loglevel error -show_format -i pipe:'.split()
+        result = subprocess_run(command, input=converted_asset.essence.read(), stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, check=True)
+        assert json.loads(result.stdout.decode('utf-8'))['format']['format_name'].startswith('mov,')
+
+    @pytest.fixture(scope='class')
+    def segmentable_video_asset(self, processor, tmpdir_factory):
+        command = ('ffmpeg -loglevel error '
+                   '-f lavfi -i testsrc=size=48x32:rate=15:duration=2 -f lavfi -i sine=frequency=440:duration=2 '
+                   '-c:v libx264 -g 5 -c:a aac -f matroska').split()
+        tmpfile = tmpdir_factory.mktemp('segmentable_video_asset').join('h264-aac.mkv')
+        command.append(str(tmpfile))
+        subprocess_run(command, check=True, stderr=subprocess.PIPE)
+        with tmpfile.open('rb') as file:
+            return processor.read(io.BytesIO(file.read()))
+
+    def __count_frames_by_type(self, asset):
+        command = 'ffprobe -print_format json -loglevel error -show_streams -count_frames -i pipe:'.split()
+        result = subprocess_run(command, input=asset.essence.read(), stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, check=True)
+        ffprobe_info = json.loads(result.stdout.decode('utf-8'))
+        return {stream['codec_type']: int(stream['nb_read_frames']) for stream in ffprobe_info['streams']}
+
+    def test_segmented_convert_encodes_segments_separately(self, processor, segmentable_video_asset):
+        conversion_operator = processor.convert(mime_type='video/x-matroska', video=dict(codec='libvpx-vp9'),
+                                                audio=dict(codec='libopus'), segments=4)
+
+        with unittest.mock.patch('madam.ffmpeg.subprocess_run', wraps=madam.ffmpeg.subprocess_run) as run_mock:
+            converted_asset = conversion_operator(segmentable_video_asset)
+
+        assert run_mock.call_count >= 5
+        streams_by_type = self.__probe_streams_by_type(converted_asset)
+        assert streams_by_type['video'][0]['codec_name'] == 'vp9'
+        assert streams_by_type['audio'][0]['codec_name'] == 'opus'
+        assert converted_asset.duration == segmentable_video_asset.duration
+
+    def test_segmented_convert_keeps_all_frames(self, processor, segmentable_video_asset):
+        conversion_operator = processor.convert(mime_type='video/quicktime', video=dict(codec='libx264'),
+                                                segments=4)
+
+        converted_asset = conversion_operator(segmentable_video_asset)
+
+        source_frames = self.__count_frames_by_type(segmentable_video_asset)
+        assert self.__count_frames_by_type(converted_asset)['video'] == source_frames['video']
+
+    def test_segmented_convert_can_strip_audio_stream(self, processor, segmentable_video_asset):
+        conversion_operator = processor.convert(mime_type='video/x-matroska', audio=dict(codec=None), segments=2)
+
+        converted_asset = conversion_operator(segmentable_video_asset)
+
+        streams_by_type = self.__probe_streams_by_type(converted_asset)
+        assert streams_by_type.get('video')
+        assert not streams_by_type.get('audio')
+
+    def test_segmented_convert_is_not_fused(self, processor, segmentable_video_asset):
+        operators = [processor.resize(width=24, height=16), processor.convert(mime_type='video/x-matroska',
+                                                                              segments=2)]
+
+        assert processor.fuse(operators) is None
+
+    @pytest.mark.parametrize('protocol, manifest', [('hls', 'master.m3u8'), ('dash', 'manifest.mpd')])
+    def test_package_creates_renditions_with_single_ffmpeg_invocation(self, processor, segmentable_video_asset,
+                                                                      protocol, manifest):
+        package_operator = processor.package(renditions=[dict(width=48, height=32, video=dict(bitrate=200)),
+                                                         dict(width=24, height=16, audio=dict(bitrate=64))],
+                                             protocol=protocol, segment_duration=1)
+
+        with unittest.mock.patch('madam.ffmpeg.subprocess_run', wraps=madam.ffmpeg.subprocess_run) as run_mock:
+            package_asset = package_operator(segmentable_video_asset)
+
+        ffmpeg_commands = [call[0][0] for call in run_mock.call_args_list if call[0][0][0] == 'ffmpeg']
+        assert len(ffmpeg_commands) == 1
+        assert package_asset.mime_type == 'application/x-tar'
+        assert package_asset.manifest == manifest
+        with tarfile.open(fileobj=package_asset.essence) as archive:
+            assert archive.getnames() == list(package_asset.files)
+            manifest_text = archive.extractfile(manifest).read().decode('utf-8')
+        assert manifest in package_asset.files
+        if protocol == 'hls':
+            assert 'RESOLUTION=48x32' in manifest_text and 'RESOLUTION=24x16' in manifest_text
+        else:
+            assert 'width="48"' in manifest_text and 'width="24"' in manifest_text
+
+    def test_package_raises_error_for_unknown_protocol(self, processor, video_asset):
+        package_operator = processor.package(renditions=[dict(width=12, height=8)], protocol='rtmp')
+
+        with pytest.raises(ValueError):
+            package_operator(video_asset)
+
+    def test_package_raises_error_for_image_assets(self, processor, image_asset):
+        package_operator = processor.package(renditions=[dict(width=12, height=8)])
+
+        with pytest.raises(UnsupportedFormatError):
+            package_operator(image_asset)
+
+    def test_package_raises_error_for_ffmpeg_without_packaging_support(self, processor, video_asset):
+        package_operator = processor.package(renditions=[dict(width=12, height=8)])
+
+        with unittest.mock.patch.object(processor, '_ffmpeg_version', (4, 0, 2)):
+            with pytest.raises(UnsupportedFormatError):
+                package_operator(video_asset)
+
+    @pytest.mark.parametrize('version_string, version', [
+        ('4.4.2-0ubuntu0.22.04.1', (4, 4, 2)),
+        ('n6.0', (6, 0)),
+        ('6.0-static', (6, 0)),
+        ('N-112345-g0123456789', None),
+    ])
+    def test_parse_version_returns_numeric_components(self, version_string, version):
+        assert madam.ffmpeg._parse_version(version_string) == version
+
+    def test_convert_many_creates_all_outputs_with_single_ffmpeg_invocation(self, processor,
+                                                                           segmentable_video_asset):
+        outputs = [
+            dict(mime_type='video/x-matroska', width=24, height=16, video=dict(codec='libvpx-vp9')),
+            dict(mime_type='video/quicktime', video=dict(codec='libx264'), audio=dict(codec=None)),
+            dict(mime_type='audio/mpeg', audio=dict(bitrate=128)),
+        ]
+
+        with unittest.mock.patch('madam.ffmpeg.subprocess_run', wraps=madam.ffmpeg.subprocess_run) as run_mock:
+            converted_assets = processor.convert_many(segmentable_video_asset, outputs=outputs)
+
+        ffmpeg_commands = [call[0][0] for call in run_mock.call_args_list if call[0][0][0] == 'ffmpeg']
+        assert len(ffmpeg_commands) == 1
+        assert [asset.mime_type for asset in converted_assets] == ['video/x-matroska', 'video/quicktime',
+                                                                   'audio/mpeg']
+        assert (converted_assets[0].width, converted_assets[0].height) == (24, 16)
+        assert (converted_assets[1].width, converted_assets[1].height) == (48, 32)
+        streams_by_type = [self.__probe_streams_by_type(asset) for asset in converted_assets]
+        assert (streams_by_type[0]['video'][0]['width'], streams_by_type[0]['video'][0]['height']) == (24, 16)
+        assert streams_by_type[0]['audio']
+        assert streams_by_type[1]['video'][0]['codec_name'] == 'h264'
+        assert not streams_by_type[1].get('audio')
+        assert not streams_by_type[2].get('video')
+        assert streams_by_type[2]['audio'][0]['codec_name'] == 'mp3'
+
+    def test_convert_many_raises_error_without_outputs(self, processor, video_asset):
+        with pytest.raises(ValueError):
+            processor.convert_many(video_asset, outputs=[])
+
+    def test_convert_many_raises_error_for_unsupported_output_type(self, processor, video_asset):
+        with pytest.raises(UnsupportedFormatError):
+            processor.convert_many(video_asset, outputs=[dict(mime_type='image/png')])
+
+    def test_convert_many_raises_error_for_width_without_height(self, processor, video_asset):
+        with pytest.raises(ValueError):
+            processor.convert_many(video_asset, outputs=[dict(mime_type='video/x-matroska', width=24)])
+
+    def test_extract_frames_at_offsets_uses_single_ffmpeg_invocation(self, processor, segmentable_video_asset):
+        with unittest.mock.patch('madam.ffmpeg.subprocess_run', wraps=madam.ffmpeg.subprocess_run) as run_mock:
+            frame_assets = processor.extract_frames(segmentable_video_asset, mime_type='image/png',
+                                                    seconds=[0, 0.5, 1.5], width=24, height=16)
+
+        ffmpeg_commands = [call[0][0] for call in run_mock.call_args_list if call[0][0][0] == 'ffmpeg']
+        assert len(ffmpeg_commands) == 1
+        assert [asset.timestamp for asset in frame_assets] == pytest.approx([0, 0.5, 1.5], abs=0.1)
+        for frame_asset in frame_assets:
+            image = PIL.Image.open(frame_asset.essence)
+            assert image.format == 'PNG'
+            assert image.size == (frame_asset.width, frame_asset.height) == (24, 16)
+
+    def test_extract_frames_at_interval(self, processor, segmentable_video_asset):
+        frame_assets = processor.extract_frames(segmentable_video_asset, mime_type='image/jpeg', interval=0.5)
+
+        timestamps = [asset.timestamp for asset in frame_assets]
+        assert len(timestamps) == 4
+        assert all(later - earlier >= 0.5 for earlier, later in zip(timestamps, timestamps[1:]))
+        assert (frame_assets[0].width, frame_assets[0].height) == (48, 32)
+
+    def test_extract_frames_supports_special_characters_in_temporary_path(self, processor, segmentable_video_asset,
+                                                                          tmpdir):
+        temp_path = tmpdir.mkdir("a:b,c'd[e];f\\g")
+
+        with unittest.mock.patch('tempfile.tempdir', str(temp_path)):
+            frame_assets = processor.extract_frames(segmentable_video_asset, mime_type='image/png', seconds=[0.5])
+
+        assert [asset.timestamp for asset in frame_assets] == pytest.approx([0.5], abs=0.1)
+
+    @pytest.mark.parametrize('criteria', [{}, dict(seconds=[0], interval=1)])
+    def test_extract_frames_raises_error_unless_one_criterion_is_specified(self, processor, video_asset, criteria):
+        with pytest.raises(ValueError):
+            processor.extract_frames(video_asset, mime_type='image/png', **criteria)
+
+    def test_storyboard_tiles_thumbnails_into_sheets(self, processor, segmentable_video_asset):
+        sheets = processor.storyboard(segmentable_video_asset, mime_type='image/png', width=12, height=8,
+                                      columns=3, rows=2, interval=0.25)
+
+        assert [len(sheet.tiles) for sheet in sheets] == [6, 2]
+        assert len({hash(sheet) for sheet in sheets}) == 2
+        assert PIL.Image.open(sheets[1].essence).size == (sheets[1].width, sheets[1].height) == (36, 16)
+        assert [(tile['x'], tile['y']) for tile in sheets[0].tiles] == [(0, 0), (12, 0), (24, 0),
+                                                                       (0, 8), (12, 8), (24, 8)]
+
+    def test_storyboard_webvtt_contains_cue_for_each_thumbnail(self, processor, segmentable_video_asset):
+        sheets = processor.storyboard(segmentable_video_asset, mime_type='image/jpeg', width=12, height=8,
+                                      columns=2, rows=2, seconds=[0, 1])
+
+        webvtt = madam.ffmpeg.storyboard_webvtt(sheets, ['sheet.jpg'], duration=2)
+
+        lines = webvtt.splitlines()
+        assert lines[0] == 'WEBVTT'
+        assert 'sheet.jpg#xywh=0,0,12,8' in lines
+        assert 'sheet.jpg#xywh=12,0,12,8' in lines
+        assert lines[-2].endswith('--> 00:00:02.000')
+
+    def test_pipeline_fuses_operators_into_single_ffmpeg_invocation(self, processor, video_asset):
+        pipeline = madam.core.Pipeline()
+        pipeline.add(processor.trim(from_seconds=0.05))
+        pipeline.add(processor.resize(width=12, height=8))
+        pipeline.add(processor.convert(mime_type='video/x-matroska', video=dict(codec='vp9', bitrate=50),
+                                       audio=dict(codec=None)))
+
+        with unittest.mock.patch('madam.ffmpeg.subprocess_run', wraps=madam.ffmpeg.subprocess_run) as run_mock:
+            processed_asset, = pipeline.process(video_asset)
+
+        assert run_mock.call_count == 1
+        assert processed_asset.mime_type == 'video/x-matroska'
+        assert (processed_asset.width, processed_asset.height) == (12, 8)
+        assert processed_asset.duration == pytest.approx(video_asset.duration - 0.05)
+        streams_by_type = self.__probe_streams_by_type(processed_asset)
+        assert streams_by_type['video'][0]['codec_name'] == 'vp9'
+        assert (streams_by_type['video'][0]['width'], streams_by_type['video'][0]['height']) == (12, 8)
+        assert not streams_by_type.get('audio')
+
+    def test_fused_trims_copy_streams(self, processor, video_asset):
+        fused_operator = processor.fuse([processor.trim(from_seconds=0.05), processor.trim(to_seconds=0.1)])
+
+        trimmed_asset = fused_operator(video_asset)
+
+        assert trimmed_asset.mime_type == video_asset.mime_type
+        assert trimmed_asset.duration == pytest.approx(0.1)
+
+    def test_fused_trims_have_same_effect_as_single_trims(self, processor, segmentable_video_asset):
+        operators = [processor.trim(from_seconds=0.5, to_seconds=1.5), processor.trim(from_seconds=0.5, to_seconds=2)]
+        expected_asset = segmentable_video_asset
+        for configured_operator in operators:
+            expected_asset = configured_operator(expected_asset)
+
+        fused_asset = processor.fuse(operators)(segmentable_video_asset)
+
+        assert fused_asset.duration == expected_asset.duration == pytest.approx(0.5)
+        assert processor.read(fused_asset.essence).duration == \
+            pytest.approx(processor.read(expected_asset.essence).duration, abs=0.1)
+
+    def test_fused_trims_raise_error_for_start_after_end_of_previous_trim(self, processor, video_asset):
+        fused_operator = processor.fuse([processor.trim(to_seconds=0.1), processor.trim(from_seconds=0.15)])
+
+        with pytest.raises(ValueError):
+            fused_operator(video_asset)
+
     def test_extract_frame_asset_receives_correct_mime_type(self, processor, video_asset, image_asset):
         image_mime_type = image_asset.mime_type
         extract_frame_operator = processor.extract_frame(mime_type=image_mime_type)
@@ -210,6 +476,51 @@ class TestFFmpegProcessor:
         assert extracted_image.height > 0
         assert extracted_image.height == video_asset.height
 
+    def test_extract_frame_in_fast_mode_decodes_keyframes_only(self, processor, segmentable_video_asset):
+        extract_frame_operator = processor.extract_frame(mime_type='image/png', seconds=1.2, fast=True)
+
+        with unittest.mock.patch('madam.ffmpeg.subprocess_run', wraps=madam.ffmpeg.subprocess_run) as run_mock:
+            extracted_asset = extract_frame_operator(segmentable_video_asset)
+
+        command = run_mock.call_args[0][0]
+        assert command[command.index('-skip_frame') + 1] == 'nokey'
+        extracted_image = PIL.Image.open(extracted_asset.essence)
+        assert extracted_image.size == (segmentable_video_asset.width, segmentable_video_asset.height)
+
+    def test_extract_frame_in_fast_mode_returns_preceding_keyframe(self, processor, segmentable_video_asset):
+        def extract_pixels(seconds, fast):
+            extract_frame_operator = processor.extract_frame(mime_type='image/png', seconds=seconds, fast=fast)
+            return PIL.Image.open(extract_frame_operator(segmentable_video_asset).essence).tobytes()
+
+        fast_pixels = extract_pixels(1.2, fast=True)
+
+        # Keyframes are 5 frames apart at 15 frames per second
+        assert fast_pixels == extract_pixels(1.0, fast=False)
+        assert fast_pixels != extract_pixels(1.2, fast=False)
+
+    def test_extract_frame_in_fast_mode_reduces_resolution_while_decoding(self, processor, tmpdir):
+        video_path = str(tmpdir.join('mpeg4.mkv'))
+        subprocess_run(['ffmpeg', '-loglevel', 'error', '-f', 'lavfi', '-i', 'testsrc=size=96x64:rate=15:duration=1',
+                        '-c:v', 'mpeg4', '-f', 'matroska', video_path], check=True, stderr=subprocess.PIPE)
+        with open(video_path, 'rb') as video_file:
+            video_asset = processor.read(io.BytesIO(video_file.read()))
+        extract_frame_operator = processor.extract_frame(mime_type='image/png', fast=True, width=40, height=30)
+
+        with unittest.mock.patch('madam.ffmpeg.subprocess_run', wraps=madam.ffmpeg.subprocess_run) as run_mock:
+            extracted_asset = extract_frame_operator(video_asset)
+
+        command = run_mock.call_args[0][0]
+        assert command[command.index('-lowres') + 1] == '1'
+        assert PIL.Image.open(extracted_asset.essence).size == (40, 30)
+
+    def test_extract_frame_scales_frame(self, processor, video_asset):
+        extract_frame_operator = processor.extract_frame(mime_type='image/jpeg', fast=True, width=12, height=6)
+
+        extracted_asset = extract_frame_operator(video_asset)
+
+        assert PIL.Image.open(extracted_asset.essence).size == (extracted_asset.width, extracted_asset.height) == \
+            (12, 6)
+
     def test_extract_frame_raises_error_for_unknown_source_format(self, processor, unknown_asset, image_asset):
         image_mime_type = image_asset.mime_type
         extract_frame_operator = processor.extract_frame(mime_type=image_mime_type)
@@ -223,3 +534,238 @@ class TestFFmpegProcessor:
 
         with pytest.raises(UnsupportedFormatError):
             extract_frame_operator(video_asset)
+
+    def test_resize_uses_thread_share_of_scheduler(self, processor, video_asset):
+        resize_operator = processor.resize(width=12, height=8)
+        scheduler = madam.ffmpeg.FFmpegScheduler(max_processes=2, max_threads=6)
+
+        with unittest.mock.patch('madam.ffmpeg.scheduler', scheduler), \
+                unittest.mock.patch('madam.ffmpeg.subprocess_run', wraps=madam.ffmpeg.subprocess_run) as run_mock:
+            resize_operator(video_asset)
+
+        command = run_mock.call_args[0][0]
+        assert command[command.index('-threads') + 1] == '6'
+        assert command.index('-threads') > command.index('-i')
+
+
+class TestFFmpegScheduler:
+    def test_limits_number_of_concurrent_processes(self):
+        scheduler = madam.ffmpeg.FFmpegScheduler(max_processes=2)
+        running_counts = []
+
+        def run_job():
+            with scheduler.slot():
+                running_counts.append(scheduler.running)
+                time.sleep(0.02)
+        jobs = [threading.Thread(target=run_job) for _ in range(6)]
+        for job in jobs:
+            job.start()
+        for job in jobs:
+            job.join()
+
+        assert len(running_counts) == 6
+        assert max(running_counts) <= 2
+
+    def test_divides_thread_budget_among_running_processes(self):
+        scheduler = madam.ffmpeg.FFmpegScheduler(max_processes=4, max_threads=8)
+
+        with scheduler.slot() as first_threads:
+            with scheduler.slot() as second_threads:
+                pass
+
+        assert first_threads == 8
+        assert second_threads == 4
+
+    def test_starts_waiting_processes_by_priority(self):
+        scheduler = madam.ffmpeg.FFmpegScheduler(max_processes=1)
+        started_priorities = []
+
+        def run_job(priority):
+            with scheduler.slot(priority=priority):
+                started_priorities.append(priority)
+        with scheduler.slot():
+            jobs = []
+            for priority in (3, 1, 2):
+                job = threading.Thread(target=run_job, args=(priority,))
+                job.start()
+                jobs.append(job)
+                while scheduler.waiting < len(jobs):
+                    time.sleep(0.001)
+        for job in jobs:
+            job.join()
+
+        assert started_priorities == [1, 2, 3]
+
+    def test_priority_context_applies_to_slots_of_current_thread(self):
+        scheduler = madam.ffmpeg.FFmpegScheduler(max_processes=1)
+        started_priorities = []
+
+        def run_job(priority):
+            with scheduler.priority(priority):
+                with scheduler.slot():
+                    started_priorities.append(priority)
+        with scheduler.slot():
+            jobs = []
+            for priority in (2, -1):
+                job = threading.Thread(target=run_job, args=(priority,))
+                job.start()
+                jobs.append(job)
+                while scheduler.waiting < len(jobs):
+                    time.sleep(0.001)
+        for job in jobs:
+            job.join()
+
+        assert started_priorities == [-1, 2]
+
+    def test_propagated_priority_applies_to_slots_of_other_threads(self):
+        scheduler = madam.ffmpeg.FFmpegScheduler(max_processes=1)
+        started_priorities = []
+
+        def run_job(priority):
+            with scheduler.slot():
+                started_priorities.append(priority)
+        with scheduler.slot():
+            jobs = []
+            for priority in (2, -1):
+                with scheduler.priority(priority):
+                    job = threading.Thread(target=scheduler.propagate_priority(run_job), args=(priority,))
+                job.start()
+                jobs.append(job)
+                while scheduler.waiting < len(jobs):
+                    time.sleep(0.001)
+        for job in jobs:
+            job.join()
+
+        assert started_priorities == [-1, 2]
+
+    def test_configure_raises_error_for_invalid_limits(self):
+        scheduler = madam.ffmpeg.FFmpegScheduler()
+
+        with pytest.raises(ValueError):
+            scheduler.configure(max_processes=0)
+
+
+class TestFFmpegDeadlines:
+    def test_run_kills_command_after_deadline(self):
+        start_time = time.monotonic()
+
+        with madam.core.deadline(timeout=0.1):
+            with pytest.raises(madam.core.OperatorTimeoutError):
+                madam.ffmpeg._run(['sleep', '10'])
+
+        assert time.monotonic() - start_time < 5
+
+    def test_run_kills_command_when_token_is_cancelled(self):
+        token = madam.core.CancellationToken()
+        threading.Timer(0.1, token.cancel).start()
+        start_time = time.monotonic()
+
+        with madam.core.deadline(token=token):
+            with pytest.raises(madam.core.OperatorCancelledError):
+                madam.ffmpeg._run(['sleep', '10'])
+
+        assert time.monotonic() - start_time < 5
+
+    def test_run_writes_input_larger_than_pipe_buffer(self):
+        data = b'x' * 1024**2
+
+        with madam.core.deadline(timeout=10):
+            result = madam.ffmpeg._run(['sh', '-c', 'sleep 0.2; cat'], input=data, stdout=subprocess.PIPE)
+
+        assert result.stdout == data
+
+    def test_waiting_for_scheduler_ends_at_deadline(self):
+        scheduler = madam.ffmpeg.FFmpegScheduler(max_processes=1)
+
+        with scheduler.slot():
+            with madam.core.deadline(timeout=0.05):
+                with pytest.raises(madam.core.OperatorTimeoutError):
+                    with scheduler.slot():
+                        pass
+
+        assert scheduler.waiting == 0
+
+
+class TestProbeCache:
+    @pytest.fixture
+    def probe_cache(self):
+        probe_cache = madam.ffmpeg.ProbeCache()
+        with unittest.mock.patch('madam.ffmpeg.probe_cache', probe_cache):
+            yield probe_cache
+
+    def test_probe_runs_ffprobe_once_for_same_data(self, probe_cache, video_asset):
+        madam.ffmpeg._ffprobe_version()
+
+        with unittest.mock.patch('madam.ffmpeg.subprocess_run', wraps=madam.ffmpeg.subprocess_run) as run_mock:
+            probe_data = madam.ffmpeg._probe(video_asset.essence)
+            cached_probe_data = madam.ffmpeg._probe(video_asset.essence)
+
+        assert run_mock.call_count == 1
+        assert cached_probe_data == probe_data
+        assert (probe_cache.hits, probe_cache.misses) == (1, 1)
+        assert probe_cache.hit_rate == 0.5
+
+    def test_get_returns_independent_copies(self, probe_cache):
+        probe_cache.put('key', {'format': {'tags': {}}})
+
+        probe_cache.get('key')['format']['tags']['title'] = 'Title'
+
+        assert probe_cache.get('key') == {'format': {'tags': {}}}
+
+    def test_evicts_least_recently_used_results(self):
+        probe_cache = madam.ffmpeg.ProbeCache(max_entries=2)
+        probe_cache.put('a', {})
+        probe_cache.put('b', {})
+        probe_cache.get('a')
+
+        probe_cache.put('c', {})
+
+        assert probe_cache.get('b') is None
+        assert probe_cache.get('a') == {}
+
+    def test_results_on_disk_are_shared_between_caches(self, tmpdir):
+        path = str(tmpdir.join('probe_cache'))
+        madam.ffmpeg.ProbeCache(path=path).put('key', {'streams': []})
+        probe_cache = madam.ffmpeg.ProbeCache(path=path)
+
+        probe_data = probe_cache.get('key')
+
+        assert probe_data == {'streams': []}
+        assert probe_cache.disk_hits == 1
+
+    def test_caches_writing_to_same_path_keep_all_results(self, tmpdir):
+        path = str(tmpdir.join('probe_cache'))
+
+        def put_results(name):
+            probe_cache = madam.ffmpeg.ProbeCache(path=path)
+            for index in range(100):
+                probe_cache.put('%s%d' % (name, index), {'index': index})
+        threads = [threading.Thread(target=put_results, args=(name,)) for name in 'ab']
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        probe_cache = madam.ffmpeg.ProbeCache(path=path)
+
+        for name in 'ab':
+            for index in range(100):
+                assert probe_cache.get('%s%d' % (name, index)) == {'index': index}
+        assert probe_cache.disk_hits == 200
+
+    def test_database_is_skipped_while_it_is_locked(self, tmpdir):
+        path = str(tmpdir.join('probe_cache'))
+        madam.ffmpeg.ProbeCache(path=path).put('key', {'streams': []})
+        probe_cache = madam.ffmpeg.ProbeCache(path=path, lock_timeout=0)
+
+        with madam.core._file_lock(probe_cache.lock_path):
+            probe_data = probe_cache.get('key')
+
+        assert probe_data is None
+        assert probe_cache.disk_hits == 0
+
+    def test_key_depends_on_data_and_version(self):
+        key = madam.ffmpeg.ProbeCache.key(b'data', '4.0')
+
+        assert key == madam.ffmpeg.ProbeCache.key(b'data', '4.0')
+        assert key != madam.ffmpeg.ProbeCache.key(b'other data', '4.0')
+        assert key != madam.ffmpeg.ProbeCache.key(b'data', '4.1')